@@ -0,0 +1,51 @@
+"""_Compare per-row commits with `ospo_db_tools.batch()`._
+
+Inserts the same number of repositories and sources with the helpers committing
+every row, and again inside a single `batch()` with a `record()` savepoint per
+repository, then reports commits and rows per second for both.
+
+    python benchmarks/bench_commits.py --rows 5000
+"""
+
+import time
+import argparse
+import gddospo.ospo_db_tools as gdo
+from benchdb import bench_connection
+
+
+def insert_rows(conn, urls):
+    for url in urls:
+        repositoryid = gdo.insert_repository_db(conn, url, verbose = False, crawl = False)
+        gdo.add_repository_source(conn, repositoryid, 'Bulk Submision OSPO')
+
+
+def insert_rows_batched(conn, urls):
+    with gdo.batch(conn):
+        for url in urls:
+            with gdo.record(conn):
+                repositoryid = gdo.insert_repository_db(conn, url, verbose = False, crawl = False)
+                gdo.add_repository_source(conn, repositoryid, 'Bulk Submision OSPO')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--rows', type = int, default = 5000)
+    args = parser.parse_args()
+    with bench_connection() as conn:
+        urls = [f'https://github.com/bench/standalone{i}' for i in range(args.rows)]
+        start = time.perf_counter()
+        insert_rows(conn, urls)
+        standalone = time.perf_counter() - start
+        urls = [f'https://github.com/bench/batched{i}' for i in range(args.rows)]
+        start = time.perf_counter()
+        insert_rows_batched(conn, urls)
+        batched = time.perf_counter() - start
+    # Two helpers per row, each committing on its own.
+    print(f"standalone: {args.rows} rows in {standalone:.2f}s, "
+          f"{2 * args.rows / standalone:.0f} commits/s, {args.rows / standalone:.0f} rows/s")
+    print(f"batched:    {args.rows} rows in {batched:.2f}s, "
+          f"1 commit, {args.rows / batched:.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""_Latest-crawl query times before and after partitioning `repositorycrawls`._
+
+Fills the throwaway database with `--repos` repositories crawled every two weeks
+for `--years` years, then times `check_last_crawl()` and `plan_repo_crawls()`
+(and the aggregate forms they replaced) three times: on the plain table, after
+`partition_crawls()`, and after `downsample_crawls()`. While the table is being
+partitioned a second connection keeps inserting crawls, and the benchmark checks
+that none are lost. Each crawl references a README blob that changes every four
+weeks, so `prune_crawl_blobs()` has the blobs of the dropped crawls to delete.
+
+    python benchmarks/bench_partitions.py --repos 5000 --years 3
+"""
+
+import time
+import random
+import argparse
+import threading
+import psycopg2
+import gddospo.ospo_db_tools as gdo
+import gddospo.ospo_crawl_tools as gdc
+import gddospo.ospo_blob_tools as gdb
+import gddospo.ospo_partition_tools as gdp
+from benchdb import bench_connection
+
+# The queries as they were before partitioning, for comparison.
+MAX_LAST_CRAWL = """
+    SELECT rp.url, MAX(rpc.crawl_at)
+    FROM repositories AS rp
+    INNER JOIN repositorycrawls AS rpc ON rp.repositoryid = rpc.repositoryid
+    WHERE url = %s
+    GROUP BY rp.url;"""
+DISTINCT_PLAN = """
+    SELECT rp.repositoryid, rp.url, rp.ownerid
+    FROM repositories AS rp
+    LEFT JOIN (SELECT DISTINCT ON (repositoryid) repositoryid, crawl_at
+               FROM repositorycrawls
+               ORDER BY repositoryid, crawl_at DESC) AS lc ON lc.repositoryid = rp.repositoryid
+    WHERE rp.url ILIKE '%%github.com%%'
+      AND (lc.crawl_at < LOCALTIMESTAMP - '2 week'::interval OR lc.crawl_at IS NULL)
+    ORDER BY lc.crawl_at ASC NULLS FIRST;"""
+
+
+def fill_crawls(conn, repos, years):
+    gdb.create_blob_tables(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO repositories (url)
+            SELECT 'https://github.com/bench/repo' || i FROM generate_series(1, %s) AS i;""", (repos,))
+        # A new README every other crawl, stored uncompressed.
+        cur.execute("""
+            INSERT INTO crawlblobs (blobhash, codec, size, payload)
+            SELECT sha256(readme), 'none', length(readme), readme
+            FROM (SELECT DISTINCT convert_to('# repo' || rp.repositoryid || ' version ' || g / 2, 'UTF8') AS readme
+                  FROM repositories AS rp
+                  CROSS JOIN generate_series(0, %s * 365 / 14 - 1) AS g) AS readmes;""", (years,))
+        # Each repository is crawled every 14 days from a random start, with slowly growing counts.
+        cur.execute("""
+            INSERT INTO repositorycrawls (repositoryid, crawl_at, name, stargazers, forks, issues, openissues,
+                                          readmehash)
+            SELECT rp.repositoryid, ts, 'repo', n, n / 3, n / 5, n / 5,
+                   sha256(convert_to('# repo' || rp.repositoryid || ' version ' || n / 2, 'UTF8'))
+            FROM repositories AS rp
+            CROSS JOIN LATERAL (SELECT LOCALTIMESTAMP - make_interval(days => %s * 365)
+                                       + make_interval(days => (rp.repositoryid %% 14) + 14 * g) AS ts,
+                                       g AS n
+                                FROM generate_series(0, %s * 365 / 14 - 1) AS g) AS crawls;""",
+                    (years, years))
+        cur.execute("SELECT COUNT(*) FROM repositorycrawls;")
+        count = cur.fetchone()[0]
+    conn.commit()
+    gdc.create_crawl_indexes(conn)
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE repositories; ANALYZE repositorycrawls;")
+    conn.commit()
+    return count
+
+
+def timed(func, repeat = 3):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(conn, label, urls):
+    def last_crawls(query):
+        with conn.cursor() as cur:
+            for url in urls:
+                cur.execute(query, (url,))
+                cur.fetchone()
+        conn.rollback()
+
+    def distinct_plan():
+        with conn.cursor() as cur:
+            cur.execute(DISTINCT_PLAN)
+            cur.fetchall()
+        conn.rollback()
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM repositorycrawls;")
+        crawls = cur.fetchone()[0]
+    conn.rollback()
+    results = {'check_last_crawl (MAX)': timed(lambda: last_crawls(MAX_LAST_CRAWL)) / len(urls),
+               'check_last_crawl': timed(lambda: [gdo.check_last_crawl(conn, i) for i in urls]) / len(urls),
+               'plan_repo_crawls (DISTINCT ON)': timed(distinct_plan),
+               'plan_repo_crawls': timed(lambda: gdc.plan_repo_crawls(conn))}
+    print(f"{label} ({crawls} crawls)")
+    for name, seconds in results.items():
+        print(f"  {name:<32} {seconds * 1000:9.2f} ms")
+    return results
+
+
+def keep_crawling(conn_kwargs, schema, stop, written):
+    """Insert a crawl every few milliseconds until `stop` is set, as the crawlers would."""
+    conn = psycopg2.connect(**conn_kwargs)
+    with conn.cursor() as cur:
+        cur.execute(f"SET search_path TO {schema};")
+    while not stop.is_set():
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""INSERT INTO repositorycrawls (repositoryid, crawl_at, name, stargazers)
+                               VALUES (%s, LOCALTIMESTAMP, 'live', 1);""", (random.randint(1, 100),))
+            conn.commit()
+            written.append(1)
+        except psycopg2.Error:
+            conn.rollback()
+        time.sleep(0.002)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--repos', type = int, default = 5000)
+    parser.add_argument('--years', type = int, default = 3)
+    parser.add_argument('--lookups', type = int, default = 200)
+    args = parser.parse_args()
+    with bench_connection() as conn:
+        total = fill_crawls(conn, args.repos, args.years)
+        urls = [f'https://github.com/bench/repo{random.randint(1, args.repos)}' for _ in range(args.lookups)]
+        measure(conn, 'unpartitioned', urls)
+
+        stop = threading.Event()
+        written = []
+        conn_kwargs = conn.get_dsn_parameters()
+        conn_kwargs.pop('tty', None)
+        conn_kwargs.pop('options', None)
+        conn_kwargs = {k: v for k, v in conn_kwargs.items()
+                       if k in ['host', 'port', 'dbname', 'user', 'sslmode']}
+        writer = threading.Thread(target = keep_crawling, args = (conn_kwargs, 'ospo_bench', stop, written))
+        writer.start()
+        begin = time.perf_counter()
+        summary = gdp.partition_crawls(conn, verbose = False)
+        elapsed = time.perf_counter() - begin
+        stop.set()
+        writer.join()
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM repositorycrawls;")
+            partitioned = cur.fetchone()[0]
+            cur.execute("ANALYZE repositorycrawls;")
+        conn.commit()
+        print(f"partition_crawls: {summary['copied']} crawls into {summary['partitions']} partitions "
+              f"in {elapsed:.1f}s, with {len(written)} crawls written meanwhile; "
+              f"{partitioned} of {total + len(written)} crawls present.")
+        measure(conn, 'partitioned', urls)
+
+        summary = gdp.downsample_crawls(conn, keep_months = 6, verbose = False)
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE repositorycrawls;")
+        conn.commit()
+        print(f"downsample_crawls: {summary['partitions']} months, {summary['before']} crawls to {summary['after']}.")
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM crawlblobs;")
+            blobs = cur.fetchone()[0]
+        conn.commit()
+        print(f"prune_crawl_blobs: {gdp.prune_crawl_blobs(conn)} of {blobs} blobs deleted.")
+        measure(conn, 'partitioned and downsampled', urls)
+
+
+if __name__ == '__main__':
+    main()
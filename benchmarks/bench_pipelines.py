@@ -0,0 +1,180 @@
+"""_Offline throughput benchmark for the ingestion pipelines._
+
+Each pipeline runs against the throwaway database from `benchdb.py`, with every
+call to GitHub, CrossRef, xDD and DataCite answered by the local stub server in
+`stubserver.py` from the recorded responses in `fixtures/`. For each pipeline it
+reports records per second, database round-trips per record and API calls per
+record (by host).
+
+    python benchmarks/bench_pipelines.py --records 20 --latency 0.05
+    python benchmarks/bench_pipelines.py --pipelines gdd crawl_graphql --json results.json
+
+Add `--latency` to mimic network round-trips; without it the numbers show the
+client-side cost of each pipeline.
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+import tempfile
+import gddospo.ospo_db_tools as gdo
+import gddospo.gdd_tools as gdt
+import gddospo.ospo_crawl_tools as gdc
+import gddospo.ospo_async_tools as gda
+import gddospo.ospo_metrics_tools as gdm
+import gddospo.ospo_datacite_tools as gddc
+import gddospo.ospo_queue_tools as gdq
+import gddospo.ospo_blob_tools as gdb
+import gddospo.ospo_timeseries_tools as gdts
+import gddospo.ospo_stargazer_tools as gdsg
+from benchdb import bench_connection
+from stubserver import StubServer, redirect_hosts
+
+
+def pipeline_add_repo(conn, stub, records):
+    """`add_repo_db()` for new repositories: URL check, insert, owner and REST crawl."""
+    for i in range(records):
+        gdo.add_repo_db(conn, f'https://github.com/addowner{i}/neotoma2', 'Bulk Submision OSPO')
+    return records
+
+
+def pipeline_crawl_rest(conn, stub, records):
+    """`update_repo_crawl_db()` for repositories already in the database (PyGithub)."""
+    urls = [f'https://github.com/restowner{i}/neotoma2' for i in range(records)]
+    repos = gdo.bulk_add_repos(conn, urls, 'Bulk Submision OSPO')
+    gdm.METRICS.reset()
+    stub.reset_counts()
+    for url, repositoryid in repos.items():
+        gdo.update_repo_crawl_db(conn, url, repository_id = repositoryid)
+    return records
+
+
+def pipeline_crawl_graphql(conn, stub, records):
+    """Batched GraphQL crawl with `crawl_repositories()` for repositories already in the database."""
+    urls = [f'https://github.com/gqlowner{i}/neotoma2' for i in range(records)]
+    repos = gdo.bulk_add_repos(conn, urls, 'Bulk Submision OSPO')
+    gdm.METRICS.reset()
+    stub.reset_counts()
+    gda.crawl_repositories(conn, [(v, k) for k, v in repos.items()], batch_size = 50, workers = 4)
+    return records
+
+
+def pipeline_crawl_queue(conn, stub, records):
+    """Crawl jobs queued for repositories already in the database, drained by one worker."""
+    urls = [f'https://github.com/queueowner{i}/neotoma2' for i in range(records)]
+    repos = gdo.bulk_add_repos(conn, urls, 'Bulk Submision OSPO')
+    gdq.enqueue_repositories(conn, [(v, k) for k, v in repos.items()])
+    gdm.METRICS.reset()
+    stub.reset_counts()
+    gdq.run_worker(conn, jobtypes = ['crawl'], batch_size = 50, verbose = False)
+    return records
+
+
+def pipeline_owners(conn, stub, records):
+    """`resolve_repo_owners()` for repositories already in the database, two repositories per owner."""
+    urls = [f'https://github.com/ownerowner{i // 2}/repo{i}' for i in range(records)]
+    repos = gdo.bulk_add_repos(conn, urls, 'Bulk Submision OSPO')
+    gdm.METRICS.reset()
+    stub.reset_counts()
+    gdc.resolve_repo_owners(conn, [(v, k) for k, v in repos.items()], verbose = False)
+    return records
+
+
+def pipeline_stargazers(conn, stub, records):
+    """A second `update_stargazers()` run, after each repository gained five stars, one record per repository."""
+    urls = [f'https://github.com/starowner{i}/neotoma2' for i in range(records)]
+    with tempfile.TemporaryDirectory() as path:
+        store = gdts.TimeSeriesStore(path)
+        checkpoints = gdsg.StarCheckpoints()
+        gdsg.update_stargazers(store, urls, checkpoints, verbose = False)
+        for i in range(records):
+            stub.stars[f'starowner{i}/neotoma2'] = stub.stars_per_repo + 5
+        gdm.METRICS.reset()
+        stub.reset_counts()
+        gdsg.update_stargazers(store, urls, checkpoints, verbose = False)
+    return records
+
+
+def pipeline_gdd(conn, stub, records):
+    """The xDD snippet harvest from `githubdeepdive_scrape.py`, one record per paper."""
+    papers = 0
+    for page in gdt.harvest_snippets(gdt.GDD_SNIPPETS):
+        data = page['data']
+        known = gdo.check_publications_db(conn, [i['doi'] for i in data])
+        for paper, repohit in zip(data, gdt.extract_page_repositories(data)):
+            papers = papers + 1
+            if paper['doi'] not in known and any(repohit):
+                gdo.process_gdd_hit(conn, paper['doi'], paper['highlight'], matches = repohit)
+    return papers
+
+
+def pipeline_datacite(conn, stub, records):
+    """The Zenodo software harvest from `datacite_scrape.py`, one record per DOI."""
+    return gddc.harvest_datacite(conn, verbose = False)['records']
+
+
+PIPELINES = {'add_repo': pipeline_add_repo,
+             'crawl_rest': pipeline_crawl_rest,
+             'crawl_graphql': pipeline_crawl_graphql,
+             'crawl_queue': pipeline_crawl_queue,
+             'owners': pipeline_owners,
+             'stargazers': pipeline_stargazers,
+             'gdd': pipeline_gdd,
+             'datacite': pipeline_datacite}
+
+
+def run_pipeline(name, conn, stub, records):
+    gdm.enable()
+    stub.reset_counts()
+    start = time.perf_counter()
+    count = PIPELINES[name](conn, stub, records)
+    elapsed = time.perf_counter() - start
+    calls = dict(stub.calls)
+    roundtrips = gdm.METRICS.counters.get('db.roundtrips', 0)
+    gdm.disable()
+    return {'pipeline': name,
+            'records': count,
+            'seconds': elapsed,
+            'records_per_second': count / elapsed if elapsed > 0 else None,
+            'db_roundtrips_per_record': roundtrips / count if count else None,
+            'api_calls_per_record': sum(calls.values()) / count if count else None,
+            'api_calls': calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--records', type = int, default = 20)
+    parser.add_argument('--latency', type = float, default = 0.0)
+    parser.add_argument('--pipelines', nargs = '+', default = list(PIPELINES.keys()),
+                        choices = list(PIPELINES.keys()))
+    parser.add_argument('--json', default = None)
+    args = parser.parse_args()
+    # Requests never leave the machine, but the helpers insist on a token.
+    os.environ['GITHUB_TOKEN'] = 'benchmark-token'
+    per_page = min(args.records, 100)
+    stub = StubServer(pages = math.ceil(args.records / per_page), per_page = per_page,
+                      latency = args.latency).start()
+    results = []
+    try:
+        with redirect_hosts(stub), bench_connection() as conn:
+            conn.cursor_factory = gdm.CountingCursor
+            gdq.create_queue_tables(conn)
+            gdb.create_blob_tables(conn)
+            for name in args.pipelines:
+                result = run_pipeline(name, conn, stub, args.records)
+                results.append(result)
+                print(f"{name:<14} {result['records']:>6} records {result['seconds']:8.2f}s "
+                      f"{result['records_per_second']:9.1f} records/s "
+                      f"{result['db_roundtrips_per_record']:7.1f} db round-trips/record "
+                      f"{result['api_calls_per_record']:6.1f} api calls/record")
+    finally:
+        stub.stop()
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
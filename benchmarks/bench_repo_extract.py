@@ -0,0 +1,65 @@
+"""_Benchmark repository URL extraction over a synthetic highlight corpus._
+
+Compares the original per-highlight `re.search`/`re.sub` extractor with the
+precompiled `gdd_tools.extract_repositories()` and the single pass
+`gdd_tools.extract_repositories_batch()`.
+
+    python benchmarks/bench_repo_extract.py --highlights 200000
+"""
+
+import re
+import time
+import random
+import argparse
+import gddospo.gdd_tools as gdt
+
+WORDS = ['sediment', 'pollen', 'model', 'data', 'were', 'analysed', 'using', 'the',
+         'software', 'available', 'at', 'core', 'records', 'climate', 'lake']
+HOSTS = ['github.com', 'gitlab.com', 'bitbucket.org', 'https://github.com']
+
+
+def original_repotest(string):
+    """The per-call extractor that `gdd_tools.repotest()` used to be."""
+    test = re.search(r'((github)|(gitlab)|(bitbucket)).com\/((\s{0,1})[\w,\-,\_]+\/*){1,2}', string)
+    if test is None:
+        return None
+    test_no_space = re.sub(r'\s', '', test[0])
+    return re.sub(r'[^\w\s]$', '', test_no_space)
+
+
+def synthetic_highlights(count, seed = 42):
+    rng = random.Random(seed)
+    highlights = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(20, 60))]
+        if rng.random() < 0.3:
+            repo = f"{rng.choice(HOSTS)}/user{rng.randint(0, 999)}/repo-{rng.randint(0, 9999)}"
+            if rng.random() < 0.2:
+                repo = repo.replace('repo-', 'repo-\n')
+            words.insert(rng.randint(0, len(words)), repo + rng.choice(['', '.', ')', ',']))
+        highlights.append(' '.join(words))
+    return highlights
+
+
+def timed(label, count, function):
+    start = time.perf_counter()
+    found = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed:7.3f}s  {count / elapsed:10.0f} highlights/s  {found} repositories")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--highlights', type = int, default = 200000)
+    args = parser.parse_args()
+    highlights = synthetic_highlights(args.highlights)
+    timed('original repotest', args.highlights,
+          lambda: sum([original_repotest(i) is not None for i in highlights]))
+    timed('extract_repositories', args.highlights,
+          lambda: sum([len(gdt.extract_repositories(i)) for i in highlights]))
+    timed('extract_repositories_batch', args.highlights,
+          lambda: sum([len(i) for i in gdt.extract_repositories_batch(highlights)]))
+
+
+if __name__ == '__main__':
+    main()
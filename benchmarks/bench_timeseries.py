@@ -0,0 +1,84 @@
+"""_Query times for the columnar star store in `ospo_timeseries_tools`._
+
+Builds a store of synthetic stars (spread over `--repos` repositories and ten
+years, a few repositories far more popular than the rest) in a temporary
+directory, optionally compacts it, then times the queries the dashboard needs:
+the top 100 repositories by 90-day star growth, over all repositories and over a
+subset, and the monthly trend of one repository.
+
+    python benchmarks/bench_timeseries.py --stars 5000000 --repos 50000
+"""
+
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import gddospo.ospo_timeseries_tools as gdts
+
+
+def synthetic_stars(stars, repos, appends, seed = 42):
+    """Yield `appends` tables of stars, each covering a slice of the ten years (as a crawler would)."""
+    start = datetime.datetime(2014, 1, 1)
+    span = 3650 * 86400 * 1000000
+    per_append = stars // appends
+    for i in range(appends):
+        # Cubing a uniform draw skews stars toward the low-numbered repositories.
+        popularity = pc.power(pc.random(per_append, initializer = seed + i), 3)
+        repo = pc.cast(pc.floor(pc.multiply(popularity, repos)), pa.int64())
+        offsets = pc.add(pc.cast(pc.floor(pc.multiply(pc.random(per_append, initializer = seed + appends + i),
+                                                      span // appends)), pa.int64()), span * i // appends)
+        ids = pa.array(range(i * per_append, (i + 1) * per_append), pa.int64())
+        yield pa.table({'id': pc.cast(ids, pa.string()),
+                        'repo_url': pc.binary_join_element_wise('https://github.com/bench/repo',
+                                                                pc.cast(repo, pa.string()), ''),
+                        'user': pc.binary_join_element_wise('user', pc.cast(pc.bit_wise_and(ids, 1048575),
+                                                                              pa.string()), ''),
+                        'starred_at': pc.add(pa.scalar(start, pa.timestamp('us')),
+                                             pc.cast(offsets, pa.duration('us')))})
+
+
+def timed(label, func, repeat = 3):
+    best = None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label}: {best * 1000:.0f} ms ({result.num_rows} rows)")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--stars', type = int, default = 5000000)
+    parser.add_argument('--repos', type = int, default = 50000)
+    parser.add_argument('--appends', type = int, default = 20)
+    parser.add_argument('--no-compact', action = 'store_true')
+    args = parser.parse_args()
+    path = tempfile.mkdtemp(prefix = 'ospo_timeseries_')
+    try:
+        store = gdts.TimeSeriesStore(path)
+        begin = time.perf_counter()
+        written = sum(store.append_stars(i) for i in synthetic_stars(args.stars, args.repos, args.appends))
+        print(f"append: {written} stars in {time.perf_counter() - begin:.1f}s")
+        if not args.no_compact:
+            begin = time.perf_counter()
+            months = store.compact()
+            print(f"compact: {len(months)} months in {time.perf_counter() - begin:.1f}s")
+        now = datetime.datetime(2023, 12, 1)
+        subset = [f'https://github.com/bench/repo{i}' for i in range(0, args.repos, 10)]
+        timed('top 100 by 90-day growth, all repositories',
+              lambda: store.star_growth(days = 90, now = now, top = 100))
+        timed(f'top 100 by 90-day growth, {len(subset)} repositories',
+              lambda: store.star_growth(days = 90, now = now, repos = subset, top = 100))
+        timed('monthly trend of one repository',
+              lambda: store.star_trend(repos = ['https://github.com/bench/repo0']))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
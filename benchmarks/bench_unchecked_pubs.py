@@ -0,0 +1,102 @@
+"""_Check the plan and speed of the unchecked-publication query used by `check_all_pubs()`._
+
+Seeds publications, marks a share of them as checked, then:
+
+- fails (exit code 1) unless EXPLAIN shows `UNCHECKED_QUERY` running as an
+  anti-join, rather than a per-row subplan;
+- times the old `NOT ... = ANY(subquery)` query against the anti-join;
+- streams the unchecked rows through `iter_unchecked_pubs()`.
+
+    python benchmarks/bench_unchecked_pubs.py --rows 100000 --checked 0.8
+
+The old query is only fast while its hashed subplan fits in `work_mem`; pass a
+small `--work-mem` (e.g. 64kB) to see it fall back to a per-row scan.
+"""
+
+import sys
+import json
+import time
+import argparse
+import gddospo.ospo_uw_tools as gdu
+from benchdb import bench_connection
+
+OLD_QUERY = """
+    SELECT doi
+    FROM publications AS pub
+    WHERE
+    NOT pub.publicationid = ANY(
+        (SELECT publicationid FROM uwpublications WHERE sourceid = %s));"""
+
+
+def seed(conn, rows, checked):
+    with conn.cursor() as cur:
+        cur.execute("SELECT sourceid FROM ospoimportsources WHERE sourcename = 'OpenAlex Search';")
+        sourceid = cur.fetchone()[0]
+        cur.execute("""INSERT INTO publications (doi)
+                       SELECT '10.5555/bench.' || i FROM generate_series(1, %s) AS i;""", (rows,))
+        cur.execute("""INSERT INTO uwpublications (publicationid, uwrelationid, sourceid, valid)
+                       SELECT publicationid, NULL, %s, FALSE
+                       FROM publications
+                       WHERE random() < %s;""", (sourceid, checked))
+        cur.execute("ANALYZE publications; ANALYZE uwpublications;")
+    conn.commit()
+    return sourceid
+
+
+def plan_nodes(plan):
+    node = plan.get('Node Type')
+    if plan.get('Join Type') is not None:
+        node = f"{plan.get('Join Type')} {node}"
+    yield node, plan.get('Subplan Name')
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def timed(conn, query, sourceid):
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(query, (sourceid,))
+        count = len(cur.fetchall())
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--rows', type = int, default = 100000)
+    parser.add_argument('--checked', type = float, default = 0.8)
+    parser.add_argument('--work-mem', default = None)
+    args = parser.parse_args()
+    with bench_connection() as conn:
+        sourceid = seed(conn, args.rows, args.checked)
+        if args.work_mem is not None:
+            with conn.cursor() as cur:
+                cur.execute("SET work_mem = %s;", (args.work_mem,))
+        gdu.create_uw_indexes(conn)
+        with conn.cursor() as cur:
+            cur.execute("EXPLAIN (FORMAT JSON) " + gdu.UNCHECKED_QUERY, (sourceid,))
+            plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = list(plan_nodes(plan[0]['Plan']))
+        anti_join = any(node.startswith('Anti') for node, _ in nodes)
+        subplan = any(name is not None for _, name in nodes)
+        print(f"plan: {' > '.join(node for node, _ in nodes)}")
+        new_time, new_count = timed(conn, gdu.UNCHECKED_QUERY, sourceid)
+        old_time, old_count = timed(conn, OLD_QUERY, sourceid)
+        print(f"NOT = ANY(subquery): {old_count} rows in {old_time:.2f}s")
+        print(f"NOT EXISTS:          {new_count} rows in {new_time:.2f}s")
+        start = time.perf_counter()
+        streamed = 0
+        largest = 0
+        for chunk in gdu.iter_unchecked_pubs(conn, sourceid, chunk_size = 1000):
+            streamed = streamed + len(chunk)
+            largest = max(largest, len(chunk))
+        print(f"iter_unchecked_pubs: {streamed} rows in {time.perf_counter() - start:.2f}s, "
+              f"at most {largest} rows in memory")
+    if not anti_join or subplan or streamed != new_count:
+        print("Regression: the unchecked-publication query no longer runs as an anti-join.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
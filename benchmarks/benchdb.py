@@ -0,0 +1,48 @@
+"""_Throwaway PostgreSQL schema for the benchmarks._
+
+Set `OSDB_BENCH_CONNECT` to a JSON connection string (the same format as
+`OSDB_CONNECT`) for a local database you are happy to write to. Each run creates
+a fresh `ospo_bench` schema, loads `schema.sql` into it and drops it afterwards.
+"""
+
+import os
+import json
+import contextlib
+import dotenv
+import psycopg2
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+@contextlib.contextmanager
+def bench_connection(schema = 'ospo_bench', keep = False):
+    """_Connect to the benchmark database with a freshly loaded schema._
+
+    Args:
+        schema (str, optional): _The throwaway schema name._ Defaults to 'ospo_bench'.
+        keep (bool, optional): _Leave the schema in place after the run?_ Defaults to False.
+
+    Yields:
+        _connection_: _A psycopg2 connection whose search_path is the throwaway schema._
+    """
+    dotenv.load_dotenv()
+    conn_string = os.getenv('OSDB_BENCH_CONNECT')
+    if conn_string is None:
+        raise TypeError("Set OSDB_BENCH_CONNECT to a JSON connection string for a throwaway database.")
+    conn = psycopg2.connect(**json.loads(conn_string), connect_timeout=5)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {schema};")
+        cur.execute(f"SET search_path TO {schema};")
+        with open(SCHEMA) as schema_file:
+            cur.execute(schema_file.read())
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        if not keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+            conn.commit()
+        conn.close()
@@ -0,0 +1,44 @@
+-- Minimal OSPO schema for the benchmarks, reconstructed from the queries in
+-- gddospo. It is loaded into a throwaway schema and is not the production DDL.
+CREATE TABLE repositorymanagers (managerid SERIAL PRIMARY KEY, managername TEXT UNIQUE);
+CREATE TABLE repositoryowners (ownerid SERIAL PRIMARY KEY, ownername TEXT, email TEXT,
+  isorganization BOOLEAN, biography TEXT, managerid INTEGER REFERENCES repositorymanagers(managerid),
+  UNIQUE (ownername, managerid));
+CREATE TABLE repositories (repositoryid SERIAL PRIMARY KEY, url TEXT UNIQUE NOT NULL,
+  ownerid INTEGER REFERENCES repositoryowners(ownerid), created_at TIMESTAMP);
+CREATE TABLE repositorycrawls (repositorycrawlid SERIAL PRIMARY KEY,
+  repositoryid INTEGER REFERENCES repositories(repositoryid), crawl_at TIMESTAMP,
+  name TEXT, description TEXT, homepage TEXT, last_pushed TIMESTAMP, license_name TEXT,
+  readme BYTEA, stargazers INTEGER, issues INTEGER, openissues INTEGER, forks INTEGER,
+  raw JSONB, language JSONB, topics JSONB);
+CREATE TABLE ospoimportsources (sourceid SERIAL PRIMARY KEY, sourcename TEXT UNIQUE);
+CREATE TABLE repositorysources (repositoryid INTEGER REFERENCES repositories(repositoryid),
+  sourceid INTEGER REFERENCES ospoimportsources(sourceid), PRIMARY KEY (repositoryid, sourceid));
+CREATE TABLE repoqualitychecks (repositoryid INTEGER REFERENCES repositories(repositoryid),
+  badstatus INTEGER, url TEXT, UNIQUE (repositoryid, badstatus));
+CREATE TABLE publications (publicationid SERIAL PRIMARY KEY, doi TEXT UNIQUE, title TEXT,
+  subtitle TEXT, author JSONB, subject TEXT[], abstract TEXT, containertitle TEXT, language TEXT,
+  published DATE, publisher TEXT, articleurl TEXT, crossrefmeta JSONB, dateadded TIMESTAMP);
+CREATE TABLE publicationimport (publicationid INTEGER REFERENCES publications(publicationid),
+  sourceid INTEGER REFERENCES ospoimportsources(sourceid), PRIMARY KEY (publicationid, sourceid));
+CREATE TABLE publicationlinks (publicationlinkid SERIAL PRIMARY KEY, publicationlinksource TEXT UNIQUE);
+CREATE TABLE publicationrepolinks (publicationlinkid INTEGER REFERENCES publicationlinks(publicationlinkid),
+  publicationid INTEGER REFERENCES publications(publicationid),
+  repositoryid INTEGER REFERENCES repositories(repositoryid),
+  PRIMARY KEY (publicationlinkid, publicationid, repositoryid));
+CREATE TABLE repositorypublications (repositoryid INTEGER REFERENCES repositories(repositoryid),
+  publicationid INTEGER REFERENCES publications(publicationid));
+CREATE TABLE uwrelations (uwrelationid SERIAL PRIMARY KEY, uwrelation TEXT UNIQUE);
+CREATE TABLE uwpublications (publicationid INTEGER REFERENCES publications(publicationid),
+  uwrelationid INTEGER REFERENCES uwrelations(uwrelationid),
+  sourceid INTEGER REFERENCES ospoimportsources(sourceid), valid BOOLEAN);
+CREATE TABLE uwrepositories (repositoryid INTEGER REFERENCES repositories(repositoryid),
+  uwrelationid INTEGER REFERENCES uwrelations(uwrelationid), PRIMARY KEY (repositoryid, uwrelationid));
+CREATE TABLE datacitepublication (doi TEXT PRIMARY KEY, datacitemeta JSONB, title TEXT,
+  description TEXT, repositoryid INTEGER REFERENCES repositories(repositoryid));
+INSERT INTO repositorymanagers (managername) VALUES ('GitHub');
+INSERT INTO ospoimportsources (sourcename) VALUES ('xDD Pipeline Submission'), ('DataCite Submission'),
+  ('Bulk Submision OSPO'), ('OpenAlex Search'), ('OSPO Survey');
+INSERT INTO publicationlinks (publicationlinksource) VALUES ('xDD API Scraper');
+INSERT INTO uwrelations (uwrelation) VALUES ('OSPO Survey'), ('UW Mention'), ('UW Organization'),
+  ('UW Person'), ('Keyword Search');
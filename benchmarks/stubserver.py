@@ -0,0 +1,273 @@
+"""_Local stub servers that replay recorded API responses for the benchmarks._
+
+`StubServer` serves the JSON fixtures in `fixtures/` for GitHub (REST and
+GraphQL), github.com, CrossRef, OpenAlex, xDD and DataCite. Responses are
+templated so every repository, DOI and page is distinct: `NeotomaDB/neotoma2` in
+a fixture is replaced by the requested owner and name, and so on.
+
+`redirect_hosts()` rewrites requests made through `requests` (and so through
+PyGithub, crossref, pyalex and pytacite) from the real hosts to the stub server,
+without any change to the code being measured.
+"""
+
+import os
+import json
+import base64
+import time
+import threading
+import contextlib
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from requests.adapters import HTTPAdapter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+HOSTS = ['api.github.com', 'github.com', 'api.crossref.org', 'geodeepdive.org',
+         'xdd.wisc.edu', 'api.datacite.org', 'api.openalex.org']
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as fixture:
+        return fixture.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body, status = 200, headers = None):
+        payload = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def route(self):
+        stub = self.server.stub
+        parsed = urllib.parse.urlsplit(self.path)
+        host, _, path = parsed.path.lstrip('/').partition('/')
+        path = '/' + urllib.parse.unquote(path)
+        query = urllib.parse.parse_qs(parsed.query)
+        stub.count(host)
+        if stub.latency > 0:
+            time.sleep(stub.latency)
+        if host == 'github.com':
+            return self.send_json('', headers = {'Content-Type': 'text/html'})
+        if host == 'api.github.com':
+            return self.github(path, query)
+        if host == 'api.crossref.org' and path.startswith('/works/'):
+            doi = path[len('/works/'):]
+            return self.send_json(stub.fixtures['crossref_work.json'].replace('10.5334/oq.41', doi))
+        if host in ['geodeepdive.org', 'xdd.wisc.edu']:
+            return self.send_json(stub.xdd_page(int(query.get('page', ['0'])[0])))
+        if host == 'api.openalex.org' and path.startswith('/works'):
+            return self.openalex(path, query)
+        if host == 'api.datacite.org' and path.startswith('/clients'):
+            return self.send_json(stub.fixtures['datacite_clients.json'])
+        if host == 'api.datacite.org' and path.startswith('/dois'):
+            cursor = query.get('page[cursor]', ['*'])[0]
+            return self.send_json(stub.datacite_page(0 if cursor == '*' else int(cursor)))
+        return self.send_json({'message': 'Not Found'}, status = 404)
+
+    def github(self, path, query):
+        stub = self.server.stub
+        parts = path.strip('/').split('/')
+        if parts[0] == 'graphql':
+            length = int(self.headers.get('Content-Length', 0))
+            variables = json.loads(self.rfile.read(length)).get('variables', {})
+            data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2030-01-01T00:00:00Z'}}
+            for key in [i for i in variables if i.startswith('o')]:
+                index = key[1:]
+                if 'p' + index in variables:
+                    # A README fetched by path, after the crawl found it in a folder listing.
+                    data['r' + index] = {'readme': {'text': stub.readme(variables[key], variables['n' + index])}}
+                    continue
+                data['r' + index] = json.loads(stub.template('github_graphql_repo.json',
+                                                             variables[key], variables['n' + index]))
+            return self.send_json({'data': data})
+        if parts[0] == 'users' and len(parts) == 2:
+            return self.send_json(stub.template('github_user.json', parts[1]))
+        if parts[0] == 'users' and len(parts) == 3 and parts[2] == 'repos':
+            repos = [json.loads(stub.template('github_repo.json', parts[1], f'repo{i}'))
+                     for i in range(stub.repos_per_owner)]
+            return self.send_json(repos)
+        if parts[0] == 'repos' and len(parts) == 4 and parts[3] == 'stargazers':
+            return self.send_json(stub.stargazer_page(parts[1], parts[2], int(query.get('page', ['1'])[0]),
+                                                      int(query.get('per_page', ['30'])[0])))
+        if parts[0] == 'repos' and len(parts) >= 3:
+            owner, name = parts[1], parts[2]
+            fixture = 'github_repo.json' if len(parts) == 3 else f'github_{parts[3]}.json'
+            if fixture not in stub.fixtures:
+                return self.send_json({'message': 'Not Found'}, status = 404)
+            headers = {'ETag': f'"{owner}-{name}"'}
+            if fixture == 'github_readme.json':
+                body = json.loads(stub.template(fixture, owner, name))
+                body['content'] = base64.b64encode(stub.readme(owner, name).encode('utf-8')).decode('ascii')
+                return self.send_json(body, headers = headers)
+            if fixture == 'github_issues.json' and query.get('per_page') == ['1']:
+                # Like GitHub, one issue per page, with the page count (open issues and
+                # pull requests) in the `last` link.
+                count = json.loads(stub.template('github_repo.json', owner, name))['open_issues_count']
+                headers['Link'] = f'<https://api.github.com/repos/{owner}/{name}/issues?per_page=1&page={count}>; rel="last"'
+            return self.send_json(stub.template(fixture, owner, name), headers = headers)
+        return self.send_json({'message': 'Not Found'}, status = 404)
+
+    def openalex(self, path, query):
+        # DOIs containing `unknown` are not in OpenAlex; those containing `elsewhere`
+        # get the work whose first author is not at the University of Wisconsin.
+        stub = self.server.stub
+        if path.startswith('/works/'):
+            work = stub.openalex_work(path[len('/works/'):])
+            if work is None:
+                return self.send_json({'error': 'Not Found'}, status = 404)
+            # A single work comes back whole, not just the selected fields.
+            return self.send_json({'id': 'https://openalex.org/W2799524357', **work})
+        dois = query.get('filter', [''])[0].partition('doi:')[2].split('|')
+        body = json.loads(stub.fixtures['openalex_works.json'])
+        body['results'] = [i for i in map(stub.openalex_work, dois) if i is not None]
+        body['meta']['count'] = len(body['results'])
+        return self.send_json(body)
+
+    def do_GET(self):
+        self.route()
+
+    def do_HEAD(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+
+class StubServer:
+    """_A threaded HTTP server replaying the fixtures, with call counts per host._"""
+
+    def __init__(self, pages = 1, per_page = 20, repos_per_owner = 2, stars_per_repo = 250, latency = 0.0):
+        """_Create (but do not start) a stub server._
+
+        Args:
+            pages (int, optional): _Pages served by the xDD and DataCite stubs._ Defaults to 1.
+            per_page (int, optional): _Records per xDD and DataCite page._ Defaults to 20.
+            repos_per_owner (int, optional): _Repositories listed for each GitHub owner._ Defaults to 2.
+            stars_per_repo (int, optional): _Stargazers of each repository, until changed in `stars`._ Defaults to 250.
+            latency (float, optional): _Seconds added to every response, to mimic the network._ Defaults to 0.0.
+        """
+        self.pages = pages
+        self.per_page = per_page
+        self.repos_per_owner = repos_per_owner
+        self.stars_per_repo = stars_per_repo
+        self.stars = {}
+        self.latency = latency
+        self.fixtures = {i: load_fixture(i) for i in os.listdir(FIXTURES) if i.endswith('.json')}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def count(self, host):
+        with self.lock:
+            self.calls[host] = self.calls.get(host, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls = {}
+
+    def template(self, fixture, owner, name = 'neotoma2'):
+        return self.fixtures[fixture].replace('NeotomaDB', owner).replace('neotoma2', name)
+
+    def readme(self, owner, name = 'neotoma2'):
+        content = json.loads(self.fixtures['github_readme.json'])['content']
+        text = base64.b64decode(content).decode('utf-8')
+        return text.replace('NeotomaDB', owner).replace('neotoma2', name)
+
+    def openalex_work(self, doi):
+        doi = doi.lower()
+        for prefix in ['https://doi.org/', 'doi:']:
+            if doi.startswith(prefix):
+                doi = doi[len(prefix):]
+        if 'unknown' in doi:
+            return None
+        work = json.loads(self.fixtures['openalex_works.json'])['results'][1 if 'elsewhere' in doi else 0]
+        work['doi'] = 'https://doi.org/' + doi
+        return work
+
+    def xdd_page(self, page):
+        body = json.loads(self.fixtures['xdd_snippets.json'])
+        record = body['success']['data'][0]
+        data = []
+        for i in range(self.per_page):
+            text = json.dumps(record).replace('10.5334/oq.41', f'10.5555/xdd.{page}.{i}')
+            data.append(json.loads(text.replace('NeotomaDB', f'xddowner{page}x{i}')))
+        body['success']['data'] = data
+        body['success']['hits'] = self.pages * self.per_page
+        if page + 1 < self.pages:
+            body['success']['next_page'] = f'https://xdd.wisc.edu/api/v1/snippets?page={page + 1}'
+        return body
+
+    def datacite_page(self, page):
+        body = json.loads(self.fixtures['datacite_dois.json'])
+        record = json.dumps(body['data'][0])
+        body['data'] = [json.loads(record.replace('zenodo.1234567', f'zenodo.{page}{i:04d}')
+                                   .replace('neotomadb', f'dcowner{page}x{i}'))
+                        for i in range(self.per_page)]
+        if page + 1 < self.pages:
+            body['links']['next'] = f'https://api.datacite.org/dois?page[cursor]={page + 1}'
+        return body
+
+    def stargazer_page(self, owner, name, page, per_page):
+        # Star i of every repository is `stargazer{i}`, an hour after star i - 1.
+        total = self.stars.get(f'{owner}/{name}', self.stars_per_repo)
+        first = (page - 1) * per_page
+        return [{'starred_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1500000000 + 3600 * i)),
+                 'user': {'login': f'stargazer{i}'}}
+                for i in range(first, min(first + per_page, total))]
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+
+@contextlib.contextmanager
+def redirect_hosts(stub, hosts = HOSTS):
+    """_Send every `requests` call for `hosts` to the stub server instead._
+
+    The stub sees the original host as the first path segment, and responses
+    keep the original URL so redirect checks behave as they would in production.
+    """
+    original = HTTPAdapter.send
+
+    def send(adapter, request, **kwargs):
+        parts = urllib.parse.urlsplit(request.url)
+        if parts.hostname not in hosts:
+            return original(adapter, request, **kwargs)
+        url = request.url
+        request.url = urllib.parse.urlunsplit(('http', f'127.0.0.1:{stub.port}',
+                                               '/' + parts.hostname + parts.path, parts.query, ''))
+        response = original(adapter, request, **kwargs)
+        response.url = url
+        request.url = url
+        return response
+
+    HTTPAdapter.send = send
+    try:
+        yield stub
+    finally:
+        HTTPAdapter.send = original
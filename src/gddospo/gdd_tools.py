@@ -1,4 +1,101 @@
 import re
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from .ospo_runtime_tools import http_session
+from .ospo_metrics_tools import instrument
+
+GDD_SNIPPETS = ("https://geodeepdive.org/api/v1/snippets?"
+                + "term=gitlab.com,bitbucket.com,github.com"
+                + "&clean&full_results")
+
+# A path segment, allowing dots inside names and PDF line breaks after a hyphen
+# (e.g. "my-\nproject").
+REPO_SEGMENT = r'[\w-]+(?:(?:(?<=-)\s+|\.)[\w-]+)*'
+# Any scheme or `www.` prefix is ignored, so the pattern can start on the host name.
+# Matching runs on lower-cased text, which is much faster than re.IGNORECASE.
+REPO_PATTERN = re.compile(r'(?P<host>github\.com|gitlab\.com|bitbucket\.org|bitbucket\.com)'
+                          + r'\s?/\s?(?P<owner>' + REPO_SEGMENT + r')'
+                          + r'(?:\s?/\s?(?P<name>' + REPO_SEGMENT + r'))?')
+REPO_PATTERN_ANYCASE = re.compile(REPO_PATTERN.pattern, re.IGNORECASE)
+WHITESPACE = re.compile(r'\s+')
+# Used to join a page of highlights into one string for `extract_repositories_batch()`.
+SEPARATOR = '\x00'
+
+
+def find_repositories(text):
+    """Find repository references in a string, keeping the case of owner and repository names.
+
+    text A character string.
+    returns a generator of (start position, repository string) tuples.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        matches = REPO_PATTERN.finditer(lowered)
+    else:
+        # Some characters change length when lower-cased, so positions would not line up.
+        matches = REPO_PATTERN_ANYCASE.finditer(text)
+    for match in matches:
+        parts = [match.group('host').lower(), text[match.start('owner'):match.end('owner')]]
+        if match.group('name'):
+            parts.append(text[match.start('name'):match.end('name')])
+        repo = WHITESPACE.sub('', '/'.join(parts)).rstrip('.-')
+        if repo.endswith('.git'):
+            repo = repo[:-4]
+        yield match.start(), repo
+
+
+def extract_repositories(string):
+    """Find every repository referenced in a highlight.
+
+    string A character string returned from geodeepdive highlights.
+    returns a list of repository strings (e.g. `github.com/owner/name`), in order and without duplicates.
+    """
+    return list(dict.fromkeys([i[1] for i in find_repositories(string)]))
+
+
+@instrument('gdd.extract_repositories_batch')
+def extract_repositories_batch(highlights):
+    """Find every repository referenced in a list of highlights with a single regex pass.
+
+    highlights A list of character strings, e.g., every highlight on a page of xDD results.
+    returns a list with one list of repository strings per highlight.
+    """
+    output = [[] for _ in highlights]
+    if len(highlights) == 0:
+        return output
+    text = SEPARATOR.join(highlights)
+    # The offset of the separator that ends each highlight.
+    ends = []
+    position = 0
+    for i in highlights:
+        position = position + len(i)
+        ends.append(position)
+        position = position + len(SEPARATOR)
+    index = 0
+    for start, repo in find_repositories(text):
+        while start > ends[index]:
+            index = index + 1
+        if repo not in output[index]:
+            output[index].append(repo)
+    return output
+
+
+def extract_page_repositories(papers):
+    """Find the repositories in every highlight of a page of xDD papers at once.
+
+    papers A list of xDD results, each with a `highlight` list.
+    returns a list (one per paper) of lists (one per highlight) of repository strings.
+    """
+    highlights = [i.get('highlight') or [] for i in papers]
+    matches = extract_repositories_batch([j for i in highlights for j in i])
+    output = []
+    start = 0
+    for i in highlights:
+        output.append(matches[start:start + len(i)])
+        start = start + len(i)
+    return output
+
 
 def repotest(string):
     """Check to see if a repository is referenced in the paper.
@@ -6,13 +103,11 @@ def repotest(string):
     string A character string returned from geodeepdive highlights.
     returns None or the string matched.
     """
-    test = re.search(r'((github)|(gitlab)|(bitbucket)).com\/((\s{0,1})[\w,\-,\_]+\/*){1,2}', string)
-    if test is None:
+    repos = extract_repositories(string)
+    if len(repos) == 0:
         output = {'repo': None, 'highlight': string}
     else:
-        test_no_space = re.sub(r'\s', '', test[0])
-        test_no_punct = re.sub(r'[^\w\s]$', '', test_no_space)
-        output = {'repo': test_no_punct, 'highlight': string}
+        output = {'repo': repos[0], 'highlight': string}
     return output
 
 def empty_none(val):
@@ -28,3 +123,101 @@ def empty_none(val):
             if val[k] is None:
                 val[k] = ''
     return val
+
+
+class HarvestCheckpoint:
+    """_The xDD cursor and counters for a harvest, saved to a JSON file._
+
+    The checkpoint is written after each page has been processed, so a crashed
+    harvest resumes from the first page that was not finished.
+    """
+
+    def __init__(self, path):
+        """_Load a checkpoint, or start a new one if the file does not exist._
+
+        Args:
+            path (_str_): _The JSON file used to store the checkpoint._
+        """
+        self.path = path
+        self.state = {'next_page': None, 'pages': 0, 'papers': 0, 'hits': None, 'done': False}
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.state.update(json.load(checkpoint_file))
+
+    def save(self, **kwargs):
+        self.state.update(kwargs)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+        os.replace(temp_path, self.path)
+
+    def reset(self):
+        self.state = {'next_page': None, 'pages': 0, 'papers': 0, 'hits': None, 'done': False}
+        self.save()
+
+
+@instrument('gdd.get_snippet_page')
+def get_snippet_page(url, session = None, timeout = 60):
+    """_Fetch one page of xDD snippets._
+
+    Args:
+        url (_str_): _A snippets URL, or the `next_page` cursor from a previous page._
+        session (_requests.Session_, optional): _A session to reuse between pages._ Defaults to None.
+        timeout (int, optional): _Seconds before the request is abandoned._ Defaults to 60.
+
+    Returns:
+        _dict_: _The `success` block of the response: `data`, `hits` and `next_page`._
+    """
+    if session is None:
+        session = http_session()
+    results = session.get(url, timeout = timeout)
+    results.raise_for_status()
+    body = results.json()
+    if body.get('success') is None:
+        # xDD reports bad queries and expired cursors with a 200 and an `error` block.
+        raise ValueError(f"xDD snippet request failed: {body.get('error', body)}")
+    return body['success']
+
+
+def harvest_snippets(url = GDD_SNIPPETS, checkpoint = None, session = None, timeout = 60):
+    """_Stream pages of xDD snippets, prefetching the next page while one is processed._
+
+    An unfinished checkpoint is resumed; a finished one is reset, so the harvest
+    starts again from `url`.
+
+    Args:
+        url (_str_, optional): _The first snippets URL._ Defaults to GDD_SNIPPETS.
+        checkpoint (_HarvestCheckpoint_, optional): _If given, resume from and update this checkpoint._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between pages._ Defaults to None.
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 60.
+
+    Yields:
+        _dict_: _One page at a time, with `data` (a list of papers), `hits` and `next_page`._
+    """
+    if session is None:
+        session = http_session()
+    if checkpoint is not None:
+        if checkpoint.state.get('done'):
+            checkpoint.reset()
+        elif checkpoint.state.get('next_page'):
+            url = checkpoint.state['next_page']
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        pending = executor.submit(get_snippet_page, url, session, timeout)
+        while pending is not None:
+            page = pending.result()
+            data = page.get('data') or []
+            next_page = page.get('next_page')
+            if len(data) > 0 and next_page:
+                pending = executor.submit(get_snippet_page, next_page, session, timeout)
+            else:
+                pending = None
+            if len(data) > 0:
+                yield page
+            # Only reached once the caller asks for the next page, i.e. this page is done.
+            if checkpoint is not None:
+                checkpoint.save(next_page = next_page,
+                                pages = checkpoint.state['pages'] + (1 if len(data) > 0 else 0),
+                                papers = checkpoint.state['papers'] + len(data),
+                                hits = page.get('hits'),
+                                done = pending is None)
+    return None
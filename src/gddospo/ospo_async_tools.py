@@ -0,0 +1,257 @@
+import time
+import asyncio
+import datetime
+import statistics
+import requests
+from .ospo_runtime_tools import http_session, retry_after_seconds
+from .ospo_crawl_tools import (GITHUB_GRAPHQL, prepare_repo_batches,
+                               post_crawl_query, fetch_readme_batch, write_crawl_batch)
+
+
+class RateLimitBucket:
+    """_A token bucket whose refill rate follows GitHub's rate limit headers._
+
+    Tokens are GraphQL points (or REST calls). After every response the refill rate is
+    reset so that the remaining budget is spread evenly until `X-RateLimit-Reset`,
+    keeping throughput just under the allowed ceiling.
+    """
+
+    def __init__(self, rate = 1.0, capacity = 10, safety = 0.9):
+        """_Create a bucket._
+
+        Args:
+            rate (float, optional): _Initial tokens per second, before any headers are seen._ Defaults to 1.0.
+            capacity (int, optional): _The maximum burst size._ Defaults to 10.
+            safety (float, optional): _The fraction of the remaining budget we allow ourselves to spend._ Defaults to 0.9.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.safety = safety
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.remaining = None
+        self.reset = None
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost = 1):
+        """_Wait until `cost` tokens are available and take them._
+
+        Args:
+            cost (int, optional): _The number of tokens the next request will use._ Defaults to 1.
+
+        Returns:
+            _float_: _The number of seconds spent waiting._
+        """
+        start = time.monotonic()
+        cost = min(cost, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens = self.tokens - cost
+                    return time.monotonic() - start
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """_Stop handing out tokens for `seconds` (used for secondary rate limits)._"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update(self, headers):
+        """_Adjust the refill rate from `X-RateLimit-Remaining` and `X-RateLimit-Reset`._
+
+        Args:
+            headers (_dict_): _The response headers from GitHub._
+        """
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return None
+        self.remaining = int(remaining)
+        self.reset = int(reset)
+        window = max(self.reset - time.time(), 1)
+        self.rate = max(self.remaining * self.safety, 1) / window
+        self.tokens = min(self.tokens, self.remaining)
+        if self.remaining == 0:
+            self.pause(window)
+        return None
+
+
+class CrawlStats:
+    """_Throughput and latency counters for a crawl run._"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.repositories = 0
+        self.missing = 0
+        self.failures = 0
+        self.retries = 0
+        self.throttled = 0.0
+        self.latencies = []
+
+    def summary(self):
+        """_Summarize the run so far._
+
+        Returns:
+            _dict_: _Counts, throughput per second and request latency percentiles._
+        """
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        output = {'elapsed': elapsed,
+                  'requests': self.requests,
+                  'repositories': self.repositories,
+                  'missing': self.missing,
+                  'failures': self.failures,
+                  'retries': self.retries,
+                  'throttled_seconds': self.throttled,
+                  'repositories_per_second': self.repositories / elapsed if elapsed > 0 else 0,
+                  'requests_per_second': self.requests / elapsed if elapsed > 0 else 0}
+        if len(latencies) > 0:
+            output['latency_mean'] = statistics.mean(latencies)
+            output['latency_p50'] = latencies[int(0.50 * (len(latencies) - 1))]
+            output['latency_p95'] = latencies[int(0.95 * (len(latencies) - 1))]
+            output['latency_max'] = latencies[-1]
+        return output
+
+
+def secondary_limit_delay(response, attempt):
+    """_How long should we wait after a rate limited response?_
+
+    A 403 is only treated as rate limited when GitHub says so, with `Retry-After`,
+    an exhausted `X-RateLimit-Remaining` or a message about a secondary rate limit.
+    Any other 403 (e.g. a bad token or a blocked repository) fails at once.
+
+    Args:
+        response (_requests.Response_): _A 403 or 429 response from GitHub._
+        attempt (_int_): _The number of times this request has already been retried._
+
+    Returns:
+        _float_: _Seconds to wait, or None if the response is not rate limited._
+    """
+    if response.status_code not in [403, 429]:
+        return None
+    retry_after = retry_after_seconds(response)
+    if retry_after is not None:
+        return retry_after
+    if response.headers.get('X-RateLimit-Remaining') == '0':
+        reset = int(response.headers.get('X-RateLimit-Reset', time.time() + 60))
+        return max(reset - time.time(), 1)
+    message = response.text.lower()
+    if response.status_code == 403 and 'secondary rate limit' not in message and 'abuse' not in message:
+        return None
+    # GitHub asks clients to wait at least a minute, then back off exponentially.
+    return 60 * 2 ** attempt
+
+
+async def crawl_worker(conn, queue, bucket, stats, session, auth, endpoint, max_retries):
+    cost = 1
+    while True:
+        batch = await queue.get()
+        try:
+            attempt = 0
+            while True:
+                stats.throttled = stats.throttled + await bucket.acquire(cost)
+                crawl_at = datetime.datetime.now()
+                start = time.monotonic()
+                try:
+                    response = await asyncio.to_thread(post_crawl_query, [i[1] for i in batch],
+                                                       auth, session, endpoint)
+                except requests.exceptions.RequestException as e:
+                    response = None
+                    print(f"Request failed: {e}")
+                stats.latencies.append(time.monotonic() - start)
+                stats.requests = stats.requests + 1
+                if response is not None:
+                    bucket.update(response.headers)
+                    delay = secondary_limit_delay(response, attempt)
+                    if delay is None and response.status_code < 500:
+                        break
+                else:
+                    delay = 2 ** attempt
+                if attempt >= max_retries:
+                    stats.failures = stats.failures + len(batch)
+                    response = None
+                    break
+                if delay is None:
+                    delay = 2 ** attempt
+                bucket.pause(delay)
+                attempt = attempt + 1
+                stats.retries = stats.retries + 1
+            if response is None:
+                continue
+            response.raise_for_status()
+            result = await asyncio.to_thread(fetch_readme_batch, [i[1] for i in batch],
+                                             response.json(), auth, session, endpoint)
+            rate_limit = (result.get('data') or {}).get('rateLimit')
+            if rate_limit is not None:
+                cost = max(rate_limit.get('cost', 1), 1)
+            # psycopg2 connections are not shared across threads, so all writes
+            # happen here on the event loop.
+            written = write_crawl_batch(conn, batch, result, crawl_at)
+            stats.repositories = stats.repositories + len(written['crawled'])
+            stats.missing = stats.missing + len(written['missing'])
+        except Exception as e:
+            stats.failures = stats.failures + len(batch)
+            print(f"Failed to crawl batch.\n{e}")
+        finally:
+            queue.task_done()
+
+
+async def run_crawl(conn, repositories, auth = None, batch_size = 50, workers = 4,
+                    bucket = None, session = None, endpoint = GITHUB_GRAPHQL, max_retries = 5):
+    """_Crawl repositories with a bounded pool of concurrent GraphQL requests._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url) tuples._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        batch_size (int, optional): _Repositories per GraphQL query._ Defaults to 50.
+        workers (int, optional): _The number of requests allowed in flight at once._ Defaults to 4.
+        bucket (_RateLimitBucket_, optional): _A shared rate limiter._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint, may point to a local stub server._ Defaults to GITHUB_GRAPHQL.
+        max_retries (int, optional): _Retries for rate limited or failed requests._ Defaults to 5.
+
+    Returns:
+        _CrawlStats_: _Throughput and latency counters for the run._
+    """
+    if bucket is None:
+        bucket = RateLimitBucket(capacity = workers)
+    if session is None:
+        session = http_session(workers = workers)
+    stats = CrawlStats()
+    queue = asyncio.Queue()
+    for batch in prepare_repo_batches(repositories, batch_size):
+        queue.put_nowait(batch)
+    tasks = [asyncio.create_task(crawl_worker(conn, queue, bucket, stats, session,
+                                              auth, endpoint, max_retries))
+             for _ in range(workers)]
+    await queue.join()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions = True)
+    return stats
+
+
+def crawl_repositories(conn, repositories, **kwargs):
+    """_Synchronous wrapper around `run_crawl()` for scripts._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url) tuples._
+
+    Returns:
+        _dict_: _The `CrawlStats.summary()` for the run._
+    """
+    stats = asyncio.run(run_crawl(conn, repositories, **kwargs))
+    return stats.summary()
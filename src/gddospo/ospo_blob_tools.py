@@ -0,0 +1,333 @@
+import json
+import hashlib
+from psycopg2.extras import execute_values
+from .ospo_metrics_tools import instrument, METRICS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# READMEs and raw payloads are stored once per distinct content, keyed by SHA-256.
+# With `zstandard` installed payloads are zstd compressed ('zstd'); otherwise they
+# are stored as is ('none') and PostgreSQL compresses them when TOASTed (pglz or lz4).
+BLOB_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS crawlblobs (
+        blobhash BYTEA PRIMARY KEY,
+        codec TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        payload BYTEA NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP);
+    ALTER TABLE repositorycrawls
+        ADD COLUMN IF NOT EXISTS readmehash BYTEA REFERENCES crawlblobs(blobhash),
+        ADD COLUMN IF NOT EXISTS rawhash BYTEA REFERENCES crawlblobs(blobhash),
+        ADD COLUMN IF NOT EXISTS archived BOOLEAN;
+    -- Lets `prune_crawl_blobs()` check each blob with an index probe. On a partitioned
+    -- `repositorycrawls` the partitions, including later ones, inherit the indexes.
+    CREATE INDEX IF NOT EXISTS repositorycrawls_readmehash_idx ON repositorycrawls (readmehash);
+    CREATE INDEX IF NOT EXISTS repositorycrawls_rawhash_idx ON repositorycrawls (rawhash);"""
+
+ZSTD_LEVEL = 10
+
+
+def create_blob_tables(conn):
+    """_Create the `crawlblobs` table and the `repositorycrawls` columns that reference it._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    with conn.cursor() as cur:
+        cur.execute(BLOB_SCHEMA)
+    conn.commit()
+
+
+def blob_hash(content):
+    return hashlib.sha256(content).digest()
+
+
+def canonical_json(value):
+    """_Serialize a raw payload the same way whether it comes from a crawl (text) or from JSONB (a dict)._"""
+    if isinstance(value, (str, bytes)):
+        value = json.loads(value)
+    return json.dumps(value, sort_keys = True, separators = (',', ':')).encode('utf-8')
+
+
+def compress_blob(content):
+    """_Compress content for `crawlblobs`._
+
+    Returns:
+        _tuple_: _The codec ('zstd' or 'none') and the payload._
+    """
+    if zstandard is not None:
+        payload = zstandard.ZstdCompressor(level = ZSTD_LEVEL).compress(content)
+        if len(payload) < len(content):
+            return 'zstd', payload
+    return 'none', content
+
+
+def decompress_blob(codec, payload):
+    """_Restore the content of a `crawlblobs` row._"""
+    payload = bytes(payload)
+    if codec == 'none':
+        return payload
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("The `zstandard` package is needed to read zstd compressed blobs.")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown blob codec {codec}.")
+
+
+def store_blobs(conn, contents):
+    """_Add content to `crawlblobs`, compressing only what is not already stored._
+
+    Does not commit, so the blobs are written with the crawls that reference them.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        contents (_list_): _Bytes (or None)._
+
+    Returns:
+        _list_: _The hash of each item of `contents` (None for None)._
+    """
+    hashes = [None if i is None else blob_hash(i) for i in contents]
+    distinct = {h: c for h, c in zip(hashes, contents) if h is not None}
+    if len(distinct) == 0:
+        return hashes
+    with conn.cursor() as cur:
+        cur.execute("SELECT blobhash FROM crawlblobs WHERE blobhash = ANY(%s);", (list(distinct.keys()),))
+        known = set(bytes(i[0]) for i in cur.fetchall())
+        new_blobs = []
+        for key, content in distinct.items():
+            if key not in known:
+                codec, payload = compress_blob(content)
+                new_blobs.append((key, codec, len(content), payload))
+        if len(new_blobs) > 0:
+            execute_values(cur, """
+                INSERT INTO crawlblobs (blobhash, codec, size, payload)
+                VALUES %s
+                ON CONFLICT (blobhash) DO NOTHING;""", new_blobs)
+    METRICS.count('blobs.reused', len(distinct) - len(new_blobs))
+    METRICS.count('blobs.stored', len(new_blobs))
+    return hashes
+
+
+def raw_archived(raw):
+    """_Whether a raw payload (GraphQL `isArchived` or REST `archived`) marks the repository archived._"""
+    if raw is None:
+        return None
+    if isinstance(raw, (str, bytes)):
+        raw = json.loads(raw)
+    archived = raw.get('isArchived', raw.get('archived'))
+    return None if archived is None else bool(archived)
+
+
+@instrument('blobs.blob_crawl_values')
+def blob_crawl_values(conn, crawl_values):
+    """_Move the README and raw payload of `repositorycrawls` rows into `crawlblobs`._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        crawl_values (_list_): _Rows with the keys of `update_repo_crawl_db()`._
+
+    Returns:
+        _list_: _The rows with `readmehash`, `rawhash` and `archived` in place of `readme` and `raw`._
+    """
+    raws = [None if i.get('raw') is None else canonical_json(i['raw']) for i in crawl_values]
+    hashes = store_blobs(conn, [bytes(i['readme']) if i.get('readme') is not None else None
+                                for i in crawl_values] + raws)
+    values = []
+    for index, row in enumerate(crawl_values):
+        row = {k: v for k, v in row.items() if k not in ['readme', 'raw']}
+        row['readmehash'] = hashes[index]
+        row['rawhash'] = hashes[len(crawl_values) + index]
+        row['archived'] = raw_archived(crawl_values[index].get('raw'))
+        values.append(row)
+    return values
+
+
+@instrument('blobs.migrate_crawl_blobs')
+def migrate_crawl_blobs(conn, batch_size = 500, max_batches = None, verbose = True):
+    """_Move the README and raw columns of existing crawls into `crawlblobs`, a batch at a time._
+
+    Each batch is its own transaction: the crawls' blobs are stored once per
+    distinct content, the crawls get their hashes and `readme` and `raw` are set
+    to NULL. The migration can be stopped and resumed at any point. Space is only
+    returned to the operating system after a `VACUUM FULL` (or `pg_repack`).
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        batch_size (int, optional): _Crawls per transaction._ Defaults to 500.
+        max_batches (int, optional): _Stop after this many batches._ Defaults to None (all crawls).
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `crawls` migrated and the `bytes` of content moved out of `repositorycrawls`._
+    """
+    select_query = """
+        SELECT repositorycrawlid, readme, raw
+        FROM repositorycrawls
+        WHERE repositorycrawlid > %s
+          AND (readme IS NOT NULL OR raw IS NOT NULL)
+        ORDER BY repositorycrawlid
+        LIMIT %s;"""
+    update_query = """
+        UPDATE repositorycrawls AS rc
+        SET readmehash = mg.readmehash,
+            rawhash = mg.rawhash,
+            archived = COALESCE(rc.archived, mg.archived),
+            readme = NULL,
+            raw = NULL
+        FROM (VALUES %s) AS mg(repositorycrawlid, readmehash, rawhash, archived)
+        WHERE rc.repositorycrawlid = mg.repositorycrawlid;"""
+    summary = {'crawls': 0, 'bytes': 0}
+    last_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(select_query, (last_id, batch_size))
+                rows = cur.fetchall()
+                if len(rows) == 0:
+                    break
+                readmes = [None if i[1] is None else bytes(i[1]) for i in rows]
+                raws = [None if i[2] is None else canonical_json(i[2]) for i in rows]
+                hashes = store_blobs(conn, readmes + raws)
+                values = [(row[0], hashes[i], hashes[len(rows) + i], raw_archived(row[2]))
+                          for i, row in enumerate(rows)]
+                execute_values(cur, update_query, values,
+                               template = "(%s, %s::bytea, %s::bytea, %s::boolean)")
+            conn.commit()
+        except Exception as e:
+            print(f"Failed to migrate the crawls after {last_id}.\n{e}")
+            conn.rollback()
+            raise
+        last_id = rows[-1][0]
+        batches = batches + 1
+        summary['crawls'] = summary['crawls'] + len(rows)
+        summary['bytes'] = summary['bytes'] + sum(len(i) for i in readmes + raws if i is not None)
+        if verbose:
+            print(f"Migrated {summary['crawls']} crawls (through {last_id}), "
+                  f"{summary['bytes'] / 1e6:.1f} MB of README and raw content.")
+    return summary
+
+
+def blob_storage_summary(conn):
+    """_Compare the content referenced by crawls with what `crawlblobs` stores._
+
+    Returns:
+        _dict_: _The `crawls` referencing blobs, their `referenced_bytes`, the distinct `blobs`, their `content_bytes` and the `stored_bytes` on disk (after compression)._
+    """
+    summary_query = """
+        SELECT (SELECT COUNT(*) FROM repositorycrawls WHERE readmehash IS NOT NULL OR rawhash IS NOT NULL),
+               (SELECT COALESCE(SUM(cb.size), 0)
+                FROM repositorycrawls AS rc
+                CROSS JOIN LATERAL (VALUES (rc.readmehash), (rc.rawhash)) AS ref(blobhash)
+                INNER JOIN crawlblobs AS cb ON cb.blobhash = ref.blobhash),
+               COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(pg_column_size(payload)), 0)
+        FROM crawlblobs;"""
+    with conn.cursor() as cur:
+        cur.execute(summary_query)
+        result = cur.fetchone()
+    conn.rollback()
+    return dict(zip(['crawls', 'referenced_bytes', 'blobs', 'content_bytes', 'stored_bytes'], result))
+
+
+class BlobReader:
+    """_Fetch and decompress `crawlblobs` on request, keeping the most recent in memory._"""
+
+    def __init__(self, conn, cache_size = 256):
+        """_Create a reader._
+
+        Args:
+            conn (_connection_): _A valid psycopg2 connection._
+            cache_size (int, optional): _Decompressed blobs kept in memory._ Defaults to 256.
+        """
+        self.conn = conn
+        self.cache_size = cache_size
+        self.blobs = {}
+
+    def get_many(self, hashes):
+        """_The content of many blobs, fetched with one query._
+
+        Returns:
+            _dict_: _Content by hash._
+        """
+        hashes = [bytes(i) for i in hashes if i is not None]
+        missing = list(set(i for i in hashes if i not in self.blobs))
+        if len(missing) > 0:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT blobhash, codec, payload FROM crawlblobs WHERE blobhash = ANY(%s);",
+                            (missing,))
+                for key, codec, payload in cur.fetchall():
+                    self.blobs[bytes(key)] = decompress_blob(codec, payload)
+            self.conn.rollback()
+        found = {i: self.blobs.get(i) for i in hashes}
+        while len(self.blobs) > self.cache_size:
+            self.blobs.pop(next(iter(self.blobs)))
+        return found
+
+    def get(self, blobhash):
+        if blobhash is None:
+            return None
+        return self.get_many([blobhash]).get(bytes(blobhash))
+
+
+class LazyBlob:
+    """_A README or raw payload that is only fetched and decompressed when asked for._"""
+
+    def __init__(self, reader, blobhash = None, content = None):
+        self.reader = reader
+        self.blobhash = None if blobhash is None else bytes(blobhash)
+        self.content = content
+
+    def bytes(self):
+        if self.content is None and self.blobhash is not None:
+            self.content = self.reader.get(self.blobhash)
+        return self.content
+
+    def text(self):
+        content = self.bytes()
+        return None if content is None else content.decode('utf-8', errors = 'replace')
+
+    def json(self):
+        content = self.bytes()
+        return None if content is None else json.loads(content)
+
+
+def read_crawls(conn, repositoryids, reader = None):
+    """_Read the crawls of some repositories, with the README and raw payload loaded lazily._
+
+    Only the hashes are read with the crawls; a blob is fetched and decompressed
+    when `LazyBlob.bytes()`, `.text()` or `.json()` is first called. Crawls not yet
+    migrated return their stored `readme` and `raw` in the same wrapper.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositoryids (_list_): _The repositories to read._
+        reader (_BlobReader_, optional): _A reader to share between calls._ Defaults to a new reader.
+
+    Returns:
+        _list_: _Dicts of the crawl columns, oldest first, with `readme` and `raw` as `LazyBlob` objects._
+    """
+    if reader is None:
+        reader = BlobReader(conn)
+    crawl_query = """
+        SELECT repositorycrawlid, repositoryid, crawl_at, name, description, homepage,
+               last_pushed, license_name, stargazers, issues, openissues, forks,
+               language, topics, archived, readmehash, rawhash,
+               CASE WHEN readmehash IS NULL THEN readme END AS readme,
+               CASE WHEN rawhash IS NULL THEN raw::text END AS raw
+        FROM repositorycrawls
+        WHERE repositoryid = ANY(%s)
+        ORDER BY repositoryid, crawl_at;"""
+    with conn.cursor() as cur:
+        cur.execute(crawl_query, (list(repositoryids),))
+        columns = [i[0] for i in cur.description]
+        rows = [dict(zip(columns, i)) for i in cur.fetchall()]
+    conn.rollback()
+    for row in rows:
+        readme = row.pop('readme')
+        raw = row.pop('raw')
+        row['readme'] = LazyBlob(reader, row.pop('readmehash'), None if readme is None else bytes(readme))
+        row['raw'] = LazyBlob(reader, row.pop('rawhash'), None if raw is None else raw.encode('utf-8'))
+    return rows
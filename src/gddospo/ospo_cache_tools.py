@@ -0,0 +1,167 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+
+class LRUDict:
+    """_A small bounded mapping that evicts the least recently used key._"""
+
+    def __init__(self, maxsize = 100000):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.values:
+            self.values.move_to_end(key)
+            self.hits = self.hits + 1
+            return self.values[key]
+        self.misses = self.misses + 1
+        return None
+
+    def set(self, key, value):
+        self.values[key] = value
+        self.values.move_to_end(key)
+        if len(self.values) > self.maxsize:
+            self.values.popitem(last = False)
+
+    def discard(self, key):
+        self.values.pop(key, None)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class TTLCache:
+    """_A time-limited cache of JSON values, optionally saved to disk._
+
+    Each entry records when it was `checked`. Expired entries are treated as
+    missing, and are dropped when the cache is saved.
+    """
+
+    def __init__(self, path = None, ttl = 7 * 24 * 3600):
+        """_Create or load a cache._
+
+        Args:
+            path (_str_, optional): _A JSON file used to persist the cache between runs._ Defaults to None.
+            ttl (int, optional): _Seconds an entry stays valid._ Defaults to one week.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as cache_file:
+                self.entries = json.load(cache_file)
+
+    def key(self, key):
+        return key
+
+    def entry(self, key):
+        """_Return the entry for a key, or None if it is missing or expired._"""
+        entry = self.entries.get(self.key(key))
+        if entry is None or time.time() - entry.get('checked', 0) > self.ttl:
+            return None
+        return entry
+
+    def store(self, key, values):
+        self.entries[self.key(key)] = dict(values, checked = time.time())
+
+    def save(self):
+        if self.path is None:
+            return None
+        now = time.time()
+        fresh = {k: v for k, v in self.entries.items() if now - v.get('checked', 0) <= self.ttl}
+        with open(self.path, 'w') as cache_file:
+            json.dump(fresh, cache_file)
+        return None
+
+
+class LookupCache:
+    """_An in-process cache of OSPO database identifiers._
+
+    Repository URLs, DOIs and owner names are kept in bounded LRU caches. The small
+    reference tables the helpers look up by name (import sources and publication
+    link types) are preloaded in full by `load()`.
+
+    Only identifiers that exist are cached: a miss always falls through to the
+    database, and the insert helpers add new identifiers as they create them. The
+    helpers update the cache through `cache_on_commit()`, so identifiers written
+    inside a `batch()` are only cached once the batch commits.
+    """
+
+    def __init__(self, maxsize = 100000):
+        """_Create an empty cache._
+
+        Args:
+            maxsize (int, optional): _The maximum number of URLs, DOIs and owners kept, each._ Defaults to 100000.
+        """
+        self.repositories = LRUDict(maxsize)
+        self.publications = LRUDict(maxsize)
+        self.owners = LRUDict(maxsize)
+        self.sources = {}
+        self.linktypes = {}
+
+    @classmethod
+    def load(cls, conn, maxsize = 100000):
+        """_Create a cache with the reference tables preloaded._
+
+        Args:
+            conn (_connection_): _A valid psycopg2 connection._
+            maxsize (int, optional): _The maximum number of URLs, DOIs and owners kept, each._ Defaults to 100000.
+
+        Returns:
+            _LookupCache_: _A cache ready to pass to the `ospo_db_tools` helpers._
+        """
+        cache = cls(maxsize)
+        cache.refresh(conn)
+        return cache
+
+    def refresh(self, conn):
+        """_Reload the reference tables from the database._
+
+        Args:
+            conn (_connection_): _A valid psycopg2 connection._
+        """
+        with conn.cursor() as cur:
+            cur.execute("SELECT sourcename, sourceid FROM ospoimportsources;")
+            self.sources = dict(cur.fetchall())
+            cur.execute("SELECT publicationlinksource, publicationlinkid FROM publicationlinks;")
+            self.linktypes = dict(cur.fetchall())
+        return None
+
+    def repository(self, url):
+        return self.repositories.get(url)
+
+    def set_repository(self, url, repositoryid):
+        if url is not None and repositoryid is not None:
+            self.repositories.set(url, repositoryid)
+
+    def publication(self, doi):
+        return self.publications.get(doi)
+
+    def set_publication(self, doi, publicationid):
+        if doi is not None and publicationid is not None:
+            self.publications.set(doi, publicationid)
+
+    def owner(self, ownername):
+        return self.owners.get(ownername)
+
+    def set_owner(self, ownername, ownerid):
+        if ownername is not None and ownerid is not None:
+            self.owners.set(ownername, ownerid)
+
+    def invalidate_repository(self, url):
+        self.repositories.discard(url)
+
+    def stats(self):
+        """_Hit and miss counts for the LRU caches._
+
+        Returns:
+            _dict_: _Hits, misses and size for repositories, publications and owners._
+        """
+        return {k: {'hits': v.hits, 'misses': v.misses, 'size': len(v)}
+                for k, v in [('repositories', self.repositories),
+                             ('publications', self.publications),
+                             ('owners', self.owners)]}
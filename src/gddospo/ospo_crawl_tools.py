@@ -0,0 +1,918 @@
+import re
+import os
+import json
+import datetime
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from .ospo_runtime_tools import http_session
+from .ospo_db_tools import clean_repo_name, commit_db, rollback_db
+from .ospo_metrics_tools import instrument
+from .ospo_blob_tools import blob_crawl_values
+from .ospo_cache_tools import TTLCache
+
+GITHUB_GRAPHQL = 'https://api.github.com/graphql'
+GITHUB_API = 'https://api.github.com'
+
+# GitHub's REST `get_readme()` resolves the README for us, GraphQL does not.
+# Like `get_readme()`, `.github/` is checked before the root and `docs/` after it,
+# and any capitalization or extension of `README` counts. The common spellings
+# are fetched with the crawl; the file names in each folder are fetched too, so
+# a README under any other spelling is found and fetched by `fetch_readme_batch()`.
+README_NAMES = ['.github/README.md',
+                'README.md', 'README', 'README.rst', 'README.txt', 'README.markdown', 'README.adoc',
+                'readme.md', 'Readme.md', 'readme.rst', 'readme.txt', 'readme',
+                'docs/README.md', 'docs/README.rst']
+README_FOLDERS = ['.github/', '', 'docs/']
+
+CRAWL_FRAGMENT = """
+fragment crawlFields on Repository {
+  name
+  description
+  homepageUrl
+  pushedAt
+  isArchived
+  url
+  licenseInfo { name }
+  languages(first: 100, orderBy: {field: SIZE, direction: DESC}) {
+    edges { size node { name } }
+  }
+  repositoryTopics(first: 100) { nodes { topic { name } } }
+  stargazerCount
+  forkCount
+  issues(states: OPEN) { totalCount }
+  pullRequests(states: OPEN) { totalCount }
+  owner {
+    __typename
+    login
+    ... on User { email bio }
+    ... on Organization { email description }
+  }
+%s
+}"""
+
+
+def split_repo_url(repository):
+    """_Split a GitHub repository URL into its owner and repository name._
+
+    Args:
+        repository (_str_): _A repository URL._
+
+    Returns:
+        _tuple_: _A tuple of (owner, name), or None if the URL is not a GitHub repository._
+    """
+    repo_url = clean_repo_name(repository)
+    if repo_url is None:
+        return None
+    repo_string = re.findall(r'github\.com\/([^/]+)\/([^/]+)$', repo_url)
+    if len(repo_string) == 0:
+        return None
+    return repo_string[0]
+
+
+CRAWL_INDEX = """
+    CREATE INDEX IF NOT EXISTS repositorycrawls_repositoryid_crawl_at_idx
+    ON repositorycrawls (repositoryid, crawl_at DESC);"""
+
+
+def create_crawl_indexes(conn):
+    """_Create the index that lets `plan_repo_crawls()` find each latest crawl cheaply._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    with conn.cursor() as cur:
+        cur.execute(CRAWL_INDEX)
+    commit_db(conn)
+
+
+def plan_repo_crawls(conn, interval = '2 week', include_uncrawled = True, skip_missing = True):
+    """_Find every GitHub repository that is due for a crawl, in a single query._
+
+    Only the latest crawl of each repository is considered, found with one index
+    probe per repository (newest partition first if `repositorycrawls` is
+    partitioned), so the cost does not grow with the length of the crawl history.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        interval (str, optional): _A PostgreSQL interval, crawls older than this are stale._ Defaults to '2 week'.
+        include_uncrawled (bool, optional): _Should repositories that were never crawled be included?_ Defaults to True.
+        skip_missing (bool, optional): _Should repositories with a recorded 404 or 410 be skipped?_ Defaults to True.
+
+    Returns:
+        _list_: _A list of (repositoryid, url, ownerid) tuples, oldest crawl first._
+    """
+    plan_query = """
+        SELECT rp.repositoryid, rp.url, rp.ownerid
+        FROM repositories AS rp
+        LEFT JOIN LATERAL (SELECT rpc.crawl_at
+                           FROM repositorycrawls AS rpc
+                           WHERE rpc.repositoryid = rp.repositoryid
+                             AND rpc.crawl_at IS NOT NULL
+                           ORDER BY rpc.crawl_at DESC
+                           LIMIT 1) AS lc ON TRUE
+        WHERE rp.url ILIKE '%%github.com%%'
+          AND (lc.crawl_at < LOCALTIMESTAMP - %(interval)s::interval
+               OR (%(uncrawled)s AND lc.crawl_at IS NULL))
+          AND NOT (%(skip_missing)s AND EXISTS (SELECT 1
+                                                FROM repoqualitychecks AS rqc
+                                                WHERE rqc.repositoryid = rp.repositoryid
+                                                AND rqc.badstatus IN (404, 410)))
+        ORDER BY lc.crawl_at ASC NULLS FIRST;"""
+    with conn.cursor() as cur:
+        cur.execute(plan_query, {'interval': interval,
+                                 'uncrawled': include_uncrawled,
+                                 'skip_missing': skip_missing})
+        repos = cur.fetchall()
+    return repos
+
+
+def build_crawl_query(repositories):
+    """_Build a single GraphQL query that fetches crawl fields for many repositories._
+
+    Args:
+        repositories (_list_): _A list of (owner, name) tuples._
+
+    Returns:
+        _tuple_: _The query string and its variables, each repository aliased as r0, r1, . . ._
+    """
+    readme_fields = '\n'.join([f'  readme{i}: object(expression: "HEAD:{j}") {{ ... on Blob {{ text }} }}'
+                               for i, j in enumerate(README_NAMES)]
+                              + [f'  readmeFolder{i}: object(expression: "HEAD:{j}") {{ ... on Tree {{ entries {{ name type }} }} }}'
+                                 for i, j in enumerate(README_FOLDERS)])
+    arguments = []
+    aliases = []
+    variables = {}
+    for i, (owner, name) in enumerate(repositories):
+        arguments.append(f'$o{i}: String!, $n{i}: String!')
+        aliases.append(f'  r{i}: repository(owner: $o{i}, name: $n{i}) {{ ...crawlFields }}')
+        variables[f'o{i}'] = owner
+        variables[f'n{i}'] = name
+    query = ('query(' + ', '.join(arguments) + ') {\n'
+             + '  rateLimit { cost remaining resetAt }\n'
+             + '\n'.join(aliases) + '\n}\n'
+             + CRAWL_FRAGMENT % readme_fields)
+    return query, variables
+
+
+@instrument('crawl.post_crawl_query')
+def post_crawl_query(repositories, auth = None, session = None, endpoint = GITHUB_GRAPHQL):
+    """_Send the batched crawl query and return the raw HTTP response._
+
+    Args:
+        repositories (_list_): _A list of (owner, name) tuples._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint, may point to a recorded or fake server._ Defaults to GITHUB_GRAPHQL.
+
+    Returns:
+        _requests.Response_: _The response, including the rate limit headers._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+        if auth is None:
+            raise TypeError("The authentication token must be supplied explicitly or set as the environment variable GITHUB_TOKEN.")
+    if session is None:
+        session = http_session()
+    query, variables = build_crawl_query(repositories)
+    return session.post(endpoint,
+                        json={'query': query, 'variables': variables},
+                        headers={'Authorization': f'bearer {auth}'},
+                        timeout=60)
+
+
+def fetch_repo_batch(repositories, auth = None, session = None, endpoint = GITHUB_GRAPHQL):
+    """_Fetch crawl fields for a batch of repositories with one GraphQL call._
+
+    Args:
+        repositories (_list_): _A list of (owner, name) tuples._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint, may point to a recorded or fake server._ Defaults to GITHUB_GRAPHQL.
+
+    Returns:
+        _dict_: _The decoded JSON response, with `data` keyed by alias (r0, r1, . . .)._
+    """
+    response = post_crawl_query(repositories, auth = auth, session = session, endpoint = endpoint)
+    response.raise_for_status()
+    return fetch_readme_batch(repositories, response.json(), auth = auth,
+                              session = session, endpoint = endpoint)
+
+
+def graphql_readme_path(node):
+    """_Find the README GitHub would show for a GraphQL repository node._
+
+    Args:
+        node (_dict_): _A repository node returned by `fetch_repo_batch()`._
+
+    Returns:
+        _str_: _The path of the README, or None if the repository has none._
+    """
+    for i, folder in enumerate(README_FOLDERS):
+        tree = node.get(f'readmeFolder{i}')
+        if tree is None:
+            continue
+        names = [j['name'] for j in tree.get('entries', [])
+                 if j.get('type') == 'blob' and re.match(r'readme(\.[^/]+)?$', j['name'], re.IGNORECASE)]
+        if len(names) > 0:
+            # Prefer the listed spellings, in order, as the crawl fetched them.
+            listed = [j for j in README_NAMES if j.startswith(folder) and j[len(folder):] in names]
+            return listed[0] if len(listed) > 0 else folder + sorted(names)[0]
+    return None
+
+
+@instrument('crawl.fetch_readme_batch')
+def fetch_readme_batch(repositories, result, auth = None, session = None, endpoint = GITHUB_GRAPHQL):
+    """_Fetch the READMEs a batched crawl found under a spelling it did not ask for, with one GraphQL call._
+
+    Args:
+        repositories (_list_): _The (owner, name) tuples of the crawl, in query order._
+        result (_dict_): _The decoded response of the crawl, updated in place._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint, may point to a recorded or fake server._ Defaults to GITHUB_GRAPHQL.
+
+    Returns:
+        _dict_: _The crawl result, with a `readme` blob added to each repository node whose README was fetched._
+    """
+    data = result.get('data') or {}
+    wanted = []
+    for i, repository in enumerate(repositories):
+        node = data.get(f'r{i}')
+        if node is None:
+            continue
+        path = graphql_readme_path(node)
+        if path is not None and path not in README_NAMES:
+            wanted.append((i, repository, path))
+    if len(wanted) == 0:
+        return result
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+    if session is None:
+        session = http_session()
+    arguments = []
+    aliases = []
+    variables = {}
+    for i, (owner, name), path in wanted:
+        arguments.append(f'$o{i}: String!, $n{i}: String!, $p{i}: String!')
+        aliases.append(f'  r{i}: repository(owner: $o{i}, name: $n{i}) {{ readme: object(expression: $p{i}) {{ ... on Blob {{ text }} }} }}')
+        variables.update({f'o{i}': owner, f'n{i}': name, f'p{i}': f'HEAD:{path}'})
+    query = 'query(' + ', '.join(arguments) + ') {\n' + '\n'.join(aliases) + '\n}\n'
+    response = session.post(endpoint,
+                            json = {'query': query, 'variables': variables},
+                            headers = {'Authorization': f'bearer {auth}'},
+                            timeout = 60)
+    response.raise_for_status()
+    readmes = response.json().get('data') or {}
+    for i, _, _ in wanted:
+        node = readmes.get(f'r{i}')
+        if node is not None:
+            data[f'r{i}']['readme'] = node.get('readme')
+    return result
+
+
+def graphql_crawl_values(repositoryid, node, crawl_at):
+    """_Convert a GraphQL repository node into a `repositorycrawls` row._
+
+    Args:
+        repositoryid (_int_): _The repositoryid from the OSPO database._
+        node (_dict_): _A repository node returned by `fetch_repo_batch()`._
+        crawl_at (_datetime_): _The time of the crawl._
+
+    Returns:
+        _dict_: _Values using the same keys as `update_repo_crawl_db()`._
+    """
+    path = graphql_readme_path(node)
+    if path in README_NAMES:
+        blob = node.get(f'readme{README_NAMES.index(path)}')
+    else:
+        blob = node.get('readme')
+    readme = None
+    if blob is not None and blob.get('text') is not None:
+        readme = blob.get('text').encode('utf-8')
+    license_name = node.get('licenseInfo')
+    if license_name is not None:
+        license_name = license_name.get('name')
+    homepage = node.get('homepageUrl')
+    if homepage == '':
+        homepage = None
+    # The time of the last push, in UTC, as `update_repo_crawl_db()` stores it.
+    last_pushed = node.get('pushedAt')
+    if last_pushed is not None:
+        last_pushed = datetime.datetime.strptime(last_pushed, '%Y-%m-%dT%H:%M:%SZ')
+    languages = {i['node']['name']: i['size'] for i in node['languages']['edges']}
+    topics = [i['topic']['name'] for i in node['repositoryTopics']['nodes']]
+    # REST's `get_issues()` (open by default) and `open_issues_count` both count
+    # open pull requests as issues, GraphQL counts them separately.
+    open_count = node['issues']['totalCount'] + node['pullRequests']['totalCount']
+    raw = {k: v for k, v in node.items() if not re.match(r'readme(Folder)?\d*$', k)}
+    return {'repositoryid': repositoryid,
+            'crawl_at': crawl_at,
+            'name': node.get('name'),
+            'description': node.get('description'),
+            'homepage': homepage,
+            'last_pushed': last_pushed,
+            'license_name': license_name,
+            'language': json.dumps(languages),
+            'topics': json.dumps(topics),
+            'readme': readme,
+            'stargazers': node.get('stargazerCount'),
+            'issues': open_count,
+            'openissues': open_count,
+            'forks': node.get('forkCount'),
+            'raw': json.dumps(raw)}
+
+
+def graphql_owner_values(node, manager = "GitHub"):
+    """_Convert the owner of a GraphQL repository node into a `repositoryowners` row._
+
+    Args:
+        node (_dict_): _A repository node returned by `fetch_repo_batch()`._
+        manager (_str_, optional): _The repository manager name._ Defaults to "GitHub".
+
+    Returns:
+        _dict_: _Values using the same keys as `update_repo_add_owner()`._
+    """
+    owner = node.get('owner')
+    if owner is None:
+        return None
+    is_org = owner.get('__typename') == 'Organization'
+    return {'ownername': owner.get('login'),
+            'email': owner.get('email') or None,
+            'isorganization': is_org,
+            'biography': owner.get('description') if is_org else owner.get('bio'),
+            'managername': manager}
+
+
+def insert_crawl_batch(conn, crawl_values):
+    """_Write many `repositorycrawls` rows with a single multi-row insert._
+
+    READMEs and raw payloads are stored in `crawlblobs` (see `create_blob_tables()`)
+    and the rows reference them by hash. Does not commit.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        crawl_values (_list_): _A list of dicts from `graphql_crawl_values()`._
+    """
+    if len(crawl_values) == 0:
+        return None
+    insert_query = """
+        INSERT INTO repositorycrawls (repositoryid, crawl_at,
+                                      name, description, homepage,
+                                      last_pushed, license_name,
+                                      readmehash, stargazers, issues,
+                                      openissues, forks, rawhash, archived, language, topics)
+        VALUES %s"""
+    template = """
+        (%(repositoryid)s, %(crawl_at)s, %(name)s, %(description)s, %(homepage)s,
+         %(last_pushed)s, %(license_name)s, %(readmehash)s,
+         %(stargazers)s, %(issues)s, %(openissues)s, %(forks)s, %(rawhash)s, %(archived)s,
+         %(language)s, %(topics)s)"""
+    crawl_values = blob_crawl_values(conn, crawl_values)
+    with conn.cursor() as cur:
+        execute_values(cur, insert_query, crawl_values, template=template,
+                       page_size=len(crawl_values))
+    return None
+
+
+def insert_owner_batch(conn, owner_values):
+    """_Upsert repository owners and assign them to their repositories in bulk._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        owner_values (_list_): _A list of (repositoryid, owner dict) tuples._
+    """
+    if len(owner_values) == 0:
+        return None
+    owners = {i[1]['ownername']: i[1] for i in owner_values}
+    insert_owner = """
+        INSERT INTO repositoryowners (ownername, email, isorganization, biography, managerid)
+        VALUES %s
+        ON CONFLICT (ownername, managerid) DO UPDATE
+        SET email = EXCLUDED.email,
+            isorganization = EXCLUDED.isorganization,
+            biography = EXCLUDED.biography
+        RETURNING ownerid, ownername;"""
+    template = """
+        (%(ownername)s, %(email)s, %(isorganization)s, %(biography)s,
+         (SELECT managerid FROM repositorymanagers WHERE managername = %(managername)s))"""
+    add_repo_owner = """
+        UPDATE repositories AS rp
+        SET ownerid = own.ownerid
+        FROM (VALUES %s) AS own(repositoryid, ownerid)
+        WHERE rp.repositoryid = own.repositoryid"""
+    with conn.cursor() as cur:
+        owner_ids = execute_values(cur, insert_owner, list(owners.values()),
+                                   template=template, fetch=True)
+        owner_ids = {i[1]: i[0] for i in owner_ids}
+        execute_values(cur, add_repo_owner,
+                       [(i[0], owner_ids[i[1]['ownername']]) for i in owner_values])
+    return None
+
+
+def prepare_repo_batches(repositories, batch_size = 50, verbose = True):
+    """_Split (repositoryid, url) pairs into GraphQL sized batches._
+
+    Args:
+        repositories (_list_): _A list of (repositoryid, url) or (repositoryid, url, ownerid) tuples._
+        batch_size (int, optional): _Repositories per GraphQL query (GitHub allows up to 100)._ Defaults to 50.
+        verbose (bool, optional): _Should the number of skipped, non-Github, repositories be printed?_ Defaults to True.
+
+    Returns:
+        _list_: _A list of batches, each a list of (repositoryid, (owner, name), ownerid) tuples. The ownerid is False when it was not supplied._
+    """
+    repos = [(i[0], split_repo_url(i[1]), i[2] if len(i) > 2 else False) for i in repositories]
+    skipped = len([i for i in repos if i[1] is None])
+    if skipped > 0 and verbose:
+        print(f"Skipped {skipped} repositories that are not on Github. Only Github repositories are supported at this time.")
+    repos = [i for i in repos if i[1] is not None]
+    return [repos[i:i + batch_size] for i in range(0, len(repos), batch_size)]
+
+
+@instrument('crawl.write_crawl_batch')
+def write_crawl_batch(conn, batch, result, crawl_at):
+    """_Write the result of one batched GraphQL crawl to the database._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        batch (_list_): _A list of (repositoryid, (owner, name), ownerid) tuples, in query order._
+        result (_dict_): _The decoded GraphQL response for the batch._
+        crawl_at (_datetime_): _The time of the crawl._
+
+    Returns:
+        _dict_: _The crawled and missing repositoryids._
+    """
+    data = result.get('data')
+    if data is None:
+        raise ValueError(f"GraphQL crawl failed: {result.get('errors')}")
+    not_found = set([i.get('path', [None])[0] for i in result.get('errors', [])
+                     if i.get('type') == 'NOT_FOUND'])
+    owner_query = """
+        SELECT repositoryid
+        FROM repositories
+        WHERE repositoryid = ANY(%s) AND ownerid IS NULL;"""
+    bad_repo_query = """
+        INSERT INTO repoqualitychecks (repositoryid, badstatus)
+        VALUES %s
+        ON CONFLICT DO NOTHING;"""
+    try:
+        no_owner = set([i[0] for i in batch if i[2] is None])
+        unknown_owner = [i[0] for i in batch if i[2] is False]
+        if len(unknown_owner) > 0:
+            with conn.cursor() as cur:
+                cur.execute(owner_query, (unknown_owner,))
+                no_owner.update([i[0] for i in cur.fetchall()])
+        crawl_values = []
+        owner_values = []
+        missing = []
+        for i, (repositoryid, _, _) in enumerate(batch):
+            node = data.get(f'r{i}')
+            if node is None:
+                if f'r{i}' in not_found:
+                    missing.append((repositoryid, 404))
+                continue
+            crawl_values.append(graphql_crawl_values(repositoryid, node, crawl_at))
+            if repositoryid in no_owner:
+                owner = graphql_owner_values(node)
+                if owner is not None:
+                    owner_values.append((repositoryid, owner))
+        insert_crawl_batch(conn, crawl_values)
+        insert_owner_batch(conn, owner_values)
+        if len(missing) > 0:
+            with conn.cursor() as cur:
+                execute_values(cur, bad_repo_query, missing)
+        commit_db(conn)
+    except Exception:
+        rollback_db(conn)
+        raise
+    return {'crawled': [i['repositoryid'] for i in crawl_values],
+            'missing': [i[0] for i in missing]}
+
+
+def update_repo_crawl_batch(conn, repositories, auth = None, batch_size = 50,
+                            session = None, endpoint = GITHUB_GRAPHQL, verbose = True):
+    """_Crawl many GitHub repositories using batched GraphQL queries._
+
+    This produces the same `repositorycrawls` rows as `update_repo_crawl_db()`, but
+    fetches `batch_size` repositories per request and writes each batch with one insert.
+    The `raw` column holds the GraphQL repository node rather than the REST payload.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url) or (repositoryid, url, ownerid) tuples, e.g., from `plan_repo_crawls()`._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        batch_size (int, optional): _Repositories per GraphQL query (GitHub allows up to 100)._ Defaults to 50.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint._ Defaults to GITHUB_GRAPHQL.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _list_: _The repositoryids that were crawled._
+    """
+    if session is None:
+        session = http_session()
+    crawled = []
+    for batch in prepare_repo_batches(repositories, batch_size, verbose = verbose):
+        crawl_at = datetime.datetime.now()
+        result = fetch_repo_batch([i[1] for i in batch], auth = auth,
+                                  session = session, endpoint = endpoint)
+        try:
+            written = write_crawl_batch(conn, batch, result, crawl_at)
+        except Exception as e:
+            print(f"Failed to write crawl batch.\n{e}")
+            continue
+        crawled.extend(written['crawled'])
+        if verbose:
+            print(f"Crawled {len(written['crawled'])} repositories ({len(written['missing'])} missing); {result['data'].get('rateLimit')}")
+    return crawled
+
+
+VALIDATOR_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS repositoryvalidators (
+        repositoryid INTEGER PRIMARY KEY REFERENCES repositories(repositoryid) ON DELETE CASCADE,
+        etag TEXT,
+        lastmodified TEXT,
+        checked_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP);
+    ALTER TABLE repositorycrawls
+        ADD COLUMN IF NOT EXISTS unchanged BOOLEAN NOT NULL DEFAULT FALSE;"""
+
+
+def create_validator_table(conn):
+    """_Create the `repositoryvalidators` table and the `repositorycrawls.unchanged` marker column._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    with conn.cursor() as cur:
+        cur.execute(VALIDATOR_SCHEMA)
+    commit_db(conn)
+
+
+def check_repo_changed(owner, name, etag = None, last_modified = None, auth = None,
+                       session = None, api = GITHUB_API):
+    """_Ask GitHub whether a repository changed since we last saw it._
+
+    GitHub does not count a `304 Not Modified` against the rate limit, and the
+    repository ETag changes whenever stars, forks, issues or pushes change.
+
+    Args:
+        owner (_str_): _The repository owner._
+        name (_str_): _The repository name._
+        etag (_str_, optional): _The stored ETag for the repository._ Defaults to None.
+        last_modified (_str_, optional): _The stored Last-Modified header._ Defaults to None.
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _dict_: _The HTTP status and the new ETag and Last-Modified values._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+    if session is None:
+        session = http_session()
+    headers = {'Accept': 'application/vnd.github+json'}
+    if auth is not None:
+        headers['Authorization'] = f'bearer {auth}'
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    response = session.get(f'{api}/repos/{owner}/{name}', headers=headers, timeout=30)
+    return {'status': response.status_code,
+            'etag': response.headers.get('ETag') or etag,
+            'lastmodified': response.headers.get('Last-Modified') or last_modified}
+
+
+@instrument('crawl.filter_changed_repos')
+def filter_changed_repos(conn, repositories, auth = None, session = None,
+                         api = GITHUB_API, workers = 8, verbose = True):
+    """_Split planned crawls into changed and unchanged repositories using conditional requests._
+
+    Unchanged repositories get a lightweight `unchanged` row in `repositorycrawls`
+    (so they are not planned again until the next interval) instead of a full copy.
+    Changed repositories have their validators updated and are returned for crawling.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url, . . .) tuples, e.g., from `plan_repo_crawls()`._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+        workers (int, optional): _The number of conditional requests in flight at once._ Defaults to 8.
+        verbose (bool, optional): _Should the function print a summary?_ Defaults to True.
+
+    Returns:
+        _list_: _The subset of `repositories` that changed and should be crawled._
+    """
+    if session is None:
+        session = http_session(workers = workers)
+    # A validator is only trusted once a full crawl has been written after it,
+    # otherwise a failed crawl would be skipped as "unchanged" forever.
+    validator_query = """
+        SELECT rv.repositoryid, rv.etag, rv.lastmodified
+        FROM repositoryvalidators AS rv
+        WHERE rv.repositoryid = ANY(%s)
+          AND EXISTS (SELECT 1
+                      FROM repositorycrawls AS rpc
+                      WHERE rpc.repositoryid = rv.repositoryid
+                        AND NOT rpc.unchanged
+                        AND rpc.crawl_at >= rv.checked_at);"""
+    with conn.cursor() as cur:
+        cur.execute(validator_query, ([i[0] for i in repositories],))
+        validators = {i[0]: (i[1], i[2]) for i in cur.fetchall()}
+
+    def probe(repo):
+        repo_string = split_repo_url(repo[1])
+        if repo_string is None:
+            return None
+        etag, last_modified = validators.get(repo[0], (None, None))
+        try:
+            return check_repo_changed(repo_string[0], repo_string[1], etag, last_modified,
+                                      auth = auth, session = session, api = api)
+        except requests.exceptions.RequestException as e:
+            print(f"Conditional request failed for {repo[1]}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        checks = list(executor.map(probe, repositories))
+    crawl_at = datetime.datetime.now()
+    changed = []
+    unchanged = []
+    missing = []
+    new_validators = []
+    for repo, check in zip(repositories, checks):
+        if check is None:
+            changed.append(repo)
+        elif check['status'] == 304:
+            unchanged.append((repo[0], crawl_at, True))
+        elif check['status'] == 404:
+            missing.append((repo[0], 404))
+        else:
+            changed.append(repo)
+            if check['status'] == 200:
+                new_validators.append((repo[0], check['etag'], check['lastmodified'], crawl_at))
+    marker_query = """
+        INSERT INTO repositorycrawls (repositoryid, crawl_at, unchanged)
+        VALUES %s;"""
+    validator_upsert = """
+        INSERT INTO repositoryvalidators (repositoryid, etag, lastmodified, checked_at)
+        VALUES %s
+        ON CONFLICT (repositoryid) DO UPDATE
+        SET etag = EXCLUDED.etag,
+            lastmodified = EXCLUDED.lastmodified,
+            checked_at = EXCLUDED.checked_at;"""
+    bad_repo_query = """
+        INSERT INTO repoqualitychecks (repositoryid, badstatus)
+        VALUES %s
+        ON CONFLICT DO NOTHING;"""
+    try:
+        with conn.cursor() as cur:
+            if len(unchanged) > 0:
+                execute_values(cur, marker_query, unchanged)
+            if len(new_validators) > 0:
+                execute_values(cur, validator_upsert, new_validators)
+            if len(missing) > 0:
+                execute_values(cur, bad_repo_query, missing)
+        commit_db(conn)
+    except Exception as e:
+        print(f"Failed to record conditional checks.\n{e}")
+        rollback_db(conn)
+        return list(repositories)
+    if verbose:
+        print(f"{len(changed)} changed, {len(unchanged)} unchanged and {len(missing)} missing repositories.")
+    return changed
+
+
+class OwnerCache(TTLCache):
+    """_A time-limited cache of GitHub owner profiles, optionally saved to disk._
+
+    Keys are lower-case logins. Owners GitHub reports as missing are cached as None,
+    so they are not requested again until the entry expires.
+    """
+
+    def key(self, login):
+        return login.lower()
+
+    def __contains__(self, login):
+        return self.entry(login) is not None
+
+    def get(self, login):
+        entry = self.entry(login)
+        if entry is None:
+            return None
+        return entry['owner']
+
+    def set(self, login, owner):
+        self.store(login, {'owner': owner})
+
+
+def repo_owner_login(repository):
+    """_The owner login of a GitHub repository or owner URL, or None._"""
+    repo_url = clean_repo_name(repository)
+    if repo_url is None:
+        return None
+    login = re.findall(r'github\.com\/([^/]+)', repo_url)
+    if len(login) == 0:
+        return None
+    return login[0]
+
+
+def fetch_owner(login, auth = None, session = None, api = GITHUB_API):
+    """_Fetch a GitHub user or organization profile._
+
+    Args:
+        login (_str_): _A GitHub login._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _dict_: _The HTTP `status` and the `owner` values (with the same keys as `update_repo_add_owner()`, None unless found)._
+    """
+    if session is None:
+        session = http_session()
+    headers = {'Accept': 'application/vnd.github+json'}
+    if auth is not None:
+        headers['Authorization'] = f'bearer {auth}'
+    try:
+        response = session.get(f'{api}/users/{login}', headers=headers, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch the owner {login}: {e}")
+        return {'status': None, 'owner': None}
+    if response.status_code != 200:
+        return {'status': response.status_code, 'owner': None}
+    owner = response.json()
+    return {'status': 200,
+            'owner': {'ownername': owner.get('login'),
+                      'email': owner.get('email'),
+                      'isorganization': (owner.get('type') or '') == 'Organization',
+                      'biography': owner.get('bio')}}
+
+
+def build_owner_query(repositories):
+    """_Build a single GraphQL query for the current owner login of many repositories._
+
+    Args:
+        repositories (_list_): _A list of (owner, name) tuples._
+
+    Returns:
+        _tuple_: _The query string and its variables, each repository aliased as r0, r1, . . ._
+    """
+    arguments = []
+    aliases = []
+    variables = {}
+    for i, (owner, name) in enumerate(repositories):
+        arguments.append(f'$o{i}: String!, $n{i}: String!')
+        aliases.append(f'  r{i}: repository(owner: $o{i}, name: $n{i}) {{ owner {{ login }} }}')
+        variables[f'o{i}'] = owner
+        variables[f'n{i}'] = name
+    query = 'query(' + ', '.join(arguments) + ') {\n' + '\n'.join(aliases) + '\n}\n'
+    return query, variables
+
+
+@instrument('api.github.repo_owner_logins')
+def fetch_repo_owner_logins(repositories, auth = None, session = None, endpoint = GITHUB_GRAPHQL):
+    """_Look up who owns each of a batch of repositories now, with one GraphQL call._
+
+    GitHub follows renames and transfers, so the login can differ from the one in
+    the repository URL.
+
+    Args:
+        repositories (_list_): _A list of (owner, name) tuples._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        endpoint (_str_, optional): _The GraphQL endpoint._ Defaults to GITHUB_GRAPHQL.
+
+    Returns:
+        _list_: _One dict per repository with the `status` (200, 404, or None if GitHub returned another error) and the owner `login`._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+        if auth is None:
+            raise TypeError("The authentication token must be supplied explicitly or set as the environment variable GITHUB_TOKEN.")
+    if session is None:
+        session = http_session()
+    query, variables = build_owner_query(repositories)
+    response = session.post(endpoint,
+                            json={'query': query, 'variables': variables},
+                            headers={'Authorization': f'bearer {auth}'},
+                            timeout=60)
+    response.raise_for_status()
+    result = response.json()
+    data = result.get('data')
+    if data is None:
+        raise ValueError(f"GraphQL owner lookup failed: {result.get('errors')}")
+    not_found = set([i.get('path', [None])[0] for i in result.get('errors', [])
+                     if i.get('type') == 'NOT_FOUND'])
+    logins = []
+    for i in range(len(repositories)):
+        node = data.get(f'r{i}')
+        if node is not None and node.get('owner') is not None:
+            logins.append({'status': 200, 'login': node['owner'].get('login')})
+        else:
+            logins.append({'status': 404 if f'r{i}' in not_found else None, 'login': None})
+    return logins
+
+
+@instrument('crawl.resolve_repo_owners')
+def resolve_repo_owners(conn, repositories, auth = None, cache = None, session = None,
+                        api = GITHUB_API, endpoint = GITHUB_GRAPHQL, workers = 8, batch_size = 100,
+                        manager = "GitHub", verbose = True):
+    """_Assign owners to many repositories, fetching each distinct owner only once._
+
+    The current owner of each repository is looked up with batched GraphQL queries
+    (`batch_size` repositories per request), so transferred repositories get their
+    new owner and repositories that no longer exist get a 404 in `repoqualitychecks`.
+    Owner URLs (github.com/login) are grouped by their login as is. Each login is
+    then looked up in `cache` or fetched from GitHub once, all owners are upserted
+    and every repository in each group gets its `ownerid` in a single statement.
+    Repositories whose owner does not exist also get a 404.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url) tuples._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        cache (_OwnerCache_, optional): _A cache of owner profiles to consult and update._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+        endpoint (_str_, optional): _The GraphQL endpoint._ Defaults to GITHUB_GRAPHQL.
+        workers (int, optional): _The number of owner requests in flight at once._ Defaults to 8.
+        batch_size (int, optional): _Repositories per GraphQL owner lookup (GitHub allows up to 100)._ Defaults to 100.
+        manager (_str_, optional): _The repository manager name._ Defaults to "GitHub".
+        verbose (bool, optional): _Should the function print a summary?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `repositories`, `owners`, GitHub `requests`, `assigned` and `missing` repositories, and the `unresolved` repositoryids (to retry)._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+    if session is None:
+        session = http_session(workers = workers)
+    if cache is None:
+        cache = OwnerCache()
+    groups = {}
+    missing = []
+    unresolved = []
+
+    def add_to_group(login, repositoryid):
+        groups.setdefault(login.lower(), {'login': login, 'repositories': []})
+        groups[login.lower()]['repositories'].append(repositoryid)
+
+    repo_strings = []
+    for repositoryid, url in repositories:
+        repo_string = split_repo_url(url)
+        if repo_string is not None:
+            repo_strings.append((repositoryid, repo_string))
+        elif repo_owner_login(url) is not None:
+            add_to_group(repo_owner_login(url), repositoryid)
+    lookups = 0
+    for start in range(0, len(repo_strings), batch_size):
+        chunk = repo_strings[start:start + batch_size]
+        logins = fetch_repo_owner_logins([i[1] for i in chunk], auth, session, endpoint)
+        lookups = lookups + 1
+        for (repositoryid, _), result in zip(chunk, logins):
+            if result['status'] == 200:
+                add_to_group(result['login'], repositoryid)
+            elif result['status'] == 404:
+                missing.append((repositoryid, 404))
+            else:
+                unresolved.append(repositoryid)
+    to_fetch = [v['login'] for k, v in groups.items() if v['login'] not in cache]
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        fetched = list(executor.map(lambda x: fetch_owner(x, auth, session, api), to_fetch))
+    for login, result in zip(to_fetch, fetched):
+        if result['status'] in [200, 404]:
+            cache.set(login, result['owner'])
+    cache.save()
+    owner_values = []
+    for key, group in groups.items():
+        if group['login'] not in cache:
+            unresolved.extend(group['repositories'])
+            continue
+        owner = cache.get(group['login'])
+        if owner is None:
+            missing.extend([(i, 404) for i in group['repositories']])
+        else:
+            owner = dict(owner, managername = manager)
+            owner_values.extend([(i, owner) for i in group['repositories']])
+    bad_repo_query = """
+        INSERT INTO repoqualitychecks (repositoryid, badstatus)
+        VALUES %s
+        ON CONFLICT DO NOTHING;"""
+    try:
+        insert_owner_batch(conn, owner_values)
+        if len(missing) > 0:
+            with conn.cursor() as cur:
+                execute_values(cur, bad_repo_query, missing)
+        commit_db(conn)
+    except Exception as e:
+        print(f"Failed to assign repository owners.\n{e}")
+        rollback_db(conn)
+        raise
+    summary = {'repositories': len(repositories), 'owners': len(groups), 'requests': lookups + len(to_fetch),
+               'assigned': len(owner_values), 'missing': len(missing), 'unresolved': unresolved}
+    if verbose:
+        print(f"Assigned {summary['assigned']} repositories to {summary['owners']} owners "
+              + f"with {summary['requests']} GitHub requests, {summary['missing']} missing.")
+    return summary
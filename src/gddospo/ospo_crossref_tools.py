@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from .ospo_runtime_tools import http_session, retry_after_seconds
+from .ospo_db_tools import crossref_publication_values, commit_db, rollback_db
+from .ospo_metrics_tools import instrument
+
+CROSSREF_WORKS = 'https://api.crossref.org/works/'
+CROSSREF_CACHE = '../source_data/crossref_cache'
+DOI_PREFIXES = ['https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/',
+                'http://dx.doi.org/', 'doi:']
+
+
+def normalize_doi(doi):
+    """_Normalize a DOI so that cache keys and lookups are consistent._
+
+    Args:
+        doi (_str_): _A DOI, possibly as a URL or with a `doi:` prefix._
+
+    Returns:
+        _str_: _The lower-case DOI without any prefix._
+    """
+    doi = doi.strip().lower()
+    for prefix in DOI_PREFIXES:
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi
+
+
+class CrossrefCache:
+    """_A directory of raw CrossRef responses, one JSON file per normalized DOI._
+
+    DOIs that CrossRef does not know (404) are cached too, so that re-running an
+    enrichment over the same DOIs makes no network calls until the entries expire.
+    """
+
+    def __init__(self, path, ttl = 30 * 24 * 3600):
+        """_Create or open a cache directory._
+
+        Args:
+            path (_str_): _The cache directory, created if needed._
+            ttl (int, optional): _Seconds a cached response stays valid._ Defaults to 30 days.
+        """
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(path, exist_ok = True)
+
+    def _file(self, doi):
+        key = hashlib.sha1(normalize_doi(doi).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, doi):
+        """_Return the cached entry for a DOI, or None if it is missing or expired._
+
+        Returns:
+            _dict_: _With the normalized `doi`, the `fetched` time and the CrossRef `message` (None for a 404)._
+        """
+        try:
+            with open(self._file(doi)) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('fetched', 0) > self.ttl:
+            return None
+        return entry
+
+    def set(self, doi, message):
+        entry = {'doi': normalize_doi(doi), 'fetched': time.time(), 'message': message}
+        target = self._file(doi)
+        # Write then rename, so an interrupted run never leaves a partial file.
+        temp = target + '.' + str(threading.get_ident()) + '.tmp'
+        with open(temp, 'w') as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temp, target)
+        return entry
+
+
+class PoliteLimiter:
+    """_Space requests evenly across threads, following CrossRef's rate limit headers._"""
+
+    def __init__(self, rate = 10):
+        """_Create a limiter._
+
+        Args:
+            rate (int, optional): _Requests per second before CrossRef reports its limit._ Defaults to 10.
+        """
+        self.interval = 1 / rate
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+    def update(self, headers):
+        """_Adjust the spacing from `X-Rate-Limit-Limit` and `X-Rate-Limit-Interval` (e.g. `1s`)._"""
+        limit = headers.get('X-Rate-Limit-Limit')
+        interval = headers.get('X-Rate-Limit-Interval')
+        if limit is None or interval is None:
+            return None
+        try:
+            self.interval = float(interval.rstrip('s')) / max(int(limit), 1)
+        except ValueError:
+            pass
+        return None
+
+
+def crossref_session(workers = 3, mailto = None):
+    """_Return the shared pooled session that identifies itself for CrossRef's polite pool._
+
+    Args:
+        workers (int, optional): _The number of concurrent requests the session must support._ Defaults to 3.
+        mailto (_str_, optional): _A contact email, sent in the User-Agent._ Defaults to the `CROSSREF_MAILTO` environment variable.
+
+    Returns:
+        _requests.Session_: _A session with a connection pool sized for at least `workers`._
+    """
+    if mailto is None:
+        mailto = os.getenv('CROSSREF_MAILTO')
+    session = http_session('crossref', workers)
+    agent = 'ospo-data-management/0.1'
+    if mailto is not None:
+        agent = agent + f' (mailto:{mailto})'
+    session.headers.update({'User-Agent': agent})
+    return session
+
+
+@instrument('crossref.fetch_crossref_work')
+def fetch_crossref_work(doi, session, limiter = None, timeout = 30, max_retries = 3,
+                        endpoint = CROSSREF_WORKS):
+    """_Fetch one CrossRef work, retrying rate limited and failed requests._
+
+    Args:
+        doi (_str_): _A DOI._
+        session (_requests.Session_): _A pooled session._
+        limiter (_PoliteLimiter_, optional): _A limiter shared by all workers._ Defaults to None.
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 30.
+        max_retries (int, optional): _Retries for 429 and 5xx responses or network errors._ Defaults to 3.
+        endpoint (_str_, optional): _The works endpoint, may point to a local stub server._ Defaults to CROSSREF_WORKS.
+
+    Returns:
+        _dict_: _The HTTP `code` (None if every attempt failed) and the CrossRef `message`._
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.wait()
+        try:
+            response = session.get(endpoint + requests.utils.quote(normalize_doi(doi), safe = '/'),
+                                   timeout = timeout)
+        except requests.exceptions.RequestException as e:
+            response = None
+            print(f'Failed to fetch {doi}: {e}')
+        if response is not None:
+            if limiter is not None:
+                limiter.update(response.headers)
+            if response.status_code == 200:
+                return {'code': 200, 'message': response.json().get('message')}
+            if response.status_code == 404:
+                return {'code': 404, 'message': None}
+            if response.status_code != 429 and response.status_code < 500:
+                return {'code': response.status_code, 'message': None}
+        if attempt >= max_retries:
+            return {'code': None if response is None else response.status_code, 'message': None}
+        delay = 2 ** attempt
+        if response is not None and retry_after_seconds(response) is not None:
+            delay = retry_after_seconds(response)
+        if limiter is not None:
+            limiter.pause(delay)
+        else:
+            time.sleep(delay)
+        attempt = attempt + 1
+
+
+def fetch_crossref_works(dois, workers = 3, cache = None, session = None, limiter = None,
+                         timeout = 30, endpoint = CROSSREF_WORKS):
+    """_Fetch many CrossRef works concurrently, consulting the cache first._
+
+    Args:
+        dois (_list_): _DOIs to fetch._
+        workers (int, optional): _The number of requests in flight at once._ Defaults to 3.
+        cache (_CrossrefCache_, optional): _A response cache to consult and update._ Defaults to None.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        limiter (_PoliteLimiter_, optional): _A shared rate limiter._ Defaults to None.
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 30.
+        endpoint (_str_, optional): _The works endpoint._ Defaults to CROSSREF_WORKS.
+
+    Returns:
+        _dict_: _A mapping of each DOI (as given) to its CrossRef message, or None if CrossRef has no record or the request failed._
+    """
+    results = {}
+    to_fetch = []
+    for doi in dict.fromkeys(dois):
+        cached = cache.get(doi) if cache is not None else None
+        if cached is not None:
+            results[doi] = cached['message']
+        else:
+            to_fetch.append(doi)
+    if len(to_fetch) == 0:
+        return results
+    if session is None:
+        session = crossref_session(workers)
+    if limiter is None:
+        limiter = PoliteLimiter()
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        fetched = executor.map(lambda x: fetch_crossref_work(x, session, limiter, timeout,
+                                                             endpoint = endpoint), to_fetch)
+        for doi, result in zip(to_fetch, fetched):
+            results[doi] = result['message']
+            # Only definitive answers are cached, failures are retried next time.
+            if cache is not None and result['code'] in [200, 404]:
+                cache.set(doi, result['message'])
+    return results
+
+
+@instrument('crossref.update_crossref_batch')
+def update_crossref_batch(conn, works):
+    """_Write CrossRef metadata for many publications with a single UPDATE._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        works (_dict_): _A mapping of DOI (as stored in `publications`) to CrossRef message._
+
+    Returns:
+        _list_: _The DOIs that were updated._
+    """
+    values = [crossref_publication_values(message, doi) for doi, message in works.items()
+              if message is not None]
+    if len(values) == 0:
+        return []
+    pubquery = """UPDATE publications AS pub
+                    SET title = v.title,
+                        subtitle = v.subtitle,
+                        author = v.author,
+                        subject = v.subject,
+                        abstract = v.abstract,
+                        containertitle = v.containertitle,
+                        language = v.language,
+                        published = v.published,
+                        publisher = v.publisher,
+                        articleurl = v.articleurl,
+                        crossrefmeta = v.crossrefmeta,
+                        dateadded = v.dateadded
+                  FROM (VALUES %s) AS v(doi, title, subtitle, author, subject, abstract,
+                                        containertitle, language, published, publisher,
+                                        articleurl, crossrefmeta, dateadded)
+                  WHERE pub.doi = v.doi
+                  RETURNING pub.doi"""
+    # Casts keep the column types when a whole column of the batch is NULL.
+    template = """(%(doi)s, %(title)s, %(subtitle)s, %(author)s::jsonb, %(subject)s::text[],
+                   %(abstract)s, %(containertitle)s, %(language)s, %(published)s::date,
+                   %(publisher)s, %(articleurl)s, %(crossrefmeta)s::jsonb, %(dateadded)s::timestamp)"""
+    try:
+        with conn.cursor() as cur:
+            result = execute_values(cur, pubquery, values, template = template,
+                                    page_size = max(len(values), 1), fetch = True)
+        commit_db(conn)
+    except Exception as e:
+        print(f"Failed to update publications.\n{e}")
+        rollback_db(conn)
+        return []
+    return [i[0] for i in result]
+
+
+def enrich_publications(conn, dois = None, workers = 3, cache = None, session = None,
+                        limiter = None, batch_size = 500, verbose = True):
+    """_Add CrossRef metadata to publications, in batches._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        dois (_list_, optional): _DOIs as stored in `publications`._ Defaults to every publication without `crossrefmeta`.
+        workers (int, optional): _The number of CrossRef requests in flight at once._ Defaults to 3.
+        cache (_CrossrefCache_, optional): _A response cache to consult and update._ Defaults to a cache in the CROSSREF_CACHE environment variable's directory, or CROSSREF_CACHE.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        limiter (_PoliteLimiter_, optional): _A shared rate limiter._ Defaults to None.
+        batch_size (int, optional): _DOIs fetched and written per UPDATE._ Defaults to 500.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of DOIs `requested`, `updated` and `missing` (no CrossRef record or failed)._
+    """
+    if dois is None:
+        with conn.cursor() as cur:
+            cur.execute("""SELECT doi FROM publications
+                           WHERE crossrefmeta IS NULL AND doi IS NOT NULL;""")
+            dois = [i[0] for i in cur.fetchall()]
+    dois = list(dict.fromkeys(dois))
+    if cache is None:
+        cache = CrossrefCache(os.getenv('CROSSREF_CACHE', CROSSREF_CACHE))
+    if session is None and len(dois) > 0:
+        session = crossref_session(workers)
+    if limiter is None:
+        limiter = PoliteLimiter()
+    summary = {'requested': len(dois), 'updated': 0, 'missing': 0}
+    for i in range(0, len(dois), batch_size):
+        chunk = dois[i:i + batch_size]
+        works = fetch_crossref_works(chunk, workers = workers, cache = cache,
+                                     session = session, limiter = limiter)
+        updated = update_crossref_batch(conn, works)
+        summary['updated'] = summary['updated'] + len(updated)
+        summary['missing'] = summary['missing'] + len([k for k, v in works.items() if v is None])
+        if verbose:
+            print(f"Enriched {summary['updated']} of {summary['requested']} publications.")
+    return summary
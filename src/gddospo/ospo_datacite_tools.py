@@ -0,0 +1,220 @@
+import re
+import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from pytacite import DOIs, Clients
+from .ospo_db_tools import bulk_add_repos, clean_repo_name, batch
+from .ospo_runtime_tools import http_session, retry_after_seconds
+from .ospo_queue_tools import enqueue_repositories
+from .ospo_metrics_tools import instrument, count_records
+
+# Compiled once, rather than on every relatedIdentifier.
+GITHUB_REPO = re.compile(r'(https://github.com/[a-z0-9]+(?:(?:(?:[._]|__|[-]*)[a-z0-9]+)+)?/[a-z0-9]+(?:(?:(?:[._]|__|[-]*)[a-z0-9]+)+)?)')
+
+
+def clean_dc_repo(repo_name):
+    """_Pull a GitHub repository URL out of a DataCite related identifier._
+
+    Args:
+        repo_name (_str_): _A `relatedIdentifier` value._
+
+    Returns:
+        _str_: _The repository URL, or None if there is no GitHub repository._
+    """
+    if repo_name is None:
+        return None
+    aa = GITHUB_REPO.search(repo_name)
+    if aa:
+        return aa.group(0)
+    else:
+        return None
+
+
+def datacite_query_url(client = 'Zenodo', resource_type = 'software', per_page = 100):
+    """_Build the first cursor-paginated DataCite URL for a client's GitHub-linked records._
+
+    Args:
+        client (str, optional): _The DataCite client to search for._ Defaults to 'Zenodo'.
+        resource_type (str, optional): _The DataCite `resource_type_id`._ Defaults to 'software'.
+        per_page (int, optional): _Records per page, at most 1000._ Defaults to 100.
+
+    Returns:
+        _str_: _The URL of the first page._
+    """
+    client_record = Clients().query(client).get()
+    query = DOIs() \
+        .filter(client_id=client_record[0]["id"]) \
+        .filter(resource_type_id=resource_type) \
+        .filter(relatedIdentifers={"relatedIdentifiers.relatedIdentifier":'*github.com*'})
+    query._add_params("page[size]", per_page)
+    query._add_params("page[cursor]", "*")
+    return query.url
+
+
+@instrument('api.datacite.page')
+def fetch_datacite_page(url, session, timeout = 60, max_retries = 3):
+    """_Fetch one page of DataCite results, retrying rate limited and failed requests._
+
+    Args:
+        url (_str_): _The page URL, including its cursor._
+        session (_requests.Session_): _A pooled session._
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 60.
+        max_retries (int, optional): _Retries for 429 and 5xx responses or network errors._ Defaults to 3.
+
+    Returns:
+        _dict_: _The decoded response._
+    """
+    attempt = 0
+    while True:
+        try:
+            response = session.get(url, timeout = timeout)
+        except requests.exceptions.RequestException as e:
+            if attempt >= max_retries:
+                raise
+            response = None
+            print(f'Failed to fetch a DataCite page: {e}')
+        if response is not None and response.status_code != 429 and response.status_code < 500:
+            response.raise_for_status()
+            return response.json()
+        if attempt >= max_retries:
+            response.raise_for_status()
+        delay = 2 ** attempt
+        if response is not None and retry_after_seconds(response) is not None:
+            delay = retry_after_seconds(response)
+        time.sleep(delay)
+        attempt = attempt + 1
+
+
+def iter_datacite_pages(url, session = None, n_max = None, timeout = 60):
+    """_Follow DataCite cursor pagination, fetching the next page while the current one is processed._
+
+    Cursors are sequential, each page names the next, so one request is kept in
+    flight ahead of the caller. Unlike `pytacite`'s `paginate()` there is no
+    10,000 record limit unless `n_max` is set.
+
+    Args:
+        url (_str_): _The first page, from `datacite_query_url()`._
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to `http_session('datacite')`.
+        n_max (int, optional): _Stop after at least this many records._ Defaults to None (every page).
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 60.
+
+    Yields:
+        _list_: _The DataCite records of each page._
+    """
+    if session is None:
+        session = http_session('datacite')
+    count = 0
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        future = executor.submit(fetch_datacite_page, url, session, timeout)
+        while future is not None:
+            page = future.result()
+            next_url = page.get('links', {}).get('next')
+            count = count + len(page.get('data', []))
+            future = None
+            if next_url is not None and len(page.get('data', [])) > 0 and (n_max is None or count < n_max):
+                future = executor.submit(fetch_datacite_page, next_url, session, timeout)
+            yield page.get('data', [])
+
+
+def datacite_record_values(records):
+    """_Collect the `datacitepublication` rows and repository links of a page of records._
+
+    Records without a GitHub repository are skipped. As before, a record is linked
+    to the first repository among its related identifiers.
+
+    Args:
+        records (_list_): _DataCite records, as returned by the API._
+
+    Returns:
+        _dict_: _A mapping of DOI to row, each with `doi`, `datacitemeta`, `title`, `description` and `repo`._
+    """
+    rows = {}
+    for record in records:
+        record_attr = record.get("attributes", {})
+        gitrepos = [i for i in map(lambda x: clean_dc_repo(x.get("relatedIdentifier")),
+                                   record_attr.get("relatedIdentifiers") or []) if i]
+        if len(gitrepos) == 0 or record_attr.get("doi") in rows:
+            continue
+        title = [i.get("title") for i in record_attr.get("titles") or []]
+        description = [i.get("description") for i in record_attr.get("descriptions") or []]
+        rows[record_attr.get("doi")] = {"doi": record_attr.get("doi"),
+                                        "datacitemeta": json.dumps(record),
+                                        "title": title[0] if title else None,
+                                        "description": description[0] if description else None,
+                                        "repo": clean_repo_name(gitrepos[0])}
+    return rows
+
+
+def upsert_datacite_batch(conn, rows, repo_ids):
+    """_Insert or refresh many `datacitepublication` rows with one statement._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        rows (_dict_): _Rows from `datacite_record_values()`._
+        repo_ids (_dict_): _A mapping of repository URL to repositoryid, from `bulk_add_repos()`._
+
+    Returns:
+        _int_: _The number of rows written._
+    """
+    values = [dict(row, repositoryid = repo_ids.get(row['repo'])) for row in rows.values()]
+    values = [i for i in values if i['repositoryid'] is not None]
+    if len(values) == 0:
+        return 0
+    insert_query = """INSERT INTO datacitepublication (doi, datacitemeta, title, description, repositoryid)
+                      VALUES %s
+                      ON CONFLICT (doi) DO UPDATE
+                      SET datacitemeta = EXCLUDED.datacitemeta;"""
+    template = "(%(doi)s, %(datacitemeta)s::jsonb, %(title)s, %(description)s, %(repositoryid)s)"
+    with conn.cursor() as cur:
+        execute_values(cur, insert_query, values, template = template, page_size = len(values))
+    return len(values)
+
+
+@instrument('datacite.harvest')
+def harvest_datacite(conn, client = 'Zenodo', resource_type = 'software', per_page = 100,
+                     source = 'DataCite Submission', session = None, n_max = None, enqueue = True,
+                     verbose = True):
+    """_Harvest GitHub-linked DataCite records into `datacitepublication`, a page at a time._
+
+    Each page costs one transaction: the page's repositories are added with
+    `bulk_add_repos()` and its records are upserted with a single INSERT. New
+    repositories are not checked or crawled here; a crawl job is queued for each
+    repository the page added (see `ospo_queue_tools`), and `plan_repo_crawls()`
+    would find them in any case.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        client (str, optional): _The DataCite client to search for._ Defaults to 'Zenodo'.
+        resource_type (str, optional): _The DataCite `resource_type_id`._ Defaults to 'software'.
+        per_page (int, optional): _Records per page._ Defaults to 100.
+        source (str, optional): _The `ospoimportsources` name recorded for new repositories._ Defaults to 'DataCite Submission'.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        n_max (int, optional): _Stop after at least this many records._ Defaults to None (every page).
+        enqueue (bool, optional): _Queue a crawl job for each new repository? Needs `create_queue_tables()`._ Defaults to True.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `pages`, `records`, `linked` records and `repositories`._
+    """
+    url = datacite_query_url(client, resource_type, per_page)
+    summary = {'pages': 0, 'records': 0, 'linked': 0, 'repositories': 0}
+    for records in iter_datacite_pages(url, session = session, n_max = n_max):
+        count_records(len(records))
+        rows = datacite_record_values(records)
+        with batch(conn):
+            repo_ids, new_ids = bulk_add_repos(conn, [i['repo'] for i in rows.values()], source,
+                                               return_new = True)
+            linked = upsert_datacite_batch(conn, rows, repo_ids)
+            if enqueue:
+                new_ids = set(new_ids)
+                enqueue_repositories(conn, [(v, k) for k, v in repo_ids.items() if v in new_ids])
+        summary['pages'] = summary['pages'] + 1
+        summary['records'] = summary['records'] + len(records)
+        summary['linked'] = summary['linked'] + linked
+        summary['repositories'] = summary['repositories'] + len(repo_ids)
+        if verbose:
+            print(f"Page {summary['pages']}: linked {linked} of {len(records)} records "
+                  f"({summary['records']} records so far).")
+    return summary
@@ -1,13 +1,164 @@
 import re
+import io
+import sys
+import csv
+import contextlib
 import requests
 import json
 import datetime
 from crossref.restful import Works
 from psycopg2 import sql
 import os
-from github import Github
-from github import Auth
 from github.GithubException import UnknownObjectException
+from .ospo_runtime_tools import github_client, http_session
+from .gdd_tools import extract_repositories_batch
+from .ospo_metrics_tools import instrument
+from .ospo_blob_tools import blob_crawl_values
+
+
+# Connections that are currently inside a `batch()`, keyed by id(conn), with
+# their stack of open record savepoints and the cache updates waiting on each.
+BATCHES = {}
+
+
+class RecordRolledBack(Exception):
+    """_Raised when a helper rolls back the `record()` it runs in, so the record stops there._"""
+
+
+def commit_db(conn):
+    """_Commit, unless the connection is inside a `batch()`._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    if id(conn) not in BATCHES:
+        conn.commit()
+
+
+def rollback_db(conn):
+    """_Roll back the current record, or the whole transaction outside a `batch()`._
+
+    Inside a `batch()` the helpers roll back to the innermost `record()` savepoint, so
+    one failed record does not discard the rest of the batch. That also discards the
+    record's earlier statements, so `RecordRolledBack` is raised and `record()` drops
+    the record, rather than letting the helper carry on as if they had been kept.
+    Without a savepoint the whole batch is rolled back and `batch()` raises on exit.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+
+    Raises:
+        RecordRolledBack: _Inside a `record()`._
+    """
+    state = BATCHES.get(id(conn))
+    if state is None:
+        conn.rollback()
+    elif len(state['savepoints']) > 0:
+        with conn.cursor() as cur:
+            cur.execute(f"ROLLBACK TO SAVEPOINT {state['savepoints'][-1]};")
+        state['cache'][-1].clear()
+        error = sys.exc_info()[1]
+        raise RecordRolledBack("A helper rolled back the record" + (f" after: {error}" if error else "."))
+    else:
+        conn.rollback()
+        state['cache'] = [[]]
+        state['aborted'] = True
+
+
+def cache_on_commit(conn, update, *args):
+    """_Apply a `LookupCache` update once the current transaction has committed._
+
+    Outside a `batch()` the helpers commit as they go, so the update is applied at
+    once. Inside one it waits for the batch to commit, and is dropped if the batch
+    or the `record()` it was made in rolls back, so the cache never holds an id
+    the database does not.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        update (_function_): _A cache method, e.g. `cache.set_repository`._
+        args: _The arguments for `update`._
+    """
+    state = BATCHES.get(id(conn))
+    if state is None:
+        update(*args)
+    else:
+        state['cache'][-1].append((update, args))
+
+
+@contextlib.contextmanager
+def batch(conn):
+    """_Group many helper calls into a single transaction._
+
+    The `ospo_db_tools` helpers normally commit after every row. Inside this
+    context their commits are deferred and the transaction commits once on exit
+    (or rolls back if an exception escapes). Nested batches join the outer one.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+
+    Example:
+        with batch(conn):
+            for doi in dois:
+                with record(conn):
+                    add_publication_db(conn, doi, 'xDD Pipeline Submission')
+    """
+    if id(conn) in BATCHES:
+        yield conn
+        return
+    state = {'savepoints': [], 'aborted': False, 'cache': [[]]}
+    BATCHES[id(conn)] = state
+    try:
+        yield conn
+    except Exception:
+        del BATCHES[id(conn)]
+        conn.rollback()
+        raise
+    del BATCHES[id(conn)]
+    if state['aborted']:
+        conn.rollback()
+        raise RuntimeError("A helper rolled back the transaction outside of a record(), the batch was discarded.")
+    conn.commit()
+    for update, args in state['cache'][0]:
+        update(*args)
+
+
+@contextlib.contextmanager
+def record(conn, verbose = True):
+    """_Isolate one record inside a `batch()` with a savepoint._
+
+    If the body raises, or a helper in it calls `rollback_db()`, only this record's
+    changes are rolled back, the error is printed and the batch continues. Outside
+    a batch this does nothing.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        verbose (bool, optional): _Should errors be printed?_ Defaults to True.
+    """
+    state = BATCHES.get(id(conn))
+    if state is None:
+        yield conn
+        return
+    savepoint = f"ospo_record_{len(state['savepoints'])}"
+    with conn.cursor() as cur:
+        cur.execute(f"SAVEPOINT {savepoint};")
+    state['savepoints'].append(savepoint)
+    state['cache'].append([])
+    try:
+        yield conn
+    except Exception as e:
+        with conn.cursor() as cur:
+            cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint};")
+        state['cache'][-1].clear()
+        if verbose:
+            print(f"Record rolled back: {e}")
+    else:
+        with conn.cursor() as cur:
+            cur.execute(f"RELEASE SAVEPOINT {savepoint};")
+    finally:
+        state['savepoints'].pop()
+        # A released record's cache updates now wait on the enclosing transaction.
+        updates = state['cache'].pop()
+        state['cache'][-1].extend(updates)
 
 
 def clean_repo_name(repo_name):
@@ -28,11 +179,12 @@ def clean_repo_name(repo_name):
         repo_check = 'https://' + re.sub('/$', '', repo_name)
     return repo_check
 
-def check_repository_url(repo):
+def check_repository_url(repo, timeout = 10):
     """_Validate the repository path using a HEAD call._
 
     Args:
         repo (_str_): _A cleaned repository URL_
+        timeout (int, optional): _Seconds before the HEAD call is abandoned._ Defaults to 10.
 
     Returns:
         _bool_: _Returns True if the HEAD call returns 200._
@@ -41,7 +193,7 @@ def check_repository_url(repo):
         return False
     check_repo = clean_repo_name(repo)
     try:
-        check = requests.head(check_repo, allow_redirects=True)
+        check = http_session().head(check_repo, allow_redirects=True, timeout=timeout)
         if check.status_code == 200:
             if check.url == check_repo:
                 return {"status": True, "redirect": None }    
@@ -51,16 +203,21 @@ def check_repository_url(repo):
         print(f'Failed to resolve: {e}')
     return {"status": False, "redirect": None }
 
-def check_repository_db(conn, repo):
+@instrument('db.check_repository_db')
+def check_repository_db(conn, repo, cache = None):
     """_Is the repository in the OSPO Database?_
 
     Args:
         conn (_type_): _A valid database connection._
         repo (_type_): _A valid repository URL._
+        cache (_LookupCache_, optional): _A lookup cache consulted before the database._ Defaults to None.
 
     Returns:
         _int_: _A valid repositoryid (from the OSPO database), or None._
     """
+    cached = cache.repository(repo) if cache is not None else None
+    if cached is not None:
+        return (cached,)
     cur = conn.cursor()
     check = """SELECT repositoryid
                FROM repositories
@@ -69,26 +226,39 @@ def check_repository_db(conn, repo):
     # There is a constraint on unique URLs
     repos = cur.fetchone()
     cur.close()
+    if cache is not None and repos is not None:
+        cache_on_commit(conn, cache.set_repository, repo, repos[0])
     return repos
 
 def check_last_crawl(conn, repository):
+    # ORDER BY ... LIMIT 1 rather than MAX(), so a partitioned `repositorycrawls`
+    # is read newest month first and stops at the first crawl found.
     crawl_check = """
-        SELECT rp.url, MAX(rpc.crawl_at)
+        SELECT rp.url, lc.crawl_at
         FROM repositories AS rp
-        INNER JOIN repositorycrawls AS rpc ON rp.repositoryid = rpc.repositoryid
-        WHERE url = %s
-        GROUP BY rp.url;"""
+        CROSS JOIN LATERAL (SELECT rpc.crawl_at
+                            FROM repositorycrawls AS rpc
+                            WHERE rpc.repositoryid = rp.repositoryid
+                              AND rpc.crawl_at IS NOT NULL
+                            ORDER BY rpc.crawl_at DESC
+                            LIMIT 1) AS lc
+        WHERE url = %s;"""
     with conn.cursor() as cur:
         cur.execute(crawl_check, (repository,))
         last_crawl = cur.fetchone()
     return last_crawl
 
-def check_owner(conn, owner):
+def check_owner(conn, owner, cache = None):
+    cached = cache.owner(owner) if cache is not None else None
+    if cached is not None:
+        return (cached,)
     owner_db = """
     SELECT ownerid FROM repositoryowners WHERE ownername = %s"""
     with conn.cursor() as cur:
         cur.execute(owner_db, (owner,))
         ownerid = cur.fetchone()
+    if cache is not None and ownerid is not None:
+        cache_on_commit(conn, cache.set_owner, owner, ownerid[0])
     return ownerid
 
 def check_repository_owner(conn, repository):
@@ -101,23 +271,25 @@ def check_repository_owner(conn, repository):
         ownerid = cur.fetchone()
     return ownerid
 
-def update_repo_add_owner(conn, repository, auth = None, update = True, manager = "GitHub"):
+@instrument('db.update_repo_add_owner')
+def update_repo_add_owner(conn, repository, auth = None, update = True, manager = "GitHub", repository_id = None):
     if re.search(r'github\.com', repository) is None:
         # Currently only supports GitHub
         return False
     else:
-        repository_id = check_repository_db(conn, repository)
-        owner_id = check_repository_owner(conn, repository)
+        if repository_id is None:
+            repository_id = check_repository_db(conn, repository)
         if repository_id is None:
             return False
-        if owner_id is not False and update is False:
-            return False
+        if update is False:
+            owner_id = check_repository_owner(conn, repository)
+            if owner_id is not False:
+                return False
     if auth is None:
         auth = os.getenv('GITHUB_TOKEN')
         if auth is None:
             return False
-    G_AUTH = Auth.Token(auth)
-    gi = Github(auth=G_AUTH)
+    gi = github_client(auth)
     repo_string = re.findall(r'(github\.com\/)(.+?)$', repository)[0][1]
     repo_string = re.sub('/$', '', repo_string)
     if re.search('.+/.+$', repo_string):
@@ -132,9 +304,9 @@ def update_repo_add_owner(conn, repository, auth = None, update = True, manager
             try:
                 with conn.cursor() as cur:
                     cur.execute(bad_repo_query, (repository_id, 404))
-                conn.commit()
+                commit_db(conn)
             except Exception:
-                conn.rollback()
+                rollback_db(conn)
             return False
     else:
         owner = gi.get_user(repo_string)
@@ -165,9 +337,10 @@ def update_repo_add_owner(conn, repository, auth = None, update = True, manager
         cur.execute(insert_owner, owner_data)
         owner_id = cur.fetchone()
         cur.execute(add_repo_owner, (owner_id[0], repository_id))
-    conn.commit()
+    commit_db(conn)
 
-def update_repo_crawl_db(conn, repository, auth = None, delay = 2):
+@instrument('db.update_repo_crawl_db')
+def update_repo_crawl_db(conn, repository, auth = None, delay = 2, repository_id = None, owner_id = False):
     """_summary_
 
     Args:
@@ -175,6 +348,8 @@ def update_repo_crawl_db(conn, repository, auth = None, delay = 2):
         repository (_str_): _A valid URL string for a repository_
         auth (_str_, optional): _A valid GitHub (currently) authorization token._. Defaults to None.
         delay (int, optional): _description_. Defaults to 2.
+        repository_id (_int_, optional): _The repositoryid, if already known (e.g., from `plan_repo_crawls()`). The repository and last crawl lookups are then skipped._ Defaults to None.
+        owner_id (_int_, optional): _The ownerid, if already known. None means the repository has no owner yet._ Defaults to False.
 
     Returns:
         _type_: _description_
@@ -184,22 +359,25 @@ def update_repo_crawl_db(conn, repository, auth = None, delay = 2):
         # Currently only supports GitHub
         raise ValueError(f"Repository {repository} is not a Github repository. Only Github repositories are supported at this time.")
     else:
-        repository_id = check_repository_db(conn, repository)
-        owner_id = check_repository_owner(conn, repository)
+        planned = repository_id is not None
+        if not planned:
+            repository_id = check_repository_db(conn, repository)
+        if owner_id is False:
+            owner_id = check_repository_owner(conn, repository)
         if repository_id is None:
             raise ValueError(f"Repository {repository} does not exist in the database.")
         if owner_id is None:
-            update_repo_add_owner(conn, repository)
-        crawl_check = check_last_crawl(conn, repository)
-        if crawl_check is not None:
-            if current_date - crawl_check[1] < datetime.timedelta(days = delay):
-                raise ValueError(f"Last crawl date is within less than {delay} days of the current crawl.")
+            update_repo_add_owner(conn, repository, repository_id = repository_id)
+        if not planned:
+            crawl_check = check_last_crawl(conn, repository)
+            if crawl_check is not None:
+                if current_date - crawl_check[1] < datetime.timedelta(days = delay):
+                    raise ValueError(f"Last crawl date is within less than {delay} days of the current crawl.")
         if auth is None:
             auth = os.getenv('GITHUB_TOKEN')
             if auth is None:
                 raise TypeError("The authentication token must be supplied explicitly or set as the environment variable GITHUB_TOKEN.")
-        G_AUTH = Auth.Token(auth)
-        gi = Github(auth=G_AUTH)
+        gi = github_client(auth)
     repo_string = re.findall(r'(github\.com\/)(.+?)$', clean_repo_name(repository))[0][1]
     repo_object = gi.get_repo(repo_string)
     try:
@@ -213,14 +391,21 @@ def update_repo_crawl_db(conn, repository, auth = None, delay = 2):
     homepage = repo_object.homepage
     if homepage == '':
         homepage = None
+    # The last push (not the Last-Modified header), as naive UTC like the GraphQL crawl's `pushedAt`.
+    last_pushed = repo_object.pushed_at
+    if last_pushed is not None and last_pushed.tzinfo is not None:
+        last_pushed = last_pushed.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+    # PyGithub adds the request `url` to the languages it returns, drop it so only
+    # language sizes are stored, as the GraphQL crawl stores them.
+    languages = {k: v for k, v in repo_object.get_languages().items() if k != 'url'}
     repo_values = {'repositoryid': repository_id,
                    'crawl_at': current_date,
                    'name': repo_object.name,
                    'description': repo_object.description,
                    'homepage': homepage,
-                   'last_pushed': repo_object.last_modified_datetime,
+                   'last_pushed': last_pushed,
                    'license_name': license_name,
-                   'language': json.dumps(repo_object.get_languages()),
+                   'language': json.dumps(languages),
                    'topics': json.dumps(repo_object.get_topics()),
                    'readme': readme,
                    'stargazers': repo_object.stargazers_count,
@@ -232,18 +417,22 @@ def update_repo_crawl_db(conn, repository, auth = None, delay = 2):
         INSERT INTO repositorycrawls (repositoryid, crawl_at,
                                       name, description, homepage,
                                       last_pushed, license_name,
-                                      readme, stargazers, issues,
-                                      openissues, forks, raw, language, topics)
+                                      readmehash, stargazers, issues,
+                                      openissues, forks, rawhash, archived, language, topics)
         VALUES
         (%(repositoryid)s, %(crawl_at)s, %(name)s, %(description)s, %(homepage)s,
-         %(last_pushed)s, %(license_name)s, %(readme)s,
-         %(stargazers)s, %(issues)s, %(openissues)s, %(forks)s, %(raw)s, %(language)s, %(topics)s)"""
+         %(last_pushed)s, %(license_name)s, %(readmehash)s,
+         %(stargazers)s, %(issues)s, %(openissues)s, %(forks)s, %(rawhash)s, %(archived)s,
+         %(language)s, %(topics)s)"""
+    # The README and raw payload go to `crawlblobs`, stored once however often they are crawled.
+    repo_values = blob_crawl_values(conn, [repo_values])[0]
     with conn.cursor() as cur:
         cur.execute(insert_query, repo_values)
-    conn.commit()
+    commit_db(conn)
     return True
 
-def insert_repository_db(conn, repo, verbose = True, crawl = True):
+@instrument('db.insert_repository_db')
+def insert_repository_db(conn, repo, verbose = True, crawl = True, cache = None):
     """_Add a new repository to the OSPO Database_
 
     Args:
@@ -251,6 +440,7 @@ def insert_repository_db(conn, repo, verbose = True, crawl = True):
         repo (_type_): _A URL string for a repository._
         verbose (bool, optional): _Should the function return verbose text_? Defaults to True.
         crawl (bool, optional): _On repository insert should we also run a crawl_? Defaults to True.
+        cache (_LookupCache_, optional): _A lookup cache to update with the new repositoryid._ Defaults to None.
 
     Returns:
         _type_: _description_
@@ -262,9 +452,12 @@ def insert_repository_db(conn, repo, verbose = True, crawl = True):
                 RETURNING repositoryid;"""
     cur.execute(insert, (repo,))
     result = cur.fetchone()
-    conn.commit()
+    commit_db(conn)
+    if cache is not None and result is not None:
+        cache_on_commit(conn, cache.set_repository, repo, result[0])
     if crawl:
-        update_repo_crawl_db(conn, repo)
+        # On a conflict nothing is returned, so the crawl looks the repository up itself.
+        update_repo_crawl_db(conn, repo, repository_id = result[0] if result is not None else None)
     if verbose:
         print(f"Added the repository {repo} to the database.")
     cur.close()
@@ -299,19 +492,24 @@ def get_datetime(dt_list):
         case _:
             return None
 
-def add_repository_source(conn, repositoryid, source):
+def add_repository_source(conn, repositoryid, source, cache = None):
     cur = conn.cursor()
     insert_source = """INSERT INTO repositorysources(repositoryid, sourceid)
                 VALUES (%s, (SELECT sourceid FROM ospoimportsources WHERE sourcename = %s))
                 ON CONFLICT DO NOTHING;"""
+    if cache is not None and source in cache.sources:
+        insert_source = """INSERT INTO repositorysources(repositoryid, sourceid)
+                    VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING;"""
+        source = cache.sources[source]
     if isinstance(repositoryid, tuple):
         repositoryid = repositoryid[0]
     cur.execute(insert_source, (repositoryid, source))
-    conn.commit()
+    commit_db(conn)
     cur.close()
 
-def update_repo_404(conn, repo, verbose = False):
-    repoid = check_repository_db(conn, repo)
+def update_repo_404(conn, repo, verbose = False, cache = None):
+    repoid = check_repository_db(conn, repo, cache = cache)
     if repoid:
         bad_repo_query = """
             INSERT INTO repoqualitychecks (repositoryid, badstatus)
@@ -320,23 +518,26 @@ def update_repo_404(conn, repo, verbose = False):
             """
         try:
             with conn.cursor() as cur:
-                cur.execute(bad_repo_query, (repoid, 404))
-            conn.commit()
+                cur.execute(bad_repo_query, (repoid,))
+            commit_db(conn)
             if verbose:
                 print(f'Repository {repo} is in the database but can''t be found. Updated quality checks.')
             return {"repository": repoid, "status": 400}
         except Exception as e:
             print(f"Failed to update.\n{e}")
-            conn.rollback()
+            rollback_db(conn)
     
 
-def add_repo_db(conn, repo, source, verbose = True):
+@instrument('db.add_repo_db')
+def add_repo_db(conn, repo, source, verbose = True, cache = None, crawl = True):
     """_Add a repository to the OSPO database_
 
     Args:
         conn (_type_): _A psycopg2 connection object, to the OSPO database._
         repo (_str_): _A string representing the repository location._
         source (_str_): _A valid source type from which the repository was obtained._
+        cache (_LookupCache_, optional): _A lookup cache consulted before the database._ Defaults to None.
+        crawl (bool, optional): _Crawl a new repository now, rather than leaving it to a crawl job?_ Defaults to True.
 
     Returns:
         _int_: _The repositoryid for the new repository._
@@ -346,9 +547,9 @@ def add_repo_db(conn, repo, source, verbose = True):
         if verbose:
             print(f'Repository {repo_check} (from {repo}) does not have a valid name.')
         return None
-    repositoryid = check_repository_db(conn, repo_check)
+    repositoryid = check_repository_db(conn, repo_check, cache = cache)
     if repositoryid is None:
-        repositoryid = insert_repository_db(conn, repo_check)
+        repositoryid = insert_repository_db(conn, repo_check, crawl = crawl, cache = cache)
         if verbose:
             print(f"Inserted the repository {repo_check} to the database.")
     else:
@@ -356,27 +557,91 @@ def add_repo_db(conn, repo, source, verbose = True):
             print(f"The repository {repo_check} was already in the database.")
     if isinstance(repositoryid, tuple):
         repositoryid = repositoryid[0]
-    add_repository_source(conn, repositoryid, source)
+    add_repository_source(conn, repositoryid, source, cache = cache)
     check_url = check_repository_url(repo_check)
     if check_url.get('status') == False:
-        update_repo_404(conn, repo_check)
+        update_repo_404(conn, repo_check, cache = cache)
         return None
     elif check_url.get('redirect'):
         redir_repo_query = """
                 INSERT INTO repoqualitychecks (repositoryid, badstatus, url)
-                VALUES (%s, 301, %s);
+                VALUES (%s, 301, %s)
+                ON CONFLICT DO NOTHING;
                 """
         try:
             with conn.cursor() as cur:
-                cur.execute(bad_repo_query, (repositoryid, 301, check_url.get('redirect')))
-            conn.commit()
+                cur.execute(redir_repo_query, (repositoryid, check_url.get('redirect')))
+            commit_db(conn)
         except Exception:
-            conn.rollback()
+            rollback_db(conn)
         if verbose:
             print(f'Repository {repo_check} (from {repo}) does not appear to exist.')
         return None
     return repositoryid
 
+@instrument('db.bulk_add_repos')
+def bulk_add_repos(conn, urls, source, return_new = False):
+    """_Add many repositories to the OSPO database using set-based statements._
+
+    URLs are cleaned with `clean_repo_name()` and deduplicated in memory, copied
+    into a temporary table with COPY, and then upserted into `repositories` and
+    `repositorysources` in one transaction. Unlike `add_repo_db()` this does not
+    check the URL or crawl the repository, those steps are left to the crawl jobs.
+
+    Args:
+        conn (_connection_): _A psycopg2 connection object, to the OSPO database._
+        urls (_list_): _Strings representing repository locations._
+        source (_str_): _A valid source type from which the repositories were obtained, or None to skip `repositorysources`._
+        return_new (bool, optional): _Also return the repositoryids this call added?_ Defaults to False.
+
+    Returns:
+        _dict_: _A mapping of cleaned repository URL to repositoryid, or a (mapping, list of new repositoryids) tuple if `return_new`._
+    """
+    clean_urls = list(dict.fromkeys([i for i in map(clean_repo_name, urls) if i]))
+    if len(clean_urls) == 0:
+        return ({}, []) if return_new else {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([[i] for i in clean_urls])
+    buffer.seek(0)
+    # Inside a `batch()` an earlier call's table is still there until the commit.
+    temp_table = """
+        CREATE TEMPORARY TABLE IF NOT EXISTS repoimport (url TEXT PRIMARY KEY)
+        ON COMMIT DROP;
+        TRUNCATE repoimport;"""
+    insert_repos = """
+        INSERT INTO repositories (url)
+        SELECT url FROM repoimport
+        ON CONFLICT DO NOTHING
+        RETURNING repositoryid;"""
+    insert_sources = """
+        INSERT INTO repositorysources (repositoryid, sourceid)
+        SELECT rp.repositoryid, ois.sourceid
+        FROM repositories AS rp
+        INNER JOIN repoimport AS ri ON ri.url = rp.url
+        INNER JOIN ospoimportsources AS ois ON ois.sourcename = %s
+        ON CONFLICT DO NOTHING;"""
+    repo_ids = """
+        SELECT rp.url, rp.repositoryid
+        FROM repositories AS rp
+        INNER JOIN repoimport AS ri ON ri.url = rp.url;"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(temp_table)
+            cur.copy_expert("COPY repoimport (url) FROM STDIN WITH (FORMAT csv)", buffer)
+            cur.execute(insert_repos)
+            new_ids = [i[0] for i in cur.fetchall()]
+            if source is not None:
+                cur.execute(insert_sources, (source,))
+            cur.execute(repo_ids)
+            result = dict(cur.fetchall())
+        commit_db(conn)
+    except Exception as e:
+        print(f"Failed to add repositories.\n{e}")
+        rollback_db(conn)
+        raise
+    return (result, new_ids) if return_new else result
+
 def update_repo_name_db(conn, repository, drop = True):
     if re.search('/$', repository):
         true_repo_id = check_repository_db(conn, repo = repository)
@@ -390,7 +655,7 @@ def update_repo_name_db(conn, repository, drop = True):
             WHERE url = %s"""
         with conn.cursor() as cur:
             cur.execute(update_repo_name, (re.sub('/$', '', repository), repository))
-        conn.commit()
+        commit_db(conn)
     else:
         tables = ['repositorycrawls', 'uwrepositories',
                   'publicationrepolinks', 'repoqualitychecks',
@@ -411,10 +676,13 @@ def update_repo_name_db(conn, repository, drop = True):
         with conn.cursor() as cur:
             cur.execute(reassign_duplicate, (new_repo_id, true_repo_id))
             cur.execute(delete_duplicate, (repository,))
-        conn.commit()
+        commit_db(conn)
     return None
 
-def check_publication_db(conn, doi):
+def check_publication_db(conn, doi, cache = None):
+    cached = cache.publication(doi) if cache is not None else None
+    if cached is not None:
+        return (cached,)
     cur = conn.cursor()
     check = """SELECT publicationid
                FROM publications
@@ -426,10 +694,44 @@ def check_publication_db(conn, doi):
         cur.close()
     except Exception as e:
         print(e)
-        conn.rollback()
+        rollback_db(conn)
+    if cache is not None and pubs is not None:
+        cache_on_commit(conn, cache.set_publication, doi, pubs[0])
     return pubs
 
-def insert_publication_db(conn, doi):
+@instrument('db.check_publications_db')
+def check_publications_db(conn, dois, cache = None):
+    """_Which of these DOIs are already in the OSPO database?_
+
+    Args:
+        conn (_connection_): _A valid database connection._
+        dois (_list_): _DOIs to look up, e.g., a page of xDD results._
+        cache (_LookupCache_, optional): _A lookup cache consulted before, and updated by, the query._ Defaults to None.
+
+    Returns:
+        _dict_: _A mapping of DOI to publicationid for the DOIs that exist._
+    """
+    found = {}
+    missing = []
+    for doi in dict.fromkeys(dois):
+        cached = cache.publication(doi) if cache is not None else None
+        if cached is not None:
+            found[doi] = cached
+        else:
+            missing.append(doi)
+    if len(missing) > 0:
+        check = """SELECT doi, publicationid
+                   FROM publications
+                   WHERE doi = ANY(%s)"""
+        with conn.cursor() as cur:
+            cur.execute(check, (missing,))
+            for doi, publicationid in cur.fetchall():
+                found[doi] = publicationid
+                if cache is not None:
+                    cache_on_commit(conn, cache.set_publication, doi, publicationid)
+    return found
+
+def insert_publication_db(conn, doi, cache = None):
     cur = conn.cursor()
     insert = """INSERT INTO publications(doi)
                 VALUES (%s)
@@ -437,57 +739,83 @@ def insert_publication_db(conn, doi):
                 RETURNING publicationid;"""
     cur.execute(insert, (doi,))
     result = cur.fetchone()
-    conn.commit()
+    commit_db(conn)
     cur.close()
+    if cache is not None and result is not None:
+        cache_on_commit(conn, cache.set_publication, doi, result[0])
     return result
 
-def add_publication_source(conn, publicationid, source):
+def add_publication_source(conn, publicationid, source, cache = None):
     cur = conn.cursor()
     insert_source = """INSERT INTO publicationimport(publicationid, sourceid)
                 VALUES (%s, (SELECT sourceid FROM ospoimportsources WHERE sourcename = %s))
                 ON CONFLICT DO NOTHING;"""
+    if cache is not None and source in cache.sources:
+        insert_source = """INSERT INTO publicationimport(publicationid, sourceid)
+                    VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING;"""
+        source = cache.sources[source]
     if isinstance(publicationid, tuple):
         publicationid = publicationid[0]
     cur.execute(insert_source, (publicationid, source))
-    conn.commit()
+    commit_db(conn)
     cur.close()
 
-def add_publication_db(conn, doi, source):
+@instrument('db.add_publication_db')
+def add_publication_db(conn, doi, source, cache = None, enrich = True):
     """_Add a new publication to the database and fetch relevant metadata._
 
     Args:
         conn (_type_): _A psycopg2 connection object._
         doi (_type_): _A valid crossref DOI_
         source (_type_): _A valid publication source from the OSPO source table._
+        cache (_LookupCache_, optional): _A lookup cache consulted before the database._ Defaults to None.
+        enrich (bool, optional): _Fetch CrossRef metadata now? Use `False` and `ospo_crossref_tools.enrich_publications()` to enrich in batches._ Defaults to True.
 
     Returns:
         _int_: _An integer value for the new publication id generated._
     """
-    publicationid = check_publication_db(conn, doi)
+    publicationid = check_publication_db(conn, doi, cache = cache)
     if publicationid is None:
-        publicationid = insert_publication_db(conn, doi)
-        pubupdateid = add_crossref_meta(conn, doi)
-    add_publication_source(conn, publicationid, source)
+        publicationid = insert_publication_db(conn, doi, cache = cache)
+        if enrich:
+            pubupdateid = add_crossref_meta(conn, doi)
+    add_publication_source(conn, publicationid, source, cache = cache)
     return publicationid
 
+def crossref_publication_values(paper_cross, doi = None):
+    """_Map a CrossRef work onto the columns of the `publications` table._
+
+    Args:
+        paper_cross (_dict_): _The `message` of a CrossRef works response._
+        doi (_str_, optional): _The DOI as stored in `publications`._ Defaults to the CrossRef DOI.
+
+    Returns:
+        _dict_: _Column values, keyed by column name._
+    """
+    published = paper_cross.get('published') or paper_cross.get('issued') or {}
+    date_parts = published.get('date-parts')
+    return {'title': clean_crossref_array(paper_cross.get('title')),
+            'subtitle': clean_crossref_array(paper_cross.get('subtitle')),
+            'author': json.dumps(paper_cross.get('author')),
+            'subject': paper_cross.get('subject'),
+            'abstract': paper_cross.get('abstract'),
+            'containertitle': clean_crossref_array(paper_cross.get('container-title')),
+            'language': paper_cross.get('language'),
+            'published': get_datetime(date_parts) if date_parts and date_parts[0] and date_parts[0][0] else None,
+            'publisher': paper_cross.get('publisher'),
+            'articleurl': paper_cross.get('URL'),
+            'dateadded': datetime.datetime.now(),
+            'crossrefmeta': json.dumps(paper_cross),
+            'doi': doi if doi is not None else paper_cross.get('DOI')}
+
+@instrument('db.add_crossref_meta')
 def add_crossref_meta(conn, doi):
     cur = conn.cursor()
     works = Works()
     paper_cross = works.doi(doi)
     if paper_cross:
-        paper_cross_up = {'title': clean_crossref_array(paper_cross.get('title')),
-                        'subtitle': clean_crossref_array(paper_cross.get('subtitle')),
-                        'author': json.dumps(paper_cross.get('author')),
-                        'subject': paper_cross.get('subject'),
-                        'abstract': paper_cross.get('abstract'),
-                        'containertitle': clean_crossref_array(paper_cross.get('container-title')),
-                        'language': paper_cross.get('language'),
-                        'published': get_datetime(paper_cross.get('published').get('date-parts')),
-                        'publisher': paper_cross.get('publisher'),
-                        'articleurl': paper_cross.get('URL'),
-                        'dateadded': datetime.datetime.now(),
-                        'crossrefmeta': json.dumps(paper_cross),
-                        'doi': paper_cross.get('DOI')}
+        paper_cross_up = crossref_publication_values(paper_cross)
         pubquery = """UPDATE publications
                         SET title = %(title)s,
                             subtitle = %(subtitle)s,
@@ -504,11 +832,11 @@ def add_crossref_meta(conn, doi):
                     WHERE doi = %(doi)s
                     RETURNING doi"""
         cur.execute(pubquery, paper_cross_up)
-        conn.commit()
+        commit_db(conn)
         cur.close()
     return None
 
-def link_publication_repository_db(conn, publicationid, repositoryid, source):
+def link_publication_repository_db(conn, publicationid, repositoryid, source, cache = None):
     cur = conn.cursor()
     insert_link = """INSERT INTO publicationrepolinks (publicationlinkid, publicationid, repositoryid)
                      VALUES ((SELECT publicationlinkid
@@ -517,8 +845,13 @@ def link_publication_repository_db(conn, publicationid, repositoryid, source):
                               %s,
                               %s)
                               ON CONFLICT DO NOTHING;"""
+    if cache is not None and source in cache.linktypes:
+        insert_link = """INSERT INTO publicationrepolinks (publicationlinkid, publicationid, repositoryid)
+                         VALUES (%s, %s, %s)
+                         ON CONFLICT DO NOTHING;"""
+        source = cache.linktypes[source]
     cur.execute(insert_link, (source, publicationid, repositoryid))
-    conn.commit()
+    commit_db(conn)
     cur.close()
 
 def get_repository_urls(conn):
@@ -529,26 +862,43 @@ def get_repository_urls(conn):
         results = cur.fetchall()
     return list(results)
 
-def process_gdd_hit(conn, doi, highlight):
+@instrument('db.process_gdd_hit')
+def process_gdd_hit(conn, doi, highlight, cache = None, matches = None, enrich = True, crawl = True):
     """_Take a geodeepdive result and process its components._
 
     Args:
         conn (_type_): _A valid psycopg2 connection._
         doi (_string_): _A valid DOI_
         highlight (_list_): _An array of strings that represent text highlights from a GeoDeepDive PDF._
+        cache (_LookupCache_, optional): _A lookup cache shared across hits._ Defaults to None.
+        matches (_list_, optional): _Repositories already extracted from each highlight, e.g., by `extract_page_repositories()`._ Defaults to None.
+        enrich (bool, optional): _Fetch CrossRef metadata for a new publication immediately?_ Defaults to True.
+        crawl (bool, optional): _Crawl the repositories immediately, including those already in the database, rather than leaving them to crawl jobs?_ Defaults to True.
     """
     outcome = None
-    valid_repositories = list(map(lambda x: repotest(x), highlight))
+    if matches is None:
+        matches = extract_repositories_batch(highlight)
+    valid_repositories = {}
+    for text, repos in zip(highlight, matches):
+        for repo in repos:
+            valid_repositories.setdefault(repo, {'repo': repo, 'highlight': text})
     if any(valid_repositories):
-        for hit in valid_repositories:
+        for hit in valid_repositories.values():
             try:
-                if hit is not None:
-                    newid = add_repo_db(conn, hit['repo'], 'xDD Pipeline Submission')
+                newid = add_repo_db(conn, hit['repo'], 'xDD Pipeline Submission',
+                                    cache = cache, crawl = False)
                 if newid is not None:
-                    update_repo_crawl_db(conn, hit['repo'])
-                    newpub = add_publication_db(conn, doi, 'xDD Pipeline Submission')
+                    if crawl:
+                        # Repositories already in the database are recrawled too, unless
+                        # they are not on GitHub or were crawled in the last two days.
+                        try:
+                            update_repo_crawl_db(conn, clean_repo_name(hit['repo']))
+                        except ValueError as e:
+                            print(f"Did not crawl {hit['repo']}: {e}")
+                    newpub = add_publication_db(conn, doi, 'xDD Pipeline Submission',
+                                                cache = cache, enrich = enrich)
                     if newpub is not None:
-                        link_publication_repository_db(conn, newpub, newid, 'xDD API Scraper')
+                        link_publication_repository_db(conn, newpub, newid, 'xDD API Scraper', cache = cache)
                         print('Linked this publication and repository.')
                     else:
                         print(f"Failed to add {doi} to the database.")
@@ -562,18 +912,3 @@ def process_gdd_hit(conn, doi, highlight):
     else:
         outcome = None
     return outcome
-
-def repotest(string):
-    """Check to see if a repository is referenced in the paper.
-
-    string A character string returned from geodeepdive highlights.
-    returns None or the string matched.
-    """
-    test = re.search(r'((github)|(gitlab)|(bitbucket)).com\/((\s{0,1})[\w,\-,\_]+\/*){1,2}', string)
-    if test is None:
-        output = {'repo': None, 'highlight': string}
-    else:
-        test_no_space = re.sub(r'\s', '', test[0])
-        test_no_punct = re.sub(r'[^\w\s]$', '', test_no_space)
-        output = {'repo': test_no_punct, 'highlight': string}
-    return output
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import bisect
+import threading
+import functools
+import contextlib
+from psycopg2.extensions import cursor as base_cursor
+
+# Latency buckets, in seconds, shared by every histogram.
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class Metrics:
+    """_Counters, gauges and latency histograms for a pipeline run._
+
+    Collection is off unless `enable()` is called or the `OSPO_METRICS` environment
+    variable is set. When it is off every instrumented call costs one attribute check.
+    """
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, value = 1):
+        if not self.enabled:
+            return None
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        if not self.enabled or value is None:
+            return None
+        with self.lock:
+            self.gauges[name] = float(value)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return None
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = {'buckets': [0] * (len(BUCKETS) + 1), 'count': 0, 'sum': 0.0,
+                             'min': seconds, 'max': seconds}
+                self.histograms[name] = histogram
+            histogram['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['min'] = min(histogram['min'], seconds)
+            histogram['max'] = max(histogram['max'], seconds)
+
+    def quantile(self, name, q):
+        """_Estimate a latency quantile from the histogram buckets (the bucket's upper bound)._"""
+        histogram = self.histograms.get(name)
+        if histogram is None or histogram['count'] == 0:
+            return None
+        target = q * histogram['count']
+        seen = 0
+        for bound, count in zip(BUCKETS + [histogram['max']], histogram['buckets']):
+            seen = seen + count
+            if seen >= target:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def summary(self):
+        """_Summarize the run._
+
+        Returns:
+            _dict_: _Counters, gauges, latency statistics and per-record ratios._
+        """
+        records = self.counters.get('records', 0)
+        output = {'elapsed': time.time() - self.started,
+                  'counters': dict(self.counters),
+                  'gauges': dict(self.gauges),
+                  'latency': {}}
+        for name, histogram in self.histograms.items():
+            output['latency'][name] = {'count': histogram['count'],
+                                       'mean': histogram['sum'] / histogram['count'],
+                                       'p50': self.quantile(name, 0.5),
+                                       'p95': self.quantile(name, 0.95),
+                                       'max': histogram['max']}
+        if records > 0:
+            output['per_record'] = {'db_roundtrips': self.counters.get('db.roundtrips', 0) / records,
+                                    'api_calls': self.counters.get('api.calls', 0) / records}
+        return output
+
+    def prometheus(self, prefix = 'ospo'):
+        """_Render the metrics in the Prometheus text exposition format._
+
+        Returns:
+            _str_: _The textfile contents._
+        """
+        def clean(name):
+            return prefix + '_' + ''.join(i if i.isalnum() else '_' for i in name)
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'# TYPE {clean(name)}_total counter')
+            lines.append(f'{clean(name)}_total {value}')
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {clean(name)} gauge')
+            lines.append(f'{clean(name)} {value}')
+        for name, histogram in sorted(self.histograms.items()):
+            metric = clean(name) + '_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram['buckets']):
+                cumulative = cumulative + count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{metric}_sum {histogram["sum"]}')
+            lines.append(f'{metric}_count {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics(enabled = os.getenv('OSPO_METRICS') not in [None, '', '0'])
+
+
+def enable():
+    """_Start collecting metrics, from a clean slate._"""
+    METRICS.reset()
+    METRICS.enabled = True
+
+
+def disable():
+    METRICS.enabled = False
+
+
+def instrument(name):
+    """_Decorator that counts calls, errors and latency of a function under `name`._
+
+    Args:
+        name (_str_): _The metric name, e.g. `db.add_repo_db` or `api.crossref`._
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                METRICS.count(name + '.errors')
+                raise
+            finally:
+                METRICS.count(name + '.calls')
+                METRICS.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def timer(name):
+    """_Time a block of code, like `instrument()` does for a function._
+
+    Example:
+        with timer('gdd.page'):
+            process(page)
+    """
+    if not METRICS.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.count(name + '.calls')
+        METRICS.observe(name, time.perf_counter() - start)
+
+
+def count_records(value = 1):
+    """_Count records processed; used to report DB round-trips and API calls per record._"""
+    METRICS.count('records', value)
+
+
+class CountingCursor(base_cursor):
+    """_A psycopg2 cursor that counts database round-trips._"""
+
+    def execute(self, query, vars = None):
+        METRICS.count('db.roundtrips')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        METRICS.count('db.roundtrips')
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size = 8192):
+        METRICS.count('db.roundtrips')
+        return super().copy_expert(sql, file, size)
+
+
+def response_hook(response, *args, **kwargs):
+    """_A `requests` response hook recording API calls, latency and rate limit headers._"""
+    if not METRICS.enabled:
+        return None
+    host = response.url.split('/')[2] if '://' in response.url else 'unknown'
+    METRICS.count('api.calls')
+    METRICS.count(f'api.{host}.status.{response.status_code}')
+    METRICS.observe(f'api.{host}', response.elapsed.total_seconds())
+    for header in ['X-RateLimit-Remaining', 'X-Rate-Limit-Limit']:
+        if header in response.headers:
+            try:
+                METRICS.gauge(f'api.{host}.{header.lower()}', float(response.headers[header]))
+            except ValueError:
+                pass
+    return None
+
+
+def instrument_session(session):
+    """_Attach `response_hook()` to a `requests` session, once._
+
+    Returns:
+        _requests.Session_: _The same session._
+    """
+    if response_hook not in session.hooks['response']:
+        session.hooks['response'].append(response_hook)
+    return session
+
+
+def write_summary(json_path = None, prometheus_path = None, verbose = True):
+    """_Write the run's metrics at the end of a script, if collection is enabled._
+
+    Args:
+        json_path (_str_, optional): _Where to write the JSON summary._ Defaults to None.
+        prometheus_path (_str_, optional): _Where to write a Prometheus textfile (e.g. for node_exporter)._ Defaults to None.
+        verbose (bool, optional): _Print the JSON summary as well?_ Defaults to True.
+
+    Returns:
+        _dict_: _The summary, or None when metrics are disabled._
+    """
+    if not METRICS.enabled:
+        return None
+    summary = METRICS.summary()
+    if json_path is not None:
+        with open(json_path, 'w') as summary_file:
+            json.dump(summary, summary_file, indent = 2)
+    if prometheus_path is not None:
+        # node_exporter may read the file at any time, so replace it atomically.
+        with open(prometheus_path + '.tmp', 'w') as prom_file:
+            prom_file.write(METRICS.prometheus())
+        os.replace(prometheus_path + '.tmp', prometheus_path)
+    if verbose:
+        print(json.dumps(summary, indent = 2))
+    return summary
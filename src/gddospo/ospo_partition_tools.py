@@ -0,0 +1,380 @@
+import datetime
+from psycopg2 import sql
+from .ospo_db_tools import commit_db, rollback_db
+from .ospo_metrics_tools import instrument
+
+# Monthly partitions of `repositorycrawls`, named by month. There is deliberately no
+# default partition: without one PostgreSQL can scan the partitions in time order
+# and stop early for "latest crawl" queries. `ensure_crawl_partitions()` keeps
+# partitions a few months ahead instead.
+PARTITION_PREFIX = 'repositorycrawls_p'
+STAGING_TABLE = 'repositorycrawls_partitioned'
+ARCHIVE_TABLE = 'repositorycrawls_unpartitioned'
+CRAWL_INDEX_NAME = 'repositorycrawls_repositoryid_crawl_at_idx'
+# The `crawlblobs` references, indexed by `create_blob_tables()` when it has run.
+BLOB_COLUMNS = ['readmehash', 'rawhash']
+
+MIRROR_TRIGGER = """
+    CREATE OR REPLACE FUNCTION repositorycrawls_mirror() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM repositorycrawls_partitioned WHERE repositorycrawlid = OLD.repositorycrawlid;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.crawl_at IS NOT NULL THEN
+            INSERT INTO repositorycrawls_partitioned SELECT (NEW).*;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql;
+    DROP TRIGGER IF EXISTS repositorycrawls_mirror ON repositorycrawls;
+    CREATE TRIGGER repositorycrawls_mirror
+        AFTER INSERT OR UPDATE OR DELETE ON repositorycrawls
+        FOR EACH ROW EXECUTE FUNCTION repositorycrawls_mirror();"""
+
+
+def month_start(timestamp):
+    return datetime.datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITION_PREFIX}{month:%Y_%m}'
+
+
+def partition_month(name):
+    return datetime.datetime.strptime(name[len(PARTITION_PREFIX):], '%Y_%m')
+
+
+def is_partitioned(conn, table = 'repositorycrawls'):
+    """_Is `table` a partitioned table?_"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s));",
+                    (table,))
+        result = cur.fetchone()[0]
+    return result
+
+
+def crawl_partitions(conn, table = 'repositorycrawls'):
+    """_The monthly partitions of `table`, oldest first._
+
+    Returns:
+        _list_: _(name, month, downsampled) tuples._
+    """
+    partition_query = """
+        SELECT c.relname, COALESCE(obj_description(c.oid, 'pg_class'), '') = 'downsampled'
+        FROM pg_inherits AS i
+        INNER JOIN pg_class AS c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+          AND c.relname LIKE %s
+        ORDER BY c.relname;"""
+    with conn.cursor() as cur:
+        cur.execute(partition_query, (table, PARTITION_PREFIX + '%'))
+        partitions = [(i[0], partition_month(i[0]), i[1]) for i in cur.fetchall()]
+    return partitions
+
+
+def create_month_partition(conn, month, table = 'repositorycrawls'):
+    """_Create the partition of `table` for one month, if it does not exist. Does not commit._"""
+    create_query = sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+        FOR VALUES FROM (%s) TO (%s);""").format(partition = sql.Identifier(partition_name(month)),
+                                                 table = sql.Identifier(table))
+    with conn.cursor() as cur:
+        cur.execute(create_query, (month, add_months(month, 1)))
+
+
+def ensure_crawl_partitions(conn, months_ahead = 3, start = None, table = 'repositorycrawls'):
+    """_Make sure `repositorycrawls` has a partition for every month a crawl may be written to._
+
+    Does nothing if the table is not partitioned (see `partition_crawls()`).
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        months_ahead (int, optional): _Months after the current one to create._ Defaults to 3.
+        start (_datetime_, optional): _The first month to create._ Defaults to the current month.
+        table (str, optional): _The partitioned table._ Defaults to 'repositorycrawls'.
+
+    Returns:
+        _int_: _The number of months checked._
+    """
+    if not is_partitioned(conn, table):
+        return 0
+    month = month_start(start or datetime.datetime.now())
+    last = add_months(month_start(datetime.datetime.now()), months_ahead)
+    months = 0
+    while month <= last:
+        create_month_partition(conn, month, table)
+        month = add_months(month, 1)
+        months = months + 1
+    commit_db(conn)
+    return months
+
+
+def create_staging_table(conn):
+    """_Create the empty partitioned copy of `repositorycrawls`, with its indexes and foreign keys. Does not commit._"""
+    foreign_key_query = """
+        SELECT pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = to_regclass('repositorycrawls') AND contype = 'f';"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE {STAGING_TABLE}
+                (LIKE repositorycrawls INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMPRESSION)
+            PARTITION BY RANGE (crawl_at);""")
+        cur.execute("SELECT MIN(crawl_at) FROM repositorycrawls;")
+        first = cur.fetchone()[0] or datetime.datetime.now()
+    month = month_start(first)
+    last = add_months(month_start(datetime.datetime.now()), 3)
+    while month <= last:
+        create_month_partition(conn, month, STAGING_TABLE)
+        month = add_months(month, 1)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE INDEX {STAGING_TABLE}_repositoryid_crawl_at_idx
+            ON {STAGING_TABLE} (repositoryid, crawl_at DESC);
+            CREATE INDEX {STAGING_TABLE}_repositorycrawlid_idx
+            ON {STAGING_TABLE} (repositorycrawlid);""")
+        cur.execute("""SELECT attname FROM pg_attribute
+                       WHERE attrelid = to_regclass('repositorycrawls')
+                         AND attname = ANY(%s) AND NOT attisdropped;""", (BLOB_COLUMNS,))
+        for column in [i[0] for i in cur.fetchall()]:
+            cur.execute(f"CREATE INDEX {STAGING_TABLE}_{column}_idx ON {STAGING_TABLE} ({column});")
+        cur.execute(foreign_key_query)
+        for definition in [i[0] for i in cur.fetchall()]:
+            cur.execute(f"ALTER TABLE {STAGING_TABLE} ADD {definition};")
+
+
+def drop_archive_blob_keys(conn):
+    """_Drop the foreign keys from the archived `repositorycrawls` to `crawlblobs`. Does not commit._
+
+    The archive is only a fallback copy, so it must not stop `prune_crawl_blobs()`
+    from deleting blobs the live crawls no longer reference.
+
+    Returns:
+        _int_: _The number of foreign keys dropped._
+    """
+    foreign_key_query = """
+        SELECT conname
+        FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+          AND confrelid = to_regclass('crawlblobs');"""
+    with conn.cursor() as cur:
+        cur.execute(foreign_key_query, (ARCHIVE_TABLE,))
+        names = [i[0] for i in cur.fetchall()]
+        for name in names:
+            cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};")
+                        .format(sql.Identifier(ARCHIVE_TABLE), sql.Identifier(name)))
+    return len(names)
+
+
+@instrument('partition.partition_crawls')
+def partition_crawls(conn, chunk_size = 20000, verbose = True):
+    """_Move `repositorycrawls` into a table partitioned by month, while crawls keep being written._
+
+    1. A partitioned copy is created and a trigger mirrors every insert, update and
+       delete on `repositorycrawls` into it.
+    2. Existing crawls are copied in chunks of `chunk_size` ids, each its own short
+       transaction. The chunk's rows are locked first so they cannot change while
+       being copied, and rows the trigger already mirrored are skipped.
+    3. A final short transaction swaps the tables. The original is kept as
+       `repositorycrawls_unpartitioned` until you drop it.
+
+    Crawls without a `crawl_at` cannot be partitioned and stay in the original table.
+    An interrupted run can be repeated: rows already copied are skipped.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        chunk_size (int, optional): _Crawl ids copied per transaction._ Defaults to 20000.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `copied` crawls, `skipped` crawls without a date, and `partitions`._
+    """
+    if is_partitioned(conn):
+        if verbose:
+            print("repositorycrawls is already partitioned.")
+        return {'copied': 0, 'skipped': 0, 'partitions': len(crawl_partitions(conn))}
+    lock_query = """
+        SELECT 1 FROM repositorycrawls
+        WHERE repositorycrawlid > %s AND repositorycrawlid <= %s
+        FOR SHARE;"""
+    copy_query = f"""
+        INSERT INTO {STAGING_TABLE}
+        SELECT rc.*
+        FROM repositorycrawls AS rc
+        WHERE rc.repositorycrawlid > %s AND rc.repositorycrawlid <= %s
+          AND rc.crawl_at IS NOT NULL
+          AND NOT EXISTS (SELECT 1
+                          FROM {STAGING_TABLE} AS pc
+                          WHERE pc.repositorycrawlid = rc.repositorycrawlid);"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (STAGING_TABLE,))
+            resume = cur.fetchone()[0]
+        if not resume:
+            create_staging_table(conn)
+        with conn.cursor() as cur:
+            # Waits for writes in flight, so every later write is mirrored.
+            cur.execute(MIRROR_TRIGGER)
+        conn.commit()
+    except Exception as e:
+        print(f"Failed to prepare the partitioned table.\n{e}")
+        conn.rollback()
+        raise
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(repositorycrawlid), 0) FROM repositorycrawls;")
+        boundary = cur.fetchone()[0]
+    conn.commit()
+    # A resumed run starts over, but the chunks already copied are skipped row by row.
+    last_id = 0
+    summary = {'copied': 0, 'skipped': 0, 'partitions': 0}
+    while last_id < boundary:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(lock_query, (last_id, last_id + chunk_size))
+                cur.execute(copy_query, (last_id, last_id + chunk_size))
+                summary['copied'] = summary['copied'] + cur.rowcount
+            conn.commit()
+        except Exception as e:
+            print(f"Failed to copy the crawls after {last_id}.\n{e}")
+            conn.rollback()
+            raise
+        last_id = last_id + chunk_size
+        if verbose:
+            print(f"Copied {summary['copied']} crawls (through id {min(last_id, boundary)} of {boundary}).")
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_get_serial_sequence('repositorycrawls', 'repositorycrawlid');")
+            sequence = cur.fetchone()[0]
+            cur.execute("LOCK TABLE repositorycrawls IN ACCESS EXCLUSIVE MODE;")
+            cur.execute("SELECT COUNT(*) FROM repositorycrawls WHERE crawl_at IS NULL;")
+            summary['skipped'] = cur.fetchone()[0]
+            cur.execute(f"""
+                DROP TRIGGER repositorycrawls_mirror ON repositorycrawls;
+                DROP FUNCTION repositorycrawls_mirror();
+                ALTER TABLE repositorycrawls RENAME TO {ARCHIVE_TABLE};
+                ALTER INDEX IF EXISTS {CRAWL_INDEX_NAME} RENAME TO {ARCHIVE_TABLE}_repositoryid_crawl_at_idx;
+                ALTER TABLE {STAGING_TABLE} RENAME TO repositorycrawls;
+                ALTER INDEX {STAGING_TABLE}_repositoryid_crawl_at_idx RENAME TO {CRAWL_INDEX_NAME};
+                ALTER INDEX {STAGING_TABLE}_repositorycrawlid_idx RENAME TO repositorycrawls_repositorycrawlid_idx;""")
+            for column in BLOB_COLUMNS:
+                cur.execute(f"""
+                    ALTER INDEX IF EXISTS repositorycrawls_{column}_idx RENAME TO {ARCHIVE_TABLE}_{column}_idx;
+                    ALTER INDEX IF EXISTS {STAGING_TABLE}_{column}_idx RENAME TO repositorycrawls_{column}_idx;""")
+            cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass('repositorycrawls') AND conname LIKE %s;",
+                        (STAGING_TABLE + '%',))
+            for name in [i[0] for i in cur.fetchall()]:
+                cur.execute(sql.SQL("ALTER TABLE repositorycrawls RENAME CONSTRAINT {} TO {};")
+                            .format(sql.Identifier(name),
+                                    sql.Identifier('repositorycrawls' + name[len(STAGING_TABLE):])))
+        drop_archive_blob_keys(conn)
+        with conn.cursor() as cur:
+            if sequence is not None:
+                # Keep the id sequence when the original table is dropped.
+                cur.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY repositorycrawls.repositorycrawlid;")
+                            .format(sql.SQL(sequence)))
+        conn.commit()
+    except Exception as e:
+        print(f"Failed to swap in the partitioned table.\n{e}")
+        conn.rollback()
+        raise
+    summary['partitions'] = len(crawl_partitions(conn))
+    if verbose:
+        print(f"repositorycrawls is now partitioned into {summary['partitions']} months; "
+              f"{summary['skipped']} crawls without a date remain in {ARCHIVE_TABLE}.")
+    return summary
+
+
+@instrument('partition.downsample_crawls')
+def downsample_crawls(conn, keep_months = 6, verbose = True):
+    """_Reduce crawl history older than `keep_months` to one crawl per repository per month._
+
+    Each month is rewritten once, in its own transaction: the repository's last
+    full crawl of the month (the last `unchanged` marker only if there is none) is
+    kept with its metrics and blob references, the partition is swapped for the
+    smaller copy and marked downsampled. The month's other crawls, and any blobs
+    only they referenced (see `prune_crawl_blobs()`), are dropped.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        keep_months (int, optional): _Months of full resolution history to keep, besides the current month._ Defaults to 6.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `partitions` downsampled, and crawls `before` and `after`._
+    """
+    if not is_partitioned(conn):
+        raise ValueError("repositorycrawls is not partitioned; run partition_crawls() first.")
+    cutoff = add_months(month_start(datetime.datetime.now()), -keep_months)
+    summary = {'partitions': 0, 'before': 0, 'after': 0}
+    for name, month, downsampled in crawl_partitions(conn):
+        if downsampled or month >= cutoff:
+            continue
+        partition = sql.Identifier(name)
+        compact = sql.Identifier(name + '_compact')
+        bounds = sql.Identifier(name + '_bounds')
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE;").format(partition))
+                cur.execute(sql.SQL("SELECT COUNT(*) FROM {};").format(partition))
+                before = cur.fetchone()[0]
+                cur.execute(sql.SQL("""
+                    CREATE TABLE {compact}
+                        (LIKE repositorycrawls INCLUDING DEFAULTS INCLUDING STORAGE INCLUDING COMPRESSION);
+                    INSERT INTO {compact}
+                    SELECT DISTINCT ON (repositoryid) *
+                    FROM {partition}
+                    ORDER BY repositoryid, (stargazers IS NULL), crawl_at DESC;
+                    ALTER TABLE {compact} ADD CONSTRAINT {bounds}
+                        CHECK (crawl_at IS NOT NULL AND crawl_at >= %(lower)s AND crawl_at < %(upper)s);
+                    ALTER TABLE repositorycrawls DETACH PARTITION {partition};
+                    DROP TABLE {partition};
+                    ALTER TABLE {compact} RENAME TO {partition};
+                    ALTER TABLE repositorycrawls ATTACH PARTITION {partition}
+                        FOR VALUES FROM (%(lower)s) TO (%(upper)s);
+                    COMMENT ON TABLE {partition} IS 'downsampled';""").format(compact = compact,
+                                                                             partition = partition,
+                                                                             bounds = bounds),
+                            {'lower': month, 'upper': add_months(month, 1)})
+                cur.execute(sql.SQL("SELECT COUNT(*) FROM {};").format(partition))
+                after = cur.fetchone()[0]
+            commit_db(conn)
+        except Exception as e:
+            print(f"Failed to downsample {name}.\n{e}")
+            rollback_db(conn)
+            raise
+        summary['partitions'] = summary['partitions'] + 1
+        summary['before'] = summary['before'] + before
+        summary['after'] = summary['after'] + after
+        if verbose:
+            print(f"Downsampled {name}: {before} crawls to {after}.")
+    return summary
+
+
+@instrument('partition.prune_crawl_blobs')
+def prune_crawl_blobs(conn):
+    """_Delete `crawlblobs` no crawl references any more, e.g. after `downsample_crawls()`._
+
+    Crawls left in the archived, unpartitioned table do not keep their blobs.
+
+    Returns:
+        _int_: _The number of blobs deleted (0 if there is no `crawlblobs` table)._
+    """
+    prune_query = """
+        DELETE FROM crawlblobs AS cb
+        WHERE NOT EXISTS (SELECT 1 FROM repositorycrawls AS rc WHERE rc.readmehash = cb.blobhash)
+          AND NOT EXISTS (SELECT 1 FROM repositorycrawls AS rc WHERE rc.rawhash = cb.blobhash);"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('crawlblobs') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return 0
+    # Tables partitioned before the archive lost its foreign keys.
+    drop_archive_blob_keys(conn)
+    with conn.cursor() as cur:
+        cur.execute(prune_query)
+        deleted = cur.rowcount
+    commit_db(conn)
+    return deleted
@@ -0,0 +1,406 @@
+import os
+import time
+import socket
+import datetime
+import traceback
+from psycopg2.extras import execute_values, Json
+from .ospo_db_tools import commit_db, rollback_db, clean_repo_name
+from .ospo_crawl_tools import prepare_repo_batches, fetch_repo_batch, write_crawl_batch, split_repo_url
+from .ospo_crossref_tools import fetch_crossref_works, update_crossref_batch, CrossrefCache, CROSSREF_CACHE
+from .ospo_uw_tools import uw_publication_check_batch
+from .ospo_metrics_tools import METRICS, instrument
+
+JOB_TYPES = ['crawl', 'crossref', 'openalex']
+
+QUEUE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS ospojobs (
+        jobid BIGSERIAL PRIMARY KEY,
+        jobtype TEXT NOT NULL,
+        jobkey TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+        locked_at TIMESTAMP,
+        locked_by TEXT,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+        UNIQUE (jobtype, jobkey));
+    CREATE INDEX IF NOT EXISTS ospojobs_ready_idx ON ospojobs (jobtype, run_at);
+    CREATE TABLE IF NOT EXISTS ospodeadjobs (
+        jobid BIGINT PRIMARY KEY,
+        jobtype TEXT NOT NULL,
+        jobkey TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        created_at TIMESTAMP NOT NULL,
+        failed_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP);"""
+
+
+def create_queue_tables(conn):
+    """_Create the `ospojobs` queue and the `ospodeadjobs` dead-letter table._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    with conn.cursor() as cur:
+        cur.execute(QUEUE_SCHEMA)
+    commit_db(conn)
+
+
+@instrument('queue.enqueue')
+def enqueue_jobs(conn, jobtype, jobs, run_at = None, max_attempts = 5):
+    """_Add jobs to the queue, ignoring jobs that are already waiting._
+
+    Jobs are unique on (`jobtype`, `jobkey`), so enqueueing a repository that is
+    already queued does not crawl it twice. A waiting job is brought forward if
+    the new `run_at` is earlier.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobtype (_str_): _One of `JOB_TYPES`._
+        jobs (_list_): _A list of (jobkey, payload) tuples, the payload a JSON-serializable dict._
+        run_at (_datetime_, optional): _The earliest time the jobs may run._ Defaults to now.
+        max_attempts (int, optional): _Attempts before a job is dead-lettered._ Defaults to 5.
+
+    Returns:
+        _int_: _The number of jobs added or brought forward._
+    """
+    if jobtype not in JOB_TYPES:
+        raise ValueError(f"Unknown job type {jobtype}, expected one of {JOB_TYPES}.")
+    values = list({str(key): (jobtype, str(key), Json(payload or {}), run_at, max_attempts)
+                   for key, payload in jobs}.values())
+    if len(values) == 0:
+        return 0
+    enqueue = """
+        INSERT INTO ospojobs (jobtype, jobkey, payload, run_at, max_attempts)
+        VALUES %s
+        ON CONFLICT (jobtype, jobkey) DO UPDATE
+        SET run_at = EXCLUDED.run_at
+        WHERE ospojobs.locked_at IS NULL AND EXCLUDED.run_at < ospojobs.run_at
+        RETURNING jobid;"""
+    template = "(%s, %s, %s, COALESCE(%s::timestamp, LOCALTIMESTAMP), %s)"
+    try:
+        with conn.cursor() as cur:
+            result = execute_values(cur, enqueue, values, template = template,
+                                    page_size = len(values), fetch = True)
+        commit_db(conn)
+    except Exception as e:
+        print(f"Failed to enqueue {jobtype} jobs.\n{e}")
+        rollback_db(conn)
+        raise
+    METRICS.count(f'queue.{jobtype}.enqueued', len(result))
+    return len(result)
+
+
+def enqueue_repositories(conn, repositories, jobtypes = ['crawl'], run_at = None):
+    """_Queue repository jobs (crawls) for (repositoryid, url) pairs._
+
+    Only GitHub repositories can be crawled, so other repositories are not queued.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        repositories (_list_): _A list of (repositoryid, url) tuples, e.g., from `plan_repo_crawls()`._
+        jobtypes (list, optional): _Repository job types, currently only 'crawl'._ Defaults to ['crawl'].
+        run_at (_datetime_, optional): _The earliest time the jobs may run._ Defaults to now.
+
+    Returns:
+        _int_: _The number of jobs added._
+    """
+    jobs = [(i[0], {'repositoryid': i[0], 'url': i[1]}) for i in repositories
+            if split_repo_url(i[1]) is not None]
+    return sum([enqueue_jobs(conn, jobtype, jobs, run_at = run_at) for jobtype in jobtypes])
+
+
+def enqueue_repository_urls(conn, urls, jobtypes = ['crawl'], run_at = None):
+    """_Queue repository jobs for repository URLs already in the database._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        urls (_list_): _Repository URLs, cleaned with `clean_repo_name()` before lookup._
+        jobtypes (list, optional): _Repository job types, currently only 'crawl'._ Defaults to ['crawl'].
+        run_at (_datetime_, optional): _The earliest time the jobs may run._ Defaults to now.
+
+    Returns:
+        _int_: _The number of jobs added._
+    """
+    urls = [i for i in dict.fromkeys(map(clean_repo_name, urls)) if i]
+    if len(urls) == 0:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""SELECT repositoryid, url FROM repositories
+                       WHERE url = ANY(%s);""", (urls,))
+        repositories = cur.fetchall()
+    return enqueue_repositories(conn, repositories, jobtypes = jobtypes, run_at = run_at)
+
+
+def enqueue_publications(conn, dois, jobtypes = ['crossref'], run_at = None):
+    """_Queue publication jobs (CrossRef enrichment or OpenAlex validation) for DOIs._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        dois (_list_): _DOIs as stored in `publications`._
+        jobtypes (list, optional): _Any of 'crossref' and 'openalex'._ Defaults to ['crossref'].
+        run_at (_datetime_, optional): _The earliest time the jobs may run._ Defaults to now.
+
+    Returns:
+        _int_: _The number of jobs added._
+    """
+    jobs = [(i, {'doi': i}) for i in dois if i]
+    return sum([enqueue_jobs(conn, jobtype, jobs, run_at = run_at) for jobtype in jobtypes])
+
+
+@instrument('queue.claim')
+def claim_jobs(conn, jobtype, limit = 50, worker = None, lease = '15 minutes'):
+    """_Lease up to `limit` ready jobs of one type to this worker._
+
+    `FOR UPDATE SKIP LOCKED` lets any number of workers claim at once without
+    blocking each other or taking the same job. The claim is committed right away
+    and the job is leased rather than locked, so no transaction stays open while
+    the job calls an API. Jobs whose lease has expired (a worker died) are claimed again.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobtype (_str_): _One of `JOB_TYPES`._
+        limit (int, optional): _The most jobs to claim._ Defaults to 50.
+        worker (_str_, optional): _A name for this worker._ Defaults to the host name and process id.
+        lease (str, optional): _A PostgreSQL interval after which an unfinished job may be claimed again._ Defaults to '15 minutes'.
+
+    Returns:
+        _list_: _Claimed jobs, as dicts with `jobid`, `jobtype`, `jobkey`, `payload` and `attempts`._
+    """
+    if worker is None:
+        worker = worker_name()
+    claim = """
+        UPDATE ospojobs AS job
+        SET locked_at = LOCALTIMESTAMP,
+            locked_by = %(worker)s,
+            attempts = job.attempts + 1
+        FROM (SELECT jobid
+              FROM ospojobs
+              WHERE jobtype = %(jobtype)s
+                AND run_at <= LOCALTIMESTAMP
+                AND (locked_at IS NULL OR locked_at < LOCALTIMESTAMP - %(lease)s::interval)
+              ORDER BY run_at, jobid
+              LIMIT %(limit)s
+              FOR UPDATE SKIP LOCKED) AS ready
+        WHERE job.jobid = ready.jobid
+        RETURNING job.jobid, job.jobtype, job.jobkey, job.payload, job.attempts;"""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(claim, {'worker': worker, 'jobtype': jobtype,
+                                'lease': lease, 'limit': limit})
+            columns = [i[0] for i in cur.description]
+            jobs = [dict(zip(columns, i)) for i in cur.fetchall()]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return jobs
+
+
+def complete_jobs(conn, jobids, worker = None):
+    """_Remove finished jobs from the queue._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobids (_list_): _The `jobid` of each finished job._
+        worker (_str_, optional): _The worker holding the lease._ Defaults to `worker_name()`.
+    """
+    if len(jobids) == 0:
+        return None
+    with conn.cursor() as cur:
+        cur.execute("""DELETE FROM ospojobs
+                       WHERE jobid = ANY(%s) AND locked_by = %s;""",
+                    (list(jobids), worker or worker_name()))
+    conn.commit()
+
+
+def fail_jobs(conn, jobids, error, worker = None, base_delay = 60, max_delay = 6 * 3600):
+    """_Release failed jobs for a retry with exponential backoff, or dead-letter them._
+
+    A job that has used `max_attempts` attempts moves to `ospodeadjobs` with its last
+    error. Otherwise it becomes ready again after `base_delay * 2^(attempts - 1)`
+    seconds (at most `max_delay`), with jitter so retries from many workers spread out.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobids (_list_): _The `jobid` of each failed job._
+        error (_str_): _The error message to record._
+        worker (_str_, optional): _The worker holding the lease._ Defaults to `worker_name()`.
+        base_delay (int, optional): _Seconds before the first retry._ Defaults to 60.
+        max_delay (int, optional): _The longest delay between retries, in seconds._ Defaults to six hours.
+
+    Returns:
+        _int_: _The number of jobs dead-lettered._
+    """
+    if len(jobids) == 0:
+        return 0
+    dead_letter = """
+        WITH dead AS (
+            DELETE FROM ospojobs
+            WHERE jobid = ANY(%(jobids)s) AND locked_by = %(worker)s
+              AND attempts >= max_attempts
+            RETURNING jobid, jobtype, jobkey, payload, attempts, created_at)
+        INSERT INTO ospodeadjobs (jobid, jobtype, jobkey, payload, attempts, last_error, created_at)
+        SELECT jobid, jobtype, jobkey, payload, attempts, %(error)s, created_at FROM dead
+        ON CONFLICT (jobid) DO NOTHING;"""
+    retry = """
+        UPDATE ospojobs
+        SET locked_at = NULL,
+            locked_by = NULL,
+            last_error = %(error)s,
+            run_at = LOCALTIMESTAMP + LEAST(%(max_delay)s, %(base_delay)s * power(2, attempts - 1))
+                                      * (0.5 + random() / 2) * interval '1 second'
+        WHERE jobid = ANY(%(jobids)s) AND locked_by = %(worker)s;"""
+    params = {'jobids': list(jobids), 'worker': worker or worker_name(), 'error': str(error)[:2000],
+              'base_delay': base_delay, 'max_delay': max_delay}
+    with conn.cursor() as cur:
+        cur.execute(dead_letter, params)
+        dead = cur.rowcount
+        cur.execute(retry, params)
+    conn.commit()
+    return dead
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def handle_crawl(conn, jobs):
+    """_Crawl the repositories of a batch of jobs with batched GraphQL crawls; jobs neither crawled nor found missing are retried._"""
+    repositories = [(i['payload']['repositoryid'], i['payload']['url']) for i in jobs]
+    # Jobs queued for repositories that are not on GitHub can never be crawled.
+    done = set([i[0] for i in repositories if split_repo_url(i[1]) is None])
+    for batch in prepare_repo_batches(repositories):
+        result = fetch_repo_batch([i[1] for i in batch])
+        written = write_crawl_batch(conn, batch, result, datetime.datetime.now())
+        done.update(written['crawled'] + written['missing'])
+    return [i['jobid'] for i in jobs if i['payload']['repositoryid'] not in done]
+
+
+def handle_crossref(conn, jobs):
+    """_Add CrossRef metadata for a batch of publications; DOIs that were not updated are retried._"""
+    cache = CrossrefCache(os.getenv('CROSSREF_CACHE', CROSSREF_CACHE))
+    dois = [i['payload']['doi'] for i in jobs]
+    works = fetch_crossref_works(dois, cache = cache)
+    updated = set(update_crossref_batch(conn, works))
+    return [i['jobid'] for i in jobs if i['payload']['doi'] not in updated]
+
+
+def handle_openalex(conn, jobs):
+    """_Check a batch of publications against OpenAlex for University of Wisconsin authors; DOIs OpenAlex did not return are retried._"""
+    results = uw_publication_check_batch(conn, [i['payload']['doi'] for i in jobs], verbose = False)
+    return [i['jobid'] for i in jobs if i['payload']['doi'] not in results]
+
+
+# Each handler takes a batch of claimed jobs of its type and returns the jobids that
+# should be retried. If a handler raises, every job in the batch is retried. The
+# CrossRef handler uses the same cache directory as `enrich_publications()`. Owners are assigned by
+# the crawl itself, so there is no separate owner job.
+JOB_HANDLERS = {'crawl': handle_crawl,
+                'crossref': handle_crossref,
+                'openalex': handle_openalex}
+
+
+def run_jobs(conn, jobtype, jobs, worker = None, handlers = JOB_HANDLERS):
+    """_Run a batch of claimed jobs and record the outcome of each._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobtype (_str_): _The type of every job in the batch._
+        jobs (_list_): _Jobs from `claim_jobs()`._
+        worker (_str_, optional): _The worker holding the lease._ Defaults to `worker_name()`.
+        handlers (_dict_, optional): _A mapping of job type to handler._ Defaults to JOB_HANDLERS.
+
+    Returns:
+        _dict_: _Counts of `done`, `retried` and `dead` jobs._
+    """
+    jobids = [i['jobid'] for i in jobs]
+    start = time.perf_counter()
+    try:
+        failed = handlers[jobtype](conn, jobs) or []
+        error = f"{jobtype} handler did not complete the job."
+    except Exception as e:
+        conn.rollback()
+        failed = jobids
+        error = ''.join(traceback.format_exception_only(e)).strip()
+        print(f"{jobtype} batch of {len(jobs)} jobs failed: {error}")
+    METRICS.observe(f'queue.{jobtype}.batch', time.perf_counter() - start)
+    done = [i for i in jobids if i not in failed]
+    complete_jobs(conn, done, worker)
+    dead = fail_jobs(conn, failed, error, worker)
+    summary = {'done': len(done), 'retried': len(failed) - dead, 'dead': dead}
+    for key, value in summary.items():
+        METRICS.count(f'queue.{jobtype}.{key}', value)
+    return summary
+
+
+def run_worker(conn, jobtypes = JOB_TYPES, batch_size = 50, worker = None, lease = '15 minutes',
+               poll = None, handlers = JOB_HANDLERS, verbose = True):
+    """_Drain the queue, one batch of each job type in turn._
+
+    Start as many workers as you like, on any machine that can reach the database.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        jobtypes (list, optional): _The job types this worker runs._ Defaults to JOB_TYPES.
+        batch_size (int, optional): _Jobs claimed at once; a crawl batch is one GraphQL query._ Defaults to 50.
+        worker (_str_, optional): _A name for this worker._ Defaults to the host name and process id.
+        lease (str, optional): _A PostgreSQL interval after which an unfinished job may be claimed again._ Defaults to '15 minutes'.
+        poll (int, optional): _Seconds to wait when the queue is empty before looking again, or None to return instead._ Defaults to None.
+        handlers (_dict_, optional): _A mapping of job type to handler._ Defaults to JOB_HANDLERS.
+        verbose (bool, optional): _Should the worker print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `done`, `retried` and `dead` jobs, once the queue is empty and `poll` is None._
+    """
+    if worker is None:
+        worker = worker_name()
+    summary = {'done': 0, 'retried': 0, 'dead': 0}
+    while True:
+        claimed = 0
+        for jobtype in jobtypes:
+            jobs = claim_jobs(conn, jobtype, batch_size, worker = worker, lease = lease)
+            if len(jobs) == 0:
+                continue
+            claimed = claimed + len(jobs)
+            result = run_jobs(conn, jobtype, jobs, worker = worker, handlers = handlers)
+            for key, value in result.items():
+                summary[key] = summary[key] + value
+            if verbose:
+                print(f"{worker} ran {len(jobs)} {jobtype} jobs: {result}")
+        if claimed == 0:
+            if poll is None:
+                return summary
+            time.sleep(poll)
+
+
+def queue_status(conn):
+    """_Summarize the queue for monitoring._
+
+    Returns:
+        _dict_: _For each job type, counts of `ready`, `scheduled`, `running` and `dead` jobs._
+    """
+    status_query = """
+        SELECT jobtype,
+               COUNT(*) FILTER (WHERE locked_at IS NULL AND run_at <= LOCALTIMESTAMP),
+               COUNT(*) FILTER (WHERE locked_at IS NULL AND run_at > LOCALTIMESTAMP),
+               COUNT(*) FILTER (WHERE locked_at IS NOT NULL),
+               0
+        FROM ospojobs
+        GROUP BY jobtype
+        UNION ALL
+        SELECT jobtype, 0, 0, 0, COUNT(*)
+        FROM ospodeadjobs
+        GROUP BY jobtype;"""
+    status = {i: {'ready': 0, 'scheduled': 0, 'running': 0, 'dead': 0} for i in JOB_TYPES}
+    with conn.cursor() as cur:
+        cur.execute(status_query)
+        for jobtype, ready, scheduled, running, dead in cur.fetchall():
+            counts = status.setdefault(jobtype, {'ready': 0, 'scheduled': 0, 'running': 0, 'dead': 0})
+            for key, value in zip(['ready', 'scheduled', 'running', 'dead'], [ready, scheduled, running, dead]):
+                counts[key] = counts[key] + value
+    conn.rollback()
+    return status
@@ -0,0 +1,187 @@
+import os
+import json
+import atexit
+import threading
+import contextlib
+import datetime
+import email.utils
+import dotenv
+import requests
+from psycopg2.pool import ThreadedConnectionPool
+from github import Github
+from github import Auth
+from .ospo_metrics_tools import METRICS, CountingCursor, instrument_session
+
+# Long-lived clients, shared by every helper in the process.
+POOLS = {}
+GITHUB_CLIENTS = {}
+SESSIONS = {}
+SESSION_WORKERS = {}
+LOCK = threading.Lock()
+
+
+def connection_settings(env = 'OSDB_CONNECT'):
+    """_Read the database connection settings from the environment (or a `.env` file)._
+
+    Args:
+        env (str, optional): _The environment variable holding a JSON connection string._ Defaults to 'OSDB_CONNECT'.
+
+    Returns:
+        _dict_: _Keyword arguments for `psycopg2.connect()`._
+    """
+    dotenv.load_dotenv()
+    conn_string = os.getenv(env)
+    if conn_string is None:
+        raise TypeError(f"The database connection must be set as the environment variable {env}.")
+    return json.loads(conn_string)
+
+
+def get_pool(env = 'OSDB_CONNECT', minconn = 1, maxconn = 8, **settings):
+    """_Return the process-wide connection pool for a database, creating it on first use._
+
+    Args:
+        env (str, optional): _The environment variable holding a JSON connection string._ Defaults to 'OSDB_CONNECT'.
+        minconn (int, optional): _Connections opened up front._ Defaults to 1.
+        maxconn (int, optional): _The most connections the pool will open._ Defaults to 8.
+        **settings: _Connection settings that override the environment (e.g. `port`), used when the pool is created._
+
+    Returns:
+        _ThreadedConnectionPool_: _A thread-safe psycopg2 connection pool._
+    """
+    with LOCK:
+        pool = POOLS.get(env)
+        if pool is None or pool.closed:
+            conn_dict = dict(connection_settings(env), **settings)
+            conn_dict.setdefault('connect_timeout', 5)
+            if METRICS.enabled:
+                conn_dict.setdefault('cursor_factory', CountingCursor)
+            pool = ThreadedConnectionPool(minconn, maxconn, **conn_dict)
+            POOLS[env] = pool
+    return pool
+
+
+def get_connection(env = 'OSDB_CONNECT', **settings):
+    """_Take a connection from the pool, for scripts that hold one connection for their whole run._
+
+    Args:
+        env (str, optional): _The environment variable holding a JSON connection string._ Defaults to 'OSDB_CONNECT'.
+        **settings: _Connection settings that override the environment, passed to `get_pool()`._
+
+    Returns:
+        _connection_: _A psycopg2 connection. Return it with `release_connection()`, or let the pool close at exit._
+    """
+    return get_pool(env, **settings).getconn()
+
+
+def release_connection(conn, env = 'OSDB_CONNECT'):
+    """_Roll back anything uncommitted and return a connection to its pool._"""
+    if not conn.closed:
+        conn.rollback()
+    get_pool(env).putconn(conn)
+
+
+@contextlib.contextmanager
+def pooled_connection(env = 'OSDB_CONNECT'):
+    """_Borrow a connection from the pool for the duration of a `with` block._
+
+    Args:
+        env (str, optional): _The environment variable holding a JSON connection string._ Defaults to 'OSDB_CONNECT'.
+
+    Example:
+        with pooled_connection() as conn:
+            check_repository_db(conn, 'https://github.com/NeotomaDB/neotoma2')
+    """
+    conn = get_connection(env)
+    try:
+        yield conn
+    finally:
+        release_connection(conn, env)
+
+
+def close_pools():
+    """_Close every connection pool, called automatically at exit._"""
+    with LOCK:
+        for pool in POOLS.values():
+            if not pool.closed:
+                pool.closeall()
+        POOLS.clear()
+
+
+atexit.register(close_pools)
+
+
+def github_client(auth = None, per_page = 100, pool_size = 16):
+    """_Return a long-lived GitHub client for a token, so its HTTP connections are reused._
+
+    Args:
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        per_page (int, optional): _Items per page for paginated lists._ Defaults to 100.
+        pool_size (int, optional): _HTTP connections kept open by the client._ Defaults to 16.
+
+    Returns:
+        _Github_: _A PyGithub client, or None if no token is available._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+        if auth is None:
+            return None
+    with LOCK:
+        client = GITHUB_CLIENTS.get(auth)
+        if client is None:
+            client = Github(auth = Auth.Token(auth), per_page = per_page, pool_size = pool_size)
+            GITHUB_CLIENTS[auth] = client
+    return client
+
+
+def http_session(name = 'default', workers = 16):
+    """_Return a long-lived `requests` session with a connection pool, shared by name._
+
+    Args:
+        name (str, optional): _Sessions with different settings (e.g. headers) should use different names._ Defaults to 'default'.
+        workers (int, optional): _Connections kept per host. A later call asking for more grows the pool; it never shrinks._ Defaults to 16.
+
+    Returns:
+        _requests.Session_: _A pooled session._
+    """
+    with LOCK:
+        session = SESSIONS.get(name)
+        if session is None:
+            session = requests.Session()
+            instrument_session(session)
+            SESSIONS[name] = session
+        if workers > SESSION_WORKERS.get(name, 0):
+            replaced = session.adapters.get('https://')
+            adapter = requests.adapters.HTTPAdapter(pool_connections = workers, pool_maxsize = workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            SESSION_WORKERS[name] = workers
+            # Closing the old pools drops their idle connections; requests in flight
+            # finish first and their connections are closed when they are returned.
+            if replaced is not None:
+                replaced.close()
+    return session
+
+
+def retry_after_seconds(response):
+    """_Read the `Retry-After` header of a response, in seconds._
+
+    Args:
+        response (_requests.Response_): _A response, usually a 403, 429 or 503._
+
+    Returns:
+        _float_: _Seconds to wait, or None if the header is missing or unreadable. The header may be a number of seconds or an HTTP date._
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo = datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
@@ -0,0 +1,330 @@
+import math
+import bisect
+import datetime
+from .ospo_metrics_tools import instrument
+
+# Defaults for the adaptive policy, in days.
+MIN_INTERVAL = 1
+MAX_INTERVAL = 90
+PRIOR_INTERVAL = 14
+# Crawls a budget may bring forward must find a change with at least this probability.
+MIN_PRIORITY = 0.05
+
+SIGNALS_QUERY = """
+    WITH ordered AS (
+        SELECT repositoryid, crawl_at, last_pushed, unchanged,
+               COALESCE(archived, (raw->>'isArchived')::boolean, (raw->>'archived')::boolean, FALSE) AS archived,
+               NOT unchanged AND LAG(crawl_at) OVER w IS NOT NULL
+               AND (last_pushed IS DISTINCT FROM LAG(last_pushed) OVER w
+                    OR stargazers IS DISTINCT FROM LAG(stargazers) OVER w
+                    OR forks IS DISTINCT FROM LAG(forks) OVER w
+                    OR issues IS DISTINCT FROM LAG(issues) OVER w) AS changed
+        FROM repositorycrawls
+        WHERE crawl_at IS NOT NULL
+        -- `unchanged` markers carry no metrics: full crawls are compared with the previous full crawl.
+        WINDOW w AS (PARTITION BY repositoryid, unchanged ORDER BY crawl_at)),
+    signals AS MATERIALIZED (
+        SELECT repositoryid,
+               MIN(crawl_at) AS first_crawl,
+               MAX(crawl_at) AS last_crawl,
+               COUNT(*) AS crawls,
+               COUNT(*) FILTER (WHERE changed) AS changes,
+               MAX(crawl_at) FILTER (WHERE changed) AS last_change,
+               MAX(last_pushed) AS last_pushed,
+               (array_agg(archived ORDER BY crawl_at DESC) FILTER (WHERE NOT unchanged))[1] AS archived
+        FROM ordered
+        GROUP BY repositoryid)
+    SELECT rp.repositoryid, rp.url, rp.ownerid, s.first_crawl, s.last_crawl,
+           COALESCE(s.crawls, 0), COALESCE(s.changes, 0), s.last_change,
+           s.last_pushed, COALESCE(s.archived, FALSE)
+    FROM repositories AS rp
+    LEFT JOIN signals AS s ON s.repositoryid = rp.repositoryid
+    WHERE rp.url ILIKE '%%github.com%%'
+      AND NOT (%(skip_missing)s AND EXISTS (SELECT 1
+                                            FROM repoqualitychecks AS rqc
+                                            WHERE rqc.repositoryid = rp.repositoryid
+                                            AND rqc.badstatus IN (404, 410)));"""
+
+SIGNAL_COLUMNS = ['repositoryid', 'url', 'ownerid', 'first_crawl', 'last_crawl', 'crawls',
+                  'changes', 'last_change', 'last_pushed', 'archived']
+
+
+def days(delta):
+    return delta.total_seconds() / 86400
+
+
+@instrument('db.crawl_signals_db')
+def crawl_signals_db(conn, skip_missing = True):
+    """_Summarize the crawl history of every GitHub repository, in a single query._
+
+    Two consecutive crawls differ if `last_pushed`, `stargazers`, `forks` or
+    `issues` changed between them. `unchanged` markers (see `filter_changed_repos()`)
+    count as crawls but are never compared, and `archived` comes from the latest
+    full crawl. Needs the marker column from `create_validator_table()`. The signals are aggregated once (MATERIALIZED),
+    so a poor row estimate on `repositories` cannot make the planner repeat the
+    window over every crawl for each repository.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        skip_missing (bool, optional): _Should repositories with a recorded 404 or 410 be skipped?_ Defaults to True.
+
+    Returns:
+        _list_: _One dict per repository with `first_crawl`, `last_crawl`, the number of `crawls` and `changes`, `last_change`, `last_pushed` and `archived`._
+    """
+    with conn.cursor() as cur:
+        cur.execute(SIGNALS_QUERY, {'skip_missing': skip_missing})
+        signals = [dict(zip(SIGNAL_COLUMNS, i)) for i in cur.fetchall()]
+    return signals
+
+
+def new_signals(repositoryid, url = None, ownerid = None):
+    """_The signals of a repository that has never been crawled._"""
+    return {'repositoryid': repositoryid, 'url': url, 'ownerid': ownerid,
+            'first_crawl': None, 'last_crawl': None, 'crawls': 0, 'changes': 0,
+            'last_change': None, 'last_pushed': None, 'archived': False, 'fingerprint': None}
+
+
+def update_signals(signals, crawl_at, fingerprint, last_pushed = None, archived = False):
+    """_Fold one more crawl into a repository's signals, as `crawl_signals_db()` would._
+
+    Args:
+        signals (_dict_): _Signals from `new_signals()` or a previous update, changed in place._
+        crawl_at (_datetime_): _The time of the crawl._
+        fingerprint (_tuple_): _The crawled (last_pushed, stargazers, forks, issues)._
+        last_pushed (_datetime_, optional): _The crawled `last_pushed`._ Defaults to None.
+        archived (bool, optional): _Was the repository archived?_ Defaults to False.
+
+    Returns:
+        _dict_: _The updated signals._
+    """
+    if signals['crawls'] > 0 and fingerprint != signals['fingerprint']:
+        signals['changes'] = signals['changes'] + 1
+        signals['last_change'] = crawl_at
+    if signals['first_crawl'] is None:
+        signals['first_crawl'] = crawl_at
+    signals['last_crawl'] = crawl_at
+    signals['crawls'] = signals['crawls'] + 1
+    signals['fingerprint'] = fingerprint
+    if last_pushed is not None and (signals['last_pushed'] is None or last_pushed > signals['last_pushed']):
+        signals['last_pushed'] = last_pushed
+    signals['archived'] = archived
+    return signals
+
+
+def change_rate(signals, min_interval = MIN_INTERVAL, max_interval = MAX_INTERVAL,
+                prior_interval = PRIOR_INTERVAL):
+    """_Estimate how often a repository changes, in changes per day._
+
+    The observed rate is smoothed with a prior of one change per `prior_interval`
+    days, so a short history does not swing the estimate. A repository crawled only
+    once is judged by how recently it had been pushed. The rate is never more than
+    once per quiet period (the days since the last change), so each crawl that finds
+    nothing new doubles the wait before the next one: exponential backoff. Archived
+    repositories get the slowest rate.
+
+    Args:
+        signals (_dict_): _Signals from `crawl_signals_db()` or `update_signals()`._
+        min_interval (float, optional): _The shortest interval between crawls, in days._ Defaults to MIN_INTERVAL.
+        max_interval (float, optional): _The longest interval between crawls, in days._ Defaults to MAX_INTERVAL.
+        prior_interval (float, optional): _The interval assumed before there is any history, in days._ Defaults to PRIOR_INTERVAL.
+
+    Returns:
+        _float_: _Expected changes per day, or None for a repository that was never crawled._
+    """
+    if signals['crawls'] == 0:
+        return None
+    if signals['archived']:
+        return 1 / max_interval
+    if signals['crawls'] < 2 and signals['last_pushed'] is not None:
+        rate = 1 / (max(days(signals['last_crawl'] - signals['last_pushed']), 0) + prior_interval)
+    else:
+        span = days(signals['last_crawl'] - signals['first_crawl'])
+        rate = (signals['changes'] + 1) / (span + prior_interval)
+    quiet = days(signals['last_crawl'] - (signals['last_change'] or signals['first_crawl']))
+    if quiet > 0:
+        rate = min(rate, 1 / quiet)
+    return min(max(rate, 1 / max_interval), 1 / min_interval)
+
+
+def crawl_priority(signals, now, horizon = PRIOR_INTERVAL, **policy):
+    """_Rank a repository for crawling, with its next crawl time._
+
+    The priority is the expected freshness a crawl buys: the probability that the
+    repository changed since its last crawl, `1 - exp(-rate * age)`, times the share
+    of the next `horizon` days it is then likely to stay unchanged,
+    `(1 - exp(-rate * horizon)) / (rate * horizon)`, with changes arriving at the
+    rate from `change_rate()`. The second term keeps a budget from being spent on
+    repositories that change so often they are stale again straight away.
+
+    Args:
+        signals (_dict_): _Signals from `crawl_signals_db()` or `update_signals()`._
+        now (_datetime_): _The current time._
+        horizon (float, optional): _Days until the repository is likely to be crawled again._ Defaults to PRIOR_INTERVAL.
+        **policy: _Settings passed to `change_rate()`._
+
+    Returns:
+        _tuple_: _The priority (1 for a repository never crawled) and the next crawl time (None if never crawled)._
+    """
+    rate = change_rate(signals, **policy)
+    if rate is None:
+        return 1.0, None
+    age = max(days(now - signals['last_crawl']), 0)
+    kept = (1 - math.exp(-rate * horizon)) / (rate * horizon)
+    return (1 - math.exp(-rate * age)) * kept, signals['last_crawl'] + datetime.timedelta(days = 1 / rate)
+
+
+def rank_crawls(signals, now, budget = None, min_priority = MIN_PRIORITY, **policy):
+    """_Choose the repositories to crawl now, highest priority first._
+
+    Without a budget every repository that is due is chosen. With one, the budget
+    is spent on the highest priorities, which maximizes the expected freshness for
+    that many API calls; the horizon is then the average time between visits,
+    `len(signals) / budget` days. Budget left over after the due repositories may
+    bring crawls forward, but only those due within the horizon and with at least
+    `min_priority`, so spare budget is not spent on repositories unlikely to have changed.
+
+    Args:
+        signals (_list_): _Signals from `crawl_signals_db()` or `update_signals()`._
+        now (_datetime_): _The current time._
+        budget (int, optional): _The most repositories to crawl._ Defaults to None (every due repository).
+        min_priority (float, optional): _The lowest priority of a crawl brought forward._ Defaults to MIN_PRIORITY.
+        **policy: _Settings passed to `change_rate()`._
+
+    Returns:
+        _list_: _The chosen signals, highest priority first._
+    """
+    horizon = PRIOR_INTERVAL if budget is None else max(len(signals) / max(budget, 1), MIN_INTERVAL)
+    ranked = []
+    for repo in signals:
+        priority, next_crawl = crawl_priority(repo, now, horizon = horizon, **policy)
+        due = next_crawl is None or next_crawl <= now
+        early = (budget is not None and not due and priority >= min_priority
+                 and next_crawl <= now + datetime.timedelta(days = horizon))
+        if due or early:
+            ranked.append((priority, repo))
+    ranked.sort(key = lambda x: x[0], reverse = True)
+    return [i[1] for i in ranked[:budget]]
+
+
+def plan_adaptive_crawls(conn, budget = None, now = None, skip_missing = True, **policy):
+    """_Find the repositories to crawl now, like `plan_repo_crawls()` but driven by each repository's activity._
+
+    Active repositories are crawled as often as daily and unchanged or archived ones
+    back off to every `max_interval` days, instead of everything every two weeks.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        budget (int, optional): _The most repositories to crawl, e.g. the day's API budget._ Defaults to None (every due repository).
+        now (_datetime_, optional): _The current time._ Defaults to now.
+        skip_missing (bool, optional): _Should repositories with a recorded 404 or 410 be skipped?_ Defaults to True.
+        **policy: _Settings passed to `rank_crawls()` (`min_priority`) and `change_rate()` (`min_interval`, `max_interval` and `prior_interval`)._
+
+    Returns:
+        _list_: _A list of (repositoryid, url, ownerid) tuples, highest priority first._
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    signals = crawl_signals_db(conn, skip_missing = skip_missing)
+    return [(i['repositoryid'], i['url'], i['ownerid'])
+            for i in rank_crawls(signals, now, budget = budget, **policy)]
+
+
+def flat_policy(interval = 14):
+    """_The old schedule for `simulate_policy()`: anything crawled more than `interval` days ago, oldest first._"""
+    def policy(signals, now, budget):
+        due = [i for i in signals
+               if i['last_crawl'] is None or days(now - i['last_crawl']) >= interval]
+        due.sort(key = lambda x: (x['last_crawl'] is not None, x['last_crawl'] or now))
+        return due[:budget]
+    return policy
+
+
+def adaptive_policy(**policy):
+    """_The adaptive schedule for `simulate_policy()`, with settings passed to `change_rate()`._"""
+    def adaptive(signals, now, budget):
+        return rank_crawls(signals, now, budget = budget, **policy)
+    return adaptive
+
+
+def load_crawl_history(conn, itersize = 10000):
+    """_Load every recorded crawl state, for `simulate_policy()`, skipping `unchanged` markers._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        itersize (int, optional): _Rows fetched from the server at a time._ Defaults to 10000.
+
+    Returns:
+        _dict_: _A mapping of repositoryid to its crawls in time order, each a (crawl_at, fingerprint, last_pushed, archived) tuple._
+    """
+    history_query = """
+        SELECT repositoryid, crawl_at, last_pushed, stargazers, forks, issues,
+               COALESCE(archived, (raw->>'isArchived')::boolean, (raw->>'archived')::boolean, FALSE)
+        FROM repositorycrawls
+        WHERE crawl_at IS NOT NULL AND NOT unchanged
+        ORDER BY repositoryid, crawl_at;"""
+    history = {}
+    with conn.cursor('ospo_crawl_history') as cur:
+        cur.itersize = itersize
+        cur.execute(history_query)
+        for repositoryid, crawl_at, last_pushed, stargazers, forks, issues, archived in cur:
+            history.setdefault(repositoryid, []).append(
+                (crawl_at, (last_pushed, stargazers, forks, issues), last_pushed, archived))
+    conn.rollback()
+    return history
+
+
+def simulate_policy(history, policy, budget, start = None, end = None, step = 1):
+    """_Replay recorded crawl history against a crawl policy with a fixed API budget._
+
+    The recorded crawls are taken as the truth: at any time a repository is in the
+    state of its latest recorded crawl. A repository appears, already crawled once,
+    at its first recorded crawl (its crawl on ingestion). Every `step` days the policy picks up to `budget` repositories to crawl, each
+    seeing the true state at that time. Freshness is the share of repositories whose
+    last crawl matches the truth. Changes the real crawls did not see are invisible
+    here, so compare policies with one another rather than reading freshness as absolute.
+
+    Args:
+        history (_dict_): _From `load_crawl_history()`._
+        policy (_function_): _From `flat_policy()` or `adaptive_policy()`, called with (signals, now, budget)._
+        budget (int): _Crawls allowed per step._
+        start (_datetime_, optional): _When the replay starts; repositories that already exist are crawled once at this time._ Defaults to the earliest crawl.
+        end (_datetime_, optional): _When the replay ends._ Defaults to the latest crawl.
+        step (float, optional): _Days between scheduling rounds._ Defaults to 1.
+
+    Returns:
+        _dict_: _The `crawls` spent, the `mean_freshness` and `min_freshness` over the replay, and the number of `steps`._
+    """
+    times = {k: [i[0] for i in v] for k, v in history.items() if len(v) > 0}
+    if start is None:
+        start = min(v[0] for v in times.values())
+    if end is None:
+        end = max(v[-1] for v in times.values())
+
+    def truth(repositoryid, now):
+        index = bisect.bisect_right(times[repositoryid], now) - 1
+        return history[repositoryid][index] if index >= 0 else None
+
+    signals = {k: new_signals(k) for k in times}
+    arrivals = sorted(times, key = lambda x: times[x][0])
+    visible = []
+    crawls = 0
+    freshness = []
+    now = start
+    while now <= end:
+        while len(arrivals) > 0 and times[arrivals[0]][0] <= now:
+            repositoryid = arrivals.pop(0)
+            state = truth(repositoryid, now)
+            update_signals(signals[repositoryid], max(state[0], start), state[1], state[2], state[3])
+            visible.append(signals[repositoryid])
+        for repo in policy(visible, now, budget):
+            state = truth(repo['repositoryid'], now)
+            update_signals(repo, now, state[1], state[2], state[3])
+            crawls = crawls + 1
+        if len(visible) > 0:
+            fresh = [i['fingerprint'] == truth(i['repositoryid'], now)[1] for i in visible]
+            freshness.append(sum(fresh) / len(fresh))
+        now = now + datetime.timedelta(days = step)
+    return {'crawls': crawls,
+            'mean_freshness': sum(freshness) / len(freshness) if freshness else None,
+            'min_freshness': min(freshness) if freshness else None,
+            'steps': len(freshness)}
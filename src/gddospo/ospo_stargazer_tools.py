@@ -0,0 +1,242 @@
+import os
+import json
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .ospo_runtime_tools import http_session
+from .ospo_crawl_tools import GITHUB_API, split_repo_url
+from .ospo_metrics_tools import instrument, METRICS
+
+# Returns `starred_at` with each stargazer, oldest first.
+STAR_MEDIA_TYPE = 'application/vnd.github.star+json'
+
+
+class StarCheckpoints:
+    """_How far the stargazers of each repository have been read, saved to disk between runs._
+
+    Keys are repository URLs. Each checkpoint records the last page read, how many
+    stargazers it held, the `starred_at` and login of the newest stargazer seen, and
+    `stars`, the position of that stargazer in the (oldest first) list.
+    """
+
+    def __init__(self, path = None):
+        """_Create or load the checkpoints._
+
+        Args:
+            path (_str_, optional): _A JSON file used to persist the checkpoints between runs._ Defaults to None.
+        """
+        self.path = path
+        self.repositories = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                self.repositories = json.load(checkpoint_file)
+
+    def __contains__(self, repo_url):
+        return repo_url in self.repositories
+
+    def get(self, repo_url):
+        return self.repositories.get(repo_url)
+
+    def set(self, repo_url, checkpoint):
+        self.repositories[repo_url] = checkpoint
+
+    def save(self):
+        if self.path is None:
+            return None
+        # Written aside and renamed, so an interrupted run never leaves a truncated file.
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(self.repositories, checkpoint_file)
+        os.replace(self.path + '.tmp', self.path)
+        return None
+
+
+@instrument('api.github.stargazers')
+def fetch_stargazer_page(owner, name, page, auth = None, session = None, per_page = 100, api = GITHUB_API):
+    """_Fetch one page of a repository's stargazers, with the time each star was added._
+
+    Args:
+        owner (_str_): _The repository owner._
+        name (_str_): _The repository name._
+        page (_int_): _The page, from 1._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        per_page (int, optional): _Stargazers per page, at most 100._ Defaults to 100.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _dict_: _The HTTP `status` and the `stars`, a list of (login, starred_at) tuples (empty unless found)._
+    """
+    if session is None:
+        session = http_session()
+    headers = {'Accept': STAR_MEDIA_TYPE}
+    if auth is not None:
+        headers['Authorization'] = f'bearer {auth}'
+    response = session.get(f'{api}/repos/{owner}/{name}/stargazers', headers = headers,
+                           params = {'per_page': per_page, 'page': page}, timeout = 30)
+    if response.status_code in [404, 451]:
+        return {'status': response.status_code, 'stars': []}
+    response.raise_for_status()
+    stars = [((i.get('user') or {}).get('login'), i.get('starred_at')) for i in response.json()]
+    return {'status': response.status_code, 'stars': [i for i in stars if i[0] is not None]}
+
+
+def after_checkpoint(stars, checkpoint):
+    """_The stargazers of a page added after the checkpoint, or None if the page starts after it._
+
+    Stars are listed oldest first, so everything after the checkpointed stargazer is
+    new. If the checkpointed stargazer is not on the page but the page is empty or
+    starts later than it, stars were removed and the list shifted: the caller should
+    step back a page.
+    """
+    if checkpoint is None:
+        return stars
+    for index, star in enumerate(stars):
+        if star == (checkpoint['user'], checkpoint['starred_at']):
+            return stars[index + 1:]
+    if len(stars) == 0 or stars[0][1] > checkpoint['starred_at']:
+        return None
+    return [i for i in stars if i[1] > checkpoint['starred_at']]
+
+
+def fetch_new_stargazers(repo_url, checkpoint = None, auth = None, session = None, per_page = 100,
+                         api = GITHUB_API):
+    """_Read a repository's stargazers from its checkpoint onward._
+
+    A repository without a checkpoint is read from the first page. Otherwise reading
+    starts at the checkpointed page (stepping back while earlier stars were removed),
+    so a run costs one request per hundred new stars plus one, not one per hundred stars.
+
+    Args:
+        repo_url (_str_): _A GitHub repository URL._
+        checkpoint (_dict_, optional): _The repository's checkpoint from `StarCheckpoints`._ Defaults to None.
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        per_page (int, optional): _Stargazers per page, at most 100._ Defaults to 100.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _dict_: _The last HTTP `status`, the new `stars` as rows for `TimeSeriesStore.append_stars()`, the new `checkpoint` and the number of `requests`._
+    """
+    repo_string = split_repo_url(repo_url)
+    if repo_string is None:
+        return {'status': None, 'stars': [], 'checkpoint': checkpoint, 'requests': 0}
+    owner, name = repo_string
+    page = 1 if checkpoint is None or checkpoint.get('per_page') != per_page else checkpoint['page']
+    requests_made = 0
+    new_stars = []
+    latest = checkpoint
+    resumed = False
+    while True:
+        result = fetch_stargazer_page(owner, name, page, auth, session, per_page, api)
+        requests_made = requests_made + 1
+        if result['status'] != 200:
+            break
+        stars = after_checkpoint(result['stars'], None if resumed else checkpoint)
+        if stars is None and page > 1:
+            page = page - 1
+            continue
+        resumed = True
+        new_stars.extend(result['stars'] if stars is None else stars)
+        if len(result['stars']) > 0:
+            user, starred_at = result['stars'][-1]
+            latest = {'page': page, 'per_page': per_page, 'user': user, 'starred_at': starred_at,
+                      'stars': (page - 1) * per_page + len(result['stars'])}
+        if len(result['stars']) < per_page:
+            break
+        page = page + 1
+    METRICS.count('stargazers.new', len(new_stars))
+    return {'status': result['status'],
+            'stars': [{'repo_url': repo_url, 'user': user, 'starred_at': starred_at}
+                      for user, starred_at in new_stars],
+            'checkpoint': latest,
+            'requests': requests_made}
+
+
+@instrument('stargazers.update')
+def update_stargazers(store, repositories, checkpoints, stargazer_counts = None, auth = None,
+                      session = None, workers = 8, chunk_size = 100, api = GITHUB_API, verbose = True):
+    """_Append the stars added since the last run to a `TimeSeriesStore`._
+
+    Repositories are read concurrently, `workers` at a time. New stars are written
+    to the store before the checkpoints are saved, a chunk of repositories at a time,
+    so an interrupted run repeats (and the store skips) stars rather than losing them.
+
+    Args:
+        store (_TimeSeriesStore_): _The store to append to._
+        repositories (_list_): _GitHub repository URLs._
+        checkpoints (_StarCheckpoints_): _The checkpoints to resume from and update._
+        stargazer_counts (_dict_, optional): _Current star counts by URL, e.g. from `latest_stargazer_counts()`. Repositories whose count matches their checkpoint are skipped without a request._ Defaults to None.
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        session (_requests.Session_, optional): _A session to reuse between calls._ Defaults to None.
+        workers (int, optional): _The number of repositories read at once._ Defaults to 8.
+        chunk_size (int, optional): _Repositories between writes to the store._ Defaults to 100.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+        verbose (bool, optional): _Should the function print progress?_ Defaults to True.
+
+    Returns:
+        _dict_: _Counts of `repositories` read, `skipped` (unchanged), `missing` and `failed` repositories, GitHub `requests` and new `stars`._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+    if session is None:
+        session = http_session(workers = workers)
+    summary = {'repositories': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'requests': 0, 'stars': 0}
+    to_read = []
+    for repo_url in repositories:
+        checkpoint = checkpoints.get(repo_url)
+        if stargazer_counts is not None and checkpoint is not None \
+                and stargazer_counts.get(repo_url) == checkpoint['stars']:
+            summary['skipped'] = summary['skipped'] + 1
+        else:
+            to_read.append(repo_url)
+
+    def read(repo_url):
+        try:
+            return fetch_new_stargazers(repo_url, checkpoints.get(repo_url), auth, session, api = api)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to read the stargazers of {repo_url}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        for start in range(0, len(to_read), chunk_size):
+            chunk = to_read[start:start + chunk_size]
+            results = list(executor.map(read, chunk))
+            new_stars = [star for result in results if result is not None for star in result['stars']]
+            store.append_stars(new_stars)
+            for repo_url, result in zip(chunk, results):
+                if result is None:
+                    summary['failed'] = summary['failed'] + 1
+                    continue
+                summary['repositories'] = summary['repositories'] + 1
+                summary['requests'] = summary['requests'] + result['requests']
+                summary['stars'] = summary['stars'] + len(result['stars'])
+                if result['status'] != 200:
+                    summary['missing'] = summary['missing'] + 1
+                elif result['checkpoint'] is not None:
+                    checkpoints.set(repo_url, result['checkpoint'])
+            checkpoints.save()
+            if verbose:
+                print(f"Read {summary['repositories']} of {len(to_read)} repositories: "
+                      f"{summary['stars']} new stars with {summary['requests']} requests.")
+    return summary
+
+
+def latest_stargazer_counts(conn):
+    """_The star count of each repository at its latest crawl._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+
+    Returns:
+        _dict_: _Star counts by repository URL._
+    """
+    count_query = """
+        SELECT DISTINCT ON (rc.repositoryid) rp.url, rc.stargazers
+        FROM repositorycrawls AS rc
+        INNER JOIN repositories AS rp ON rp.repositoryid = rc.repositoryid
+        WHERE rc.stargazers IS NOT NULL
+        ORDER BY rc.repositoryid, rc.crawl_at DESC;"""
+    with conn.cursor() as cur:
+        cur.execute(count_query)
+        counts = dict(cur.fetchall())
+    conn.rollback()
+    return counts
@@ -0,0 +1,345 @@
+import os
+import uuid
+import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from .ospo_metrics_tools import instrument
+
+# One row per star, as in `stargazer_history.parquet`, with `starred_at` parsed.
+STAR_SCHEMA = pa.schema([('id', pa.string()),
+                         ('repo_url', pa.string()),
+                         ('user', pa.string()),
+                         ('starred_at', pa.timestamp('us')),
+                         ('month', pa.string())])
+
+# One row per crawl of a repository, the counts from `repositorycrawls`.
+OBSERVATION_SCHEMA = pa.schema([('repo_url', pa.string()),
+                                ('observed_at', pa.timestamp('us')),
+                                ('stargazers', pa.int64()),
+                                ('forks', pa.int64()),
+                                ('issues', pa.int64()),
+                                ('month', pa.string())])
+
+MONTHS = ds.partitioning(pa.schema([('month', pa.string())]), flavor = 'hive')
+
+
+def parse_timestamps(values):
+    """_Parse GitHub (`2023-04-26T09:28:41Z`) or stored (`2023-04-26 09:28:41.000000`) times._
+
+    Args:
+        values (_pyarrow.Array_): _Strings or timestamps._
+
+    Returns:
+        _pyarrow.Array_: _Timestamps in microseconds, without a time zone (UTC)._
+    """
+    if pa.types.is_timestamp(values.type):
+        return pc.cast(values, pa.timestamp('us')) if values.type.tz is None \
+            else pc.cast(pc.cast(values, pa.timestamp('us', tz = 'UTC')), pa.timestamp('us'))
+    return pc.cast(pc.replace_substring_regex(values, 'Z$', ''), pa.timestamp('us'))
+
+
+def month_of(values):
+    return pc.strftime(values, format = '%Y-%m')
+
+
+def month_filter(field, start = None, end = None):
+    """_A dataset filter on `field` that also prunes the month partitions._"""
+    expression = None
+    if start is not None:
+        expression = (ds.field('month') >= start.strftime('%Y-%m')) & (ds.field(field) >= pa.scalar(start, pa.timestamp('us')))
+    if end is not None:
+        bound = (ds.field('month') <= end.strftime('%Y-%m')) & (ds.field(field) < pa.scalar(end, pa.timestamp('us')))
+        expression = bound if expression is None else expression & bound
+    return expression
+
+
+class TimeSeriesStore:
+    """_Month-partitioned Parquet datasets of stars and crawl counts per repository._
+
+    `stars/` holds one row per star (as in `stargazer_history.parquet`) and
+    `observations/` holds the stargazer, fork and issue counts of each crawl. Both
+    are partitioned by month (`month=YYYY-MM/`), appends add new files, and queries
+    read only the columns and months they need, aggregating with `pyarrow.compute`.
+    """
+
+    def __init__(self, path):
+        """_Open (or create) a store._
+
+        Args:
+            path (_str_): _The directory holding the `stars/` and `observations/` datasets._
+        """
+        self.path = path
+        self.stars_path = os.path.join(path, 'stars')
+        self.observations_path = os.path.join(path, 'observations')
+        os.makedirs(self.stars_path, exist_ok = True)
+        os.makedirs(self.observations_path, exist_ok = True)
+
+    def dataset(self, name):
+        if name == 'stars':
+            return ds.dataset(self.stars_path, schema = STAR_SCHEMA, format = 'parquet', partitioning = MONTHS)
+        return ds.dataset(self.observations_path, schema = OBSERVATION_SCHEMA, format = 'parquet', partitioning = MONTHS)
+
+    def write(self, table, path):
+        # A fresh basename per append, so new files never replace existing ones.
+        ds.write_dataset(table, path, format = 'parquet', partitioning = MONTHS,
+                         basename_template = f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+                         existing_data_behavior = 'overwrite_or_ignore',
+                         max_rows_per_group = 1024 * 1024)
+
+    @instrument('timeseries.append_stars')
+    def append_stars(self, stars):
+        """_Add stars, skipping any already in the store._
+
+        Args:
+            stars (_pyarrow.Table_ or _list_): _Rows with `repo_url`, `user` and `starred_at`, and optionally `id`._
+
+        Returns:
+            _int_: _The number of new stars written._
+        """
+        table = stars if isinstance(stars, pa.Table) else pa.Table.from_pylist(stars)
+        if table.num_rows == 0:
+            return 0
+        starred_at = parse_timestamps(table['starred_at'])
+        if 'id' in table.column_names:
+            ids = table['id']
+        else:
+            ids = pc.binary_join_element_wise(table['repo_url'], table['user'], '/')
+        table = pa.table({'id': ids, 'repo_url': table['repo_url'], 'user': table['user'],
+                          'starred_at': starred_at, 'month': month_of(starred_at)},
+                         schema = STAR_SCHEMA)
+        table = table.filter(pc.is_valid(table['starred_at']))
+        # A star's month never changes, so duplicates can only be in the months being written.
+        months = pc.unique(table['month'])
+        existing = self.dataset('stars').to_table(columns = ['id'],
+                                                  filter = ds.field('month').isin(months))
+        if existing.num_rows > 0:
+            table = table.filter(pc.invert(pc.is_in(table['id'], value_set = existing['id'])))
+        if table.num_rows != len(pc.unique(table['id'])):
+            unique = table.group_by('id', use_threads = False) \
+                .aggregate([(i, 'first') for i in STAR_SCHEMA.names[1:]])
+            table = pa.table({i: unique[i if i == 'id' else f'{i}_first'] for i in STAR_SCHEMA.names})
+        if table.num_rows > 0:
+            self.write(table.select(STAR_SCHEMA.names).cast(STAR_SCHEMA), self.stars_path)
+        return table.num_rows
+
+    def import_stargazer_history(self, path):
+        """_Load `stargazer_history.parquet` (or another file with the same columns) into the store._
+
+        Args:
+            path (_str_): _The Parquet file, e.g. `../source_data/stargazer_history.parquet`._
+
+        Returns:
+            _int_: _The number of new stars written._
+        """
+        return self.append_stars(pq.read_table(path, columns = ['id', 'repo_url', 'user', 'starred_at']))
+
+    @instrument('timeseries.append_observations')
+    def append_observations(self, observations):
+        """_Add crawl counts for repositories._
+
+        Args:
+            observations (_pyarrow.Table_ or _list_): _Rows with `repo_url`, `observed_at`, `stargazers`, `forks` and `issues`._
+
+        Returns:
+            _int_: _The number of observations written._
+        """
+        table = observations if isinstance(observations, pa.Table) else pa.Table.from_pylist(observations)
+        if table.num_rows == 0:
+            return 0
+        observed_at = parse_timestamps(table['observed_at'])
+        table = pa.table({'repo_url': table['repo_url'], 'observed_at': observed_at,
+                          'stargazers': pc.cast(table['stargazers'], pa.int64()),
+                          'forks': pc.cast(table['forks'], pa.int64()),
+                          'issues': pc.cast(table['issues'], pa.int64()),
+                          'month': month_of(observed_at)}, schema = OBSERVATION_SCHEMA)
+        self.write(table, self.observations_path)
+        return table.num_rows
+
+    def latest_observation(self):
+        """_The time of the newest crawl observation, the checkpoint for `append_crawl_observations()`._"""
+        months = [i.split('=')[-1] for i in os.listdir(self.observations_path) if i.startswith('month=')]
+        if len(months) == 0:
+            return None
+        table = self.dataset('observations').to_table(columns = ['observed_at'],
+                                                      filter = ds.field('month') == max(months))
+        return pc.max(table['observed_at']).as_py()
+
+    def compact(self, name = 'stars', months = None):
+        """_Rewrite each month of a dataset as a single file, after many small appends._
+
+        Args:
+            name (str, optional): _'stars' or 'observations'._ Defaults to 'stars'.
+            months (_list_, optional): _The months (YYYY-MM) to rewrite._ Defaults to every month with more than one file.
+
+        Returns:
+            _list_: _The months rewritten._
+        """
+        path = self.stars_path if name == 'stars' else self.observations_path
+        schema = STAR_SCHEMA if name == 'stars' else OBSERVATION_SCHEMA
+        if months is None:
+            months = [i.split('=')[-1] for i in os.listdir(path)
+                      if i.startswith('month=') and len(os.listdir(os.path.join(path, i))) > 1]
+        for month in months:
+            folder = os.path.join(path, f'month={month}')
+            old_files = os.listdir(folder)
+            table = self.dataset(name).to_table(filter = ds.field('month') == month)
+            sort_key = 'starred_at' if name == 'stars' else 'observed_at'
+            table = table.sort_by([('repo_url', 'ascending'), (sort_key, 'ascending')])
+            self.write(table.cast(schema), path)
+            for old in old_files:
+                os.remove(os.path.join(folder, old))
+        return months
+
+    @instrument('timeseries.star_growth')
+    def star_growth(self, days = 90, now = None, repos = None, top = 100):
+        """_Rank repositories by the stars they gained in the last `days` days._
+
+        Example:
+            store.star_growth(days = 90, repos = uw_repo_urls, top = 100)
+
+        Args:
+            days (int, optional): _The window, in days._ Defaults to 90.
+            now (_datetime_, optional): _The end of the window._ Defaults to now (UTC).
+            repos (_list_, optional): _Only consider these repository URLs, e.g. the UW repositories._ Defaults to None (all).
+            top (int, optional): _How many repositories to return, or None for all._ Defaults to 100.
+
+        Returns:
+            _pyarrow.Table_: _`repo_url` and `stars`, most stars first._
+        """
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo = None)  # Stars are in UTC.
+        expression = month_filter('starred_at', now - datetime.timedelta(days = days), now)
+        if repos is not None:
+            expression = expression & ds.field('repo_url').isin(pa.array(list(repos), pa.string()))
+        table = self.dataset('stars').to_table(columns = ['repo_url'], filter = expression)
+        counts = table.group_by('repo_url').aggregate([('repo_url', 'count')])
+        counts = pa.table({'repo_url': counts['repo_url'], 'stars': counts['repo_url_count']})
+        counts = counts.sort_by([('stars', 'descending'), ('repo_url', 'ascending')])
+        return counts if top is None else counts.slice(0, top)
+
+    @instrument('timeseries.star_trend')
+    def star_trend(self, repos = None, start = None, end = None):
+        """_Stars gained per repository and month, with the running total._
+
+        Args:
+            repos (_list_, optional): _Only these repository URLs._ Defaults to None (all).
+            start (_datetime_, optional): _The first time to include._ Defaults to None (the beginning).
+            end (_datetime_, optional): _The time to stop before._ Defaults to None (no limit).
+
+        Returns:
+            _pyarrow.Table_: _`repo_url`, `month`, `stars` that month and the `total` to the end of the month (counting from `start`)._
+        """
+        expression = month_filter('starred_at', start, end)
+        if repos is not None:
+            repo_filter = ds.field('repo_url').isin(pa.array(list(repos), pa.string()))
+            expression = repo_filter if expression is None else expression & repo_filter
+        table = self.dataset('stars').to_table(columns = ['repo_url', 'month'], filter = expression)
+        monthly = table.group_by(['repo_url', 'month']).aggregate([('month', 'count')])
+        monthly = pa.table({'repo_url': monthly['repo_url'], 'month': monthly['month'],
+                            'stars': monthly['month_count']}) \
+            .sort_by([('repo_url', 'ascending'), ('month', 'ascending')])
+        if monthly.num_rows == 0:
+            return monthly.append_column('total', pa.array([], pa.int64()))
+        # Running totals per repository: the overall cumulative sum, less its value where each repository starts.
+        stars = monthly['stars'].combine_chunks()
+        running = pc.cumulative_sum(stars)
+        repo = monthly['repo_url'].combine_chunks()
+        first = pc.not_equal(repo, pa.concat_arrays([pa.array([None], pa.string()), repo.slice(0, len(repo) - 1)]))
+        base = pc.fill_null_forward(pc.if_else(pc.fill_null(first, True), pc.subtract(running, stars), None))
+        return monthly.append_column('total', pc.subtract(running, base))
+
+    @instrument('timeseries.observation_growth')
+    def observation_growth(self, metric = 'stargazers', days = 90, now = None, repos = None, top = 100):
+        """_Rank repositories by the change in a crawled count over the last `days` days._
+
+        The change is the last crawl in the window minus the first, so repositories
+        need two crawls in the window.
+
+        Args:
+            metric (str, optional): _'stargazers', 'forks' or 'issues'._ Defaults to 'stargazers'.
+            days (int, optional): _The window, in days._ Defaults to 90.
+            now (_datetime_, optional): _The end of the window._ Defaults to now (local time, as `crawl_at`).
+            repos (_list_, optional): _Only consider these repository URLs._ Defaults to None (all).
+            top (int, optional): _How many repositories to return, or None for all._ Defaults to 100.
+
+        Returns:
+            _pyarrow.Table_: _`repo_url`, the `first` and `last` counts and their `growth`, largest growth first._
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        expression = month_filter('observed_at', now - datetime.timedelta(days = days), now)
+        if repos is not None:
+            expression = expression & ds.field('repo_url').isin(pa.array(list(repos), pa.string()))
+        table = self.dataset('observations').to_table(columns = ['repo_url', 'observed_at', metric],
+                                                      filter = expression & pc.is_valid(ds.field(metric)))
+        table = table.sort_by([('repo_url', 'ascending'), ('observed_at', 'ascending')])
+        # Ordered aggregation (first/last) needs a single thread.
+        growth = table.group_by('repo_url', use_threads = False) \
+            .aggregate([(metric, 'first'), (metric, 'last'), (metric, 'count')])
+        growth = growth.filter(pc.greater(growth[f'{metric}_count'], 1))
+        growth = pa.table({'repo_url': growth['repo_url'],
+                           'first': growth[f'{metric}_first'],
+                           'last': growth[f'{metric}_last'],
+                           'growth': pc.subtract(growth[f'{metric}_last'], growth[f'{metric}_first'])})
+        growth = growth.sort_by([('growth', 'descending'), ('repo_url', 'ascending')])
+        return growth if top is None else growth.slice(0, top)
+
+
+def append_crawl_observations(conn, store, since = None, itersize = 50000):
+    """_Copy new crawl counts from `repositorycrawls` into the store._
+
+    Only the count columns are read, never the README or raw blobs, and only
+    crawls newer than the store's latest observation. `unchanged` markers, which
+    have no counts, are skipped.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+        store (_TimeSeriesStore_): _The store to append to._
+        since (_datetime_, optional): _Only crawls after this time._ Defaults to `store.latest_observation()`.
+        itersize (int, optional): _Rows fetched and written at a time._ Defaults to 50000.
+
+    Returns:
+        _int_: _The number of observations written._
+    """
+    if since is None:
+        since = store.latest_observation() or datetime.datetime(1970, 1, 1)
+    crawl_query = """
+        SELECT rp.url, rc.crawl_at, rc.stargazers, rc.forks, rc.issues
+        FROM repositorycrawls AS rc
+        INNER JOIN repositories AS rp ON rp.repositoryid = rc.repositoryid
+        WHERE rc.crawl_at > %s AND rc.stargazers IS NOT NULL
+        ORDER BY rc.crawl_at;"""
+    written = 0
+    with conn.cursor('ospo_crawl_observations') as cur:
+        cur.itersize = itersize
+        cur.execute(crawl_query, (since,))
+        while True:
+            rows = cur.fetchmany(itersize)
+            if len(rows) == 0:
+                break
+            columns = list(zip(*rows))
+            written = written + store.append_observations(pa.table({'repo_url': pa.array(columns[0], pa.string()),
+                                                                    'observed_at': pa.array(columns[1], pa.timestamp('us')),
+                                                                    'stargazers': pa.array(columns[2], pa.int64()),
+                                                                    'forks': pa.array(columns[3], pa.int64()),
+                                                                    'issues': pa.array(columns[4], pa.int64())}))
+    conn.rollback()
+    return written
+
+
+def tracked_repositories(conn):
+    """_The URLs of the repositories in the OSPO database, to restrict queries to the UW repositories._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+
+    Returns:
+        _list_: _Repository URLs._
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT url FROM repositories;")
+        urls = [i[0] for i in cur.fetchall()]
+    conn.rollback()
+    return urls
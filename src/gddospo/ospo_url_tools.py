@@ -0,0 +1,139 @@
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from .ospo_runtime_tools import http_session
+from .ospo_db_tools import clean_repo_name, commit_db, rollback_db
+from .ospo_metrics_tools import instrument
+from .ospo_cache_tools import TTLCache
+
+
+class LivenessCache(TTLCache):
+    """_A time-limited cache of repository URL checks, optionally saved to disk._
+
+    Only definitive answers (the URL resolved, or returned 404/410) are cached, so
+    timeouts and rate limited responses are retried on the next import.
+    """
+
+    def get(self, url):
+        return self.entry(url)
+
+    def set(self, url, result):
+        if result.get('code') in [200, 404, 410]:
+            self.store(url, result)
+
+
+def url_session(workers = 16):
+    """_Return the shared session that keeps connections alive for every host we probe._
+
+    Args:
+        workers (int, optional): _The number of concurrent requests the session must support._ Defaults to 16.
+
+    Returns:
+        _requests.Session_: _A session with a connection pool sized for at least `workers`._
+    """
+    return http_session('url', workers)
+
+
+@instrument('url.probe_repository_url')
+def probe_repository_url(repo, session = None, timeout = 10):
+    """_Validate a repository path using a HEAD call, with a timeout._
+
+    Args:
+        repo (_str_): _A repository URL._
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        timeout (int, optional): _Seconds before the request is abandoned._ Defaults to 10.
+
+    Returns:
+        _dict_: _The same status and redirect as `check_repository_url()`, plus the HTTP `code` (None if the request failed)._
+    """
+    if repo is None:
+        return {"status": False, "redirect": None, "code": None}
+    if session is None:
+        session = http_session()
+    check_repo = clean_repo_name(repo)
+    try:
+        check = session.head(check_repo, allow_redirects=True, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        print(f'Failed to resolve: {e}')
+        return {"status": False, "redirect": None, "code": None}
+    if check.status_code == 200:
+        if check.url == check_repo:
+            return {"status": True, "redirect": None, "code": 200}
+        else:
+            return {"status": True, "redirect": check.url, "code": 200}
+    return {"status": False, "redirect": None, "code": check.status_code}
+
+
+def check_repository_urls(urls, workers = 16, timeout = 10, session = None, cache = None):
+    """_Check many repository URLs concurrently over pooled connections._
+
+    Args:
+        urls (_list_): _Repository URLs._
+        workers (int, optional): _The number of checks in flight at once._ Defaults to 16.
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 10.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        cache (_LivenessCache_, optional): _A cache of earlier results to consult and update._ Defaults to None.
+
+    Returns:
+        _dict_: _A mapping of URL to the result of `probe_repository_url()`._
+    """
+    if session is None:
+        session = url_session(workers)
+    results = {}
+    to_check = []
+    for url in dict.fromkeys(urls):
+        cached = cache.get(url) if cache is not None else None
+        if cached is not None:
+            results[url] = cached
+        else:
+            to_check.append(url)
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        checks = executor.map(lambda x: probe_repository_url(x, session, timeout), to_check)
+        for url, check in zip(to_check, checks):
+            results[url] = check
+            if cache is not None:
+                cache.set(url, check)
+    if cache is not None:
+        cache.save()
+    return results
+
+
+def check_repository_urls_db(conn, repositories, workers = 16, timeout = 10,
+                             session = None, cache = None, verbose = True):
+    """_Check many repositories and record 404, 410 and 301 results in `repoqualitychecks`._
+
+    Args:
+        conn (_connection_): _A psycopg2 connection object, to the OSPO database._
+        repositories (_dict_): _A mapping of URL to repositoryid, e.g., from `bulk_add_repos()`._
+        workers (int, optional): _The number of checks in flight at once._ Defaults to 16.
+        timeout (int, optional): _Seconds before each request is abandoned._ Defaults to 10.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        cache (_LivenessCache_, optional): _A cache of earlier results to consult and update._ Defaults to None.
+        verbose (bool, optional): _Should the function print a summary?_ Defaults to True.
+
+    Returns:
+        _dict_: _A mapping of URL to the result of `probe_repository_url()`._
+    """
+    results = check_repository_urls(list(repositories.keys()), workers = workers,
+                                    timeout = timeout, session = session, cache = cache)
+    bad_repos = []
+    for url, check in results.items():
+        if check.get('code') in [404, 410]:
+            bad_repos.append((repositories[url], check.get('code'), None))
+        elif check.get('redirect'):
+            bad_repos.append((repositories[url], 301, check.get('redirect')))
+    bad_repo_query = """
+        INSERT INTO repoqualitychecks (repositoryid, badstatus, url)
+        VALUES %s
+        ON CONFLICT DO NOTHING;"""
+    if len(bad_repos) > 0:
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, bad_repo_query, bad_repos)
+            commit_db(conn)
+        except Exception as e:
+            print(f"Failed to update.\n{e}")
+            rollback_db(conn)
+    if verbose:
+        print(f"Checked {len(results)} repositories, {len(bad_repos)} were missing or redirected.")
+    return results
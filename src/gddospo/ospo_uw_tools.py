@@ -3,10 +3,15 @@ import pyalex
 import itertools
 import requests
 import os
-from github import Github
-from github import Auth
+import time
+from concurrent.futures import ThreadPoolExecutor
 from psycopg2.extras import execute_values
-from .ospo_db_tools import check_owner, insert_repository_db
+from .ospo_runtime_tools import github_client, http_session
+from .ospo_db_tools import check_owner, insert_repository_db, commit_db, bulk_add_repos, batch, clean_repo_name
+from .ospo_metrics_tools import instrument
+from .ospo_crossref_tools import normalize_doi
+
+GITHUB_API = 'https://api.github.com'
 
 def uw_validate_authors(openalex_record, lineage = "https://openalex.org/I135310074"):
     """_Check if an author is from the UW system._
@@ -62,20 +67,165 @@ def uw_publication_check(conn, doi, add_valid = True, add_invalid = True):
             print(f"Link to the University of Wisconsin for {doi} based on OpenAlex records.")
             if add_valid:
                 cur.execute(add_uwpub, (pubid[0], True))    
-                conn.commit()
+                commit_db(conn)
         elif not uw_validate_authors(openalex_record):
             print(f"Non-link to the University of Wisconsin for {doi} based on OpenAlex records.")
             if add_invalid:
                 cur.execute(add_uwpub, (pubid[0], False))
-                conn.commit()     
+                commit_db(conn)     
     return None
 
-def check_all_pubs(conn, source = 'OpenAlex Search'):
+@instrument('uw.openalex_works_batch')
+def openalex_works_batch(dois):
+    """_Fetch OpenAlex works for up to 50 DOIs with a single `filter=doi:a|b|c` request._
+
+    DOIs containing `,` or `|` cannot be expressed in a filter, so they are fetched
+    one at a time.
+
+    Args:
+        dois (_list_): _Up to 50 DOIs._
+
+    Returns:
+        _dict_: _A mapping of each DOI (as given) to its OpenAlex record. DOIs OpenAlex does not know are left out._
+    """
+    pyalex.config.email = "goring@wisc.edu"
+    keys = {normalize_doi(doi): doi for doi in dois}
+    batched = [k for k in keys if ',' not in k and '|' not in k]
+    records = []
+    if len(batched) > 0:
+        records = Works().filter(doi = '|'.join(batched)).select(['doi', 'authorships']).get(per_page = 50)
+    for key in keys:
+        if key not in batched:
+            try:
+                records.append(Works()['https://doi.org/' + key])
+            except requests.exceptions.RequestException as e:
+                print(f"Could not get source record for {keys[key]}. Skipping: {e}")
+    output = {}
+    for record in records:
+        key = normalize_doi(record.get('doi') or '')
+        if key in keys:
+            output[keys[key]] = record
+    return output
+
+@instrument('uw.uw_publication_check_batch')
+def uw_publication_check_batch(conn, dois, add_valid = True, add_invalid = True,
+                               batch_size = 50, verbose = True):
+    """_Check many publications for a link to the University of Wisconsin, 50 DOIs per OpenAlex request._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection object._
+        dois (_list_): _DOIs as stored in `publications`._
+        add_valid (bool, optional): _Should a valid link to a University of Wisconsin author be added to the database?_. Defaults to True.
+        add_invalid (bool, optional): _Should we record a lack of a valid link to the database?_. Defaults to True.
+        batch_size (int, optional): _DOIs per OpenAlex request, at most 50._ Defaults to 50.
+        verbose (bool, optional): _Should the function print a summary?_ Defaults to True.
+
+    Returns:
+        _dict_: _A mapping of DOI to `True` or `False` for every DOI OpenAlex returned._
+    """
+    pub_search = """
+        SELECT doi, publicationid FROM publications
+        WHERE doi = ANY(%s);"""
+    ids_query = """
+        SELECT (SELECT uwrelationid FROM uwrelations WHERE uwrelation = 'UW Person'),
+               (SELECT sourceid FROM ospoimportsources WHERE sourcename = 'OpenAlex Search');"""
+    # Publications this source has already checked are skipped, so retried jobs
+    # and overlapping workers do not add duplicate rows.
+    add_uwpub = """
+        INSERT INTO uwpublications(publicationid, uwrelationid, sourceid, valid)
+        SELECT new.publicationid, new.uwrelationid, new.sourceid, new.valid
+        FROM (VALUES %s) AS new(publicationid, uwrelationid, sourceid, valid)
+        WHERE NOT EXISTS (SELECT 1
+                          FROM uwpublications AS uwp
+                          WHERE uwp.publicationid = new.publicationid
+                            AND uwp.sourceid = new.sourceid);"""
+    dois = [i for i in dict.fromkeys(dois) if i]
+    with conn.cursor() as cur:
+        cur.execute(pub_search, (dois,))
+        pubids = dict(cur.fetchall())
+        cur.execute(ids_query)
+        uwrelationid, sourceid = cur.fetchone()
+    results = {}
+    batch_size = min(batch_size, 50)
+    for i in range(0, len(dois), batch_size):
+        chunk = dois[i:i + batch_size]
+        try:
+            records = openalex_works_batch(chunk)
+        except requests.exceptions.RequestException as e:
+            print(f"Could not get source records for {len(chunk)} DOIs. Skipping: {e}")
+            continue
+        for doi, record in records.items():
+            results[doi] = uw_validate_authors(record)
+    rows = [(pubids[doi], uwrelationid, sourceid, valid) for doi, valid in results.items()
+            if doi in pubids and ((valid and add_valid) or (not valid and add_invalid))]
+    if len(rows) > 0:
+        with conn.cursor() as cur:
+            execute_values(cur, add_uwpub, rows, template = "(%s::int, %s::int, %s::int, %s::boolean)")
+        commit_db(conn)
+    if verbose:
+        print(f"Checked {len(results)} of {len(dois)} publications in OpenAlex, "
+              + f"{len([i for i in results.values() if i])} linked to the University of Wisconsin.")
+    return results
+
+UW_INDEXES = """
+    CREATE INDEX IF NOT EXISTS uwpublications_sourceid_publicationid_idx
+    ON uwpublications (sourceid, publicationid);"""
+
+UNCHECKED_QUERY = """
+    SELECT pub.publicationid, pub.doi
+    FROM publications AS pub
+    WHERE pub.doi IS NOT NULL
+      AND NOT EXISTS (SELECT 1
+                      FROM uwpublications AS uwp
+                      WHERE uwp.publicationid = pub.publicationid
+                        AND uwp.sourceid = %s)
+    ORDER BY pub.publicationid;"""
+
+def create_uw_indexes(conn):
+    """_Create the index that lets `iter_unchecked_pubs()` run as an index-backed anti-join._
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection._
+    """
+    with conn.cursor() as cur:
+        cur.execute(UW_INDEXES)
+    commit_db(conn)
+
+def iter_unchecked_pubs(conn, sourceid, chunk_size = 1000):
+    """_Stream publications that have not been checked against a source, in chunks._
+
+    Uses a server-side (named) cursor, so only one chunk is held in memory at a
+    time. The cursor is declared `WITH HOLD`, so it survives the commits made while
+    each chunk is processed.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection object._
+        sourceid (_int_): _The `ospoimportsources` id of the validation source._
+        chunk_size (int, optional): _Rows fetched from the server at a time._ Defaults to 1000.
+
+    Yields:
+        _list_: _Up to `chunk_size` (publicationid, doi) tuples._
+    """
+    cur = conn.cursor(name = 'ospo_unchecked_pubs', withhold = True)
+    try:
+        cur.itersize = chunk_size
+        cur.execute(UNCHECKED_QUERY, (sourceid,))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+            yield rows
+    finally:
+        cur.close()
+
+def check_all_pubs(conn, source = 'OpenAlex Search', batch_size = 50, chunk_size = 1000):
     """_Uses a defined source (currently only OpenAlex) to check if authors are from UW._
 
     Args:
         conn (_connection_): _A valid psycopg2 connection object._
         source (str, optional): _description_. Defaults to 'OpenAlex Search'.
+        batch_size (int, optional): _DOIs per OpenAlex request, at most 50._ Defaults to 50.
+        chunk_size (int, optional): _Unchecked publications read from the database, and written back, at a time._ Defaults to 1000.
 
     Returns:
         _None_: _The function updates the database but does not return a result._
@@ -84,22 +234,15 @@ def check_all_pubs(conn, source = 'OpenAlex Search'):
         SELECT sourceid
         FROM ospoimportsources
         WHERE sourcename = %s;"""
-    unchecked_query = """
-        SELECT doi
-        FROM publications AS pub
-        WHERE 
-        NOT pub.publicationid = ANY(
-            (SELECT publicationid FROM uwpublications WHERE sourceid = %s));"""
     with conn.cursor() as cur:
         cur.execute(valid_source, (source,))
         sourceid = cur.fetchone()
-        if sourceid is None:
-            print('Not a valid source.')
-            return None
-        cur.execute(unchecked_query, sourceid)
-        dois = cur.fetchall()
-    for i in dois:
-        uw_publication_check(conn, i[0], add_valid = True, add_invalid = True)
+    if sourceid is None:
+        print('Not a valid source.')
+        return None
+    for chunk in iter_unchecked_pubs(conn, sourceid[0], chunk_size = chunk_size):
+        uw_publication_check_batch(conn, [i[1] for i in chunk], add_valid = True, add_invalid = True,
+                                   batch_size = batch_size)
 
 def uw_validate_owners(conn, owner, relation = 'UW Person', add_repos = True, auth = None):
     """_Assign a repository owner to a UW affiliation._
@@ -127,8 +270,7 @@ def uw_validate_owners(conn, owner, relation = 'UW Person', add_repos = True, au
         auth = os.getenv('GITHUB_TOKEN')
         if auth is None:
             return False
-    G_AUTH = Auth.Token(auth)
-    gi = Github(auth=G_AUTH)
+    gi = github_client(auth)
     if check_owner(conn, owner) is None:
         return False
     uw_user = gi.get_user(owner)
@@ -149,4 +291,137 @@ def uw_validate_owners(conn, owner, relation = 'UW Person', add_repos = True, au
                       ON CONFLICT DO NOTHING;"""
     with conn.cursor() as cur:
         execute_values(cur, insert_query, add_account)
-    conn.commit()
+    commit_db(conn)
+
+@instrument('uw.fetch_owner_repos')
+def fetch_owner_repos(owner, auth = None, session = None, api = GITHUB_API):
+    """_List every public repository of a GitHub user or organization, 100 per page._
+
+    Args:
+        owner (_str_): _A GitHub login._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to None.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _dict_: _The `owner`, its repository `urls`, the number of `pages` requested, the `seconds` taken and any `error`._
+    """
+    if session is None:
+        session = http_session()
+    headers = {'Accept': 'application/vnd.github+json'}
+    if auth is not None:
+        headers['Authorization'] = f'bearer {auth}'
+    start = time.monotonic()
+    output = {'owner': owner, 'urls': [], 'pages': 0, 'seconds': 0, 'error': None}
+    url = f'{api}/users/{owner}/repos?per_page=100&type=owner'
+    try:
+        while url is not None:
+            response = session.get(url, headers=headers, timeout=30)
+            output['pages'] = output['pages'] + 1
+            response.raise_for_status()
+            output['urls'].extend([i.get('html_url') for i in response.json()])
+            url = response.links.get('next', {}).get('url')
+    except requests.exceptions.RequestException as e:
+        output['error'] = str(e)
+    output['seconds'] = time.monotonic() - start
+    return output
+
+def discover_owner_repos(owners, auth = None, workers = 8, session = None, api = GITHUB_API):
+    """_Fetch the repository lists of many owners concurrently._
+
+    Args:
+        owners (_list_): _GitHub logins._
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        workers (int, optional): _The number of owners fetched at once._ Defaults to 8.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+
+    Returns:
+        _list_: _One `fetch_owner_repos()` result per owner._
+    """
+    if auth is None:
+        auth = os.getenv('GITHUB_TOKEN')
+    if session is None:
+        session = http_session(workers = workers)
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(lambda x: fetch_owner_repos(x, auth, session, api),
+                                 list(dict.fromkeys(owners))))
+
+def uw_validate_owners_bulk(conn, owners, relation = 'UW Person', add_repos = True, auth = None,
+                            workers = 8, session = None, api = GITHUB_API, verbose = True):
+    """_Assign many repository owners, and all of their repositories, to a UW affiliation._
+
+    The bulk version of `uw_validate_owners()`. Owners' repository lists are fetched
+    concurrently, then new repositories, their owners and the `uwrepositories` links
+    are written with set-based statements in a single transaction.
+
+    Args:
+        conn (_connection_): _A valid psycopg2 connection object._
+        owners (_list_): _GitHub logins already present in `repositoryowners`._
+        relation (str, optional): _A valid `uwrelations` relation._ Defaults to 'UW Person'.
+        add_repos (bool, optional): _Should owners' repositories missing from the database be added?_ Defaults to True.
+        auth (_str_, optional): _A valid GitHub authorization token._ Defaults to the `GITHUB_TOKEN` environment variable.
+        workers (int, optional): _The number of owners fetched at once._ Defaults to 8.
+        session (_requests.Session_, optional): _A pooled session to reuse._ Defaults to None.
+        api (_str_, optional): _The GitHub REST API root._ Defaults to GITHUB_API.
+        verbose (bool, optional): _Should the function print per-owner timing?_ Defaults to True.
+
+    Returns:
+        _list_: _Per-owner results from `fetch_owner_repos()`, with the number of `linked` repositories. Empty if the relation is not valid._
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT uwrelationid FROM uwrelations WHERE uwrelation = %s",
+                    (relation,))
+        uwrelationid = cur.fetchone()
+        cur.execute("SELECT ownername, ownerid FROM repositoryowners WHERE ownername = ANY(%s)",
+                    (list(owners),))
+        owner_ids = dict(cur.fetchall())
+    if uwrelationid is None:
+        return []
+    results = []
+    if add_repos and len(owner_ids) > 0:
+        results = discover_owner_repos(list(owner_ids.keys()), auth = auth, workers = workers,
+                                       session = session, api = api)
+    else:
+        results = [{'owner': i, 'urls': [], 'pages': 0, 'seconds': 0, 'error': None}
+                   for i in owner_ids]
+    set_owner = """
+        UPDATE repositories AS rp
+        SET ownerid = v.ownerid
+        FROM (VALUES %s) AS v(repositoryid, ownerid)
+        WHERE rp.repositoryid = v.repositoryid AND rp.ownerid IS NULL;"""
+    link_repos = """
+        INSERT INTO uwrepositories (repositoryid, uwrelationid)
+        SELECT rp.repositoryid, %s
+        FROM repositories AS rp
+        INNER JOIN repositoryowners AS ro ON rp.ownerid = ro.ownerid
+        WHERE ro.ownername = ANY(%s)
+        ON CONFLICT DO NOTHING;"""
+    owner_repos = """
+        SELECT ro.ownername, COUNT(*)
+        FROM repositories AS rp
+        INNER JOIN repositoryowners AS ro ON rp.ownerid = ro.ownerid
+        WHERE ro.ownername = ANY(%s)
+        GROUP BY ro.ownername;"""
+    with batch(conn):
+        urls = list(itertools.chain.from_iterable([i['urls'] for i in results]))
+        repo_ids = bulk_add_repos(conn, urls, None) if len(urls) > 0 else {}
+        owned = []
+        for result in results:
+            for url in result['urls']:
+                repositoryid = repo_ids.get(clean_repo_name(url))
+                if repositoryid is not None:
+                    owned.append((repositoryid, owner_ids[result['owner']]))
+        with conn.cursor() as cur:
+            if len(owned) > 0:
+                execute_values(cur, set_owner, owned)
+            cur.execute(link_repos, (uwrelationid[0], list(owner_ids.keys())))
+            cur.execute(owner_repos, (list(owner_ids.keys()),))
+            linked = dict(cur.fetchall())
+    for result in results:
+        result['linked'] = linked.get(result['owner'], 0)
+        if verbose:
+            status = f"failed: {result['error']}" if result['error'] else f"{len(result['urls'])} repositories"
+            print(f"{result['owner']}: {status}, {result['pages']} pages in {result['seconds']:.2f}s, "
+                  + f"{result['linked']} linked.")
+    return results
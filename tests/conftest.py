@@ -0,0 +1,38 @@
+"""_Shared fixtures: the stub API server from `benchmarks/` and, when one is configured, a throwaway database._"""
+
+import os
+import json
+import pytest
+import dotenv
+import psycopg2
+from stubserver import StubServer, redirect_hosts
+from benchdb import bench_connection
+import gddospo.ospo_blob_tools as gdb
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """_A stub GitHub, CrossRef, xDD and DataCite server that every `requests` call is sent to._"""
+    # Requests never leave the machine, but the helpers insist on a token.
+    monkeypatch.setenv('GITHUB_TOKEN', 'test-token')
+    server = StubServer().start()
+    try:
+        with redirect_hosts(server):
+            yield server
+    finally:
+        server.stop()
+
+
+@pytest.fixture
+def conn():
+    """_A connection to a freshly loaded `ospo_test` schema, skipped unless OSDB_BENCH_CONNECT is set._"""
+    dotenv.load_dotenv()
+    if os.getenv('OSDB_BENCH_CONNECT') is None:
+        pytest.skip('Set OSDB_BENCH_CONNECT to run the database tests.')
+    try:
+        psycopg2.connect(**json.loads(os.getenv('OSDB_BENCH_CONNECT')), connect_timeout = 5).close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'Could not connect to the test database: {e}')
+    with bench_connection(schema = 'ospo_test') as connection:
+        gdb.create_blob_tables(connection)
+        yield connection
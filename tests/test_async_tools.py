@@ -0,0 +1,136 @@
+import json
+import time
+import asyncio
+import datetime
+import email.utils
+import threading
+import requests
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import gddospo.ospo_db_tools as gdo
+import gddospo.ospo_async_tools as gda
+from stubserver import load_fixture
+
+
+def make_response(status, headers = None, text = ''):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = text.encode('utf-8')
+    return response
+
+
+class SequenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server = self.server
+        with server.lock:
+            status, headers, body = server.responses.pop(0) if len(server.responses) > 1 else server.responses[0]
+            server.requests = server.requests + 1
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('X-RateLimit-Remaining', '4999')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def graphql():
+    """_A local GraphQL endpoint that answers with `server.responses` in turn, repeating the last one._"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SequenceHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.responses = []
+    server.requests = 0
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    server.endpoint = f'http://127.0.0.1:{server.server_address[1]}/graphql'
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def crawl_body(*names):
+    data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2030-01-01T00:00:00Z'}}
+    for i, name in enumerate(names):
+        data[f'r{i}'] = json.loads(load_fixture('github_graphql_repo.json').replace('neotoma2', name))
+    return {'data': data}
+
+
+def test_secondary_limit_delay_reads_seconds_and_dates():
+    assert gda.secondary_limit_delay(make_response(429, {'Retry-After': '7'}), 0) == 7
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds = 120)
+    delay = gda.secondary_limit_delay(make_response(403, {'Retry-After': email.utils.format_datetime(later, usegmt = True)}), 0)
+    assert 110 < delay <= 120
+    reset = str(int(time.time()) + 30)
+    delay = gda.secondary_limit_delay(make_response(403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}), 0)
+    assert 25 < delay <= 30
+
+
+def test_secondary_limit_delay_backs_off_and_fails_fast():
+    secondary = make_response(403, text = '{"message": "You have exceeded a secondary rate limit."}')
+    assert gda.secondary_limit_delay(secondary, 0) == 60
+    assert gda.secondary_limit_delay(secondary, 2) == 240
+    assert gda.secondary_limit_delay(make_response(403, text = '{"message": "Bad credentials"}'), 0) is None
+    assert gda.secondary_limit_delay(make_response(502), 0) is None
+
+
+def test_rate_limit_bucket_follows_headers():
+    bucket = gda.RateLimitBucket(rate = 1, capacity = 10)
+    bucket.update({'X-RateLimit-Remaining': '100', 'X-RateLimit-Reset': str(int(time.time()) + 100)})
+    assert bucket.rate == pytest.approx(0.9, rel = 0.05)
+    bucket.update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 100)})
+    assert bucket.tokens == 0
+    assert bucket.paused_until > time.monotonic() + 90
+
+
+def test_rate_limit_bucket_waits_for_tokens():
+    async def take(bucket, n):
+        return [await bucket.acquire() for _ in range(n)]
+    bucket = gda.RateLimitBucket(rate = 20, capacity = 2)
+    waits = asyncio.run(take(bucket, 3))
+    assert waits[0] < 0.01 and waits[1] < 0.01
+    assert waits[2] == pytest.approx(0.05, abs = 0.04)
+
+
+def test_crawl_worker_fails_fast_on_other_403(graphql):
+    graphql.responses = [(403, {}, {'message': 'Bad credentials'})]
+    stats = asyncio.run(gda.run_crawl(None, [(1, 'https://github.com/NeotomaDB/neotoma2')],
+                                      auth = 'test-token', workers = 1, endpoint = graphql.endpoint))
+    assert graphql.requests == 1
+    assert stats.retries == 0
+    assert stats.failures == 1
+
+
+def test_crawl_worker_retries_rate_limits(graphql, conn):
+    urls = ['https://github.com/NeotomaDB/neotoma2', 'https://github.com/NeotomaDB/neotoma3']
+    repos = gdo.bulk_add_repos(conn, urls, 'Bulk Submision OSPO')
+    graphql.responses = [(429, {'Retry-After': '0'}, {'message': 'Slow down'}),
+                         (502, {}, {'message': 'Bad gateway'}),
+                         (200, {}, crawl_body('neotoma2', 'neotoma3'))]
+    stats = asyncio.run(gda.run_crawl(conn, [(repos[i], i) for i in urls],
+                                      auth = 'test-token', workers = 1, endpoint = graphql.endpoint))
+    assert graphql.requests == 3
+    assert stats.retries == 2
+    assert stats.repositories == 2
+    assert stats.failures == 0
+
+
+def test_crawl_worker_gives_up_after_max_retries(graphql):
+    graphql.responses = [(429, {'Retry-After': '0'}, {'message': 'Slow down'})]
+    stats = asyncio.run(gda.run_crawl(None, [(1, 'https://github.com/NeotomaDB/neotoma2')],
+                                      auth = 'test-token', workers = 1, endpoint = graphql.endpoint,
+                                      max_retries = 2))
+    assert graphql.requests == 3
+    assert stats.failures == 1
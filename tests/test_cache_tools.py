@@ -0,0 +1,36 @@
+import json
+import time
+from gddospo.ospo_crawl_tools import OwnerCache, prepare_repo_batches
+from gddospo.ospo_url_tools import LivenessCache
+
+
+def test_owner_cache_saves_fresh_entries(tmp_path):
+    path = str(tmp_path / 'owners.json')
+    cache = OwnerCache(path)
+    cache.set('NOAA', {'ownername': 'NOAA'})
+    cache.set('gone', None)
+    cache.entries['old'] = {'owner': None, 'checked': time.time() - 2 * cache.ttl}
+    assert 'noaa' in cache and 'gone' in cache and 'old' not in cache
+    cache.save()
+    reloaded = OwnerCache(path)
+    assert reloaded.get('noaa') == {'ownername': 'NOAA'}
+    assert 'gone' in reloaded and reloaded.get('gone') is None
+    with open(path) as cache_file:
+        assert sorted(json.load(cache_file)) == ['gone', 'noaa']
+
+
+def test_liveness_cache_keeps_definitive_answers(tmp_path):
+    cache = LivenessCache(str(tmp_path / 'urls.json'), ttl = 60)
+    cache.set('https://github.com/a/b', {'status': False, 'redirect': None, 'code': 410})
+    cache.set('https://github.com/a/c', {'status': False, 'redirect': None, 'code': None})
+    assert cache.get('https://github.com/a/b')['code'] == 410
+    assert cache.get('https://github.com/a/c') is None
+
+
+def test_non_github_repositories_are_reported_once(capsys):
+    repositories = [(1, 'https://github.com/a/b'), (2, 'https://gitlab.com/a/b'), (3, 'https://bitbucket.org/a/b')]
+    batches = prepare_repo_batches(repositories)
+    assert [[i[0] for i in batch] for batch in batches] == [[1]]
+    assert capsys.readouterr().out.count('\n') == 1
+    prepare_repo_batches(repositories, verbose = False)
+    assert capsys.readouterr().out == ''
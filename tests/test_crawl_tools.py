@@ -0,0 +1,52 @@
+import json
+import datetime
+import gddospo.ospo_db_tools as gdo
+import gddospo.ospo_crawl_tools as gdc
+
+CRAWL_COLUMNS = ['name', 'description', 'homepage', 'last_pushed', 'license_name', 'readmehash',
+                 'stargazers', 'issues', 'openissues', 'forks', 'archived', 'language', 'topics']
+
+
+def test_graphql_crawl_matches_rest(stub, conn):
+    """A REST crawl and a GraphQL crawl of the same recorded repository store the same values."""
+    url = 'https://github.com/NeotomaDB/neotoma2'
+    repositoryid = gdo.bulk_add_repos(conn, [url], 'Bulk Submision OSPO')[url]
+    gdo.update_repo_crawl_db(conn, url, repository_id = repositoryid)
+    assert gdc.update_repo_crawl_batch(conn, [(repositoryid, url)], verbose = False) == [repositoryid]
+    with conn.cursor() as cur:
+        cur.execute(f"""SELECT {', '.join(CRAWL_COLUMNS)}
+                        FROM repositorycrawls
+                        WHERE repositoryid = %s
+                        ORDER BY repositorycrawlid;""", (repositoryid,))
+        rest, graphql = cur.fetchall()
+    assert dict(zip(CRAWL_COLUMNS, graphql)) == dict(zip(CRAWL_COLUMNS, rest))
+    assert rest[CRAWL_COLUMNS.index('readmehash')] is not None
+
+
+def test_readme_path_follows_github_order():
+    """`.github/` wins over the root, the root over `docs/`, and any capitalization counts."""
+    def tree(*names):
+        return {'entries': [{'name': i, 'type': 'blob'} for i in names]}
+    assert gdc.graphql_readme_path({'readmeFolder1': tree('LICENSE', 'README.md')}) == 'README.md'
+    assert gdc.graphql_readme_path({'readmeFolder0': tree('readme.md'),
+                                    'readmeFolder1': tree('README.md')}) == '.github/readme.md'
+    assert gdc.graphql_readme_path({'readmeFolder1': tree('ReadMe.MarkDown')}) == 'ReadMe.MarkDown'
+    assert gdc.graphql_readme_path({'readmeFolder1': tree('READMEFIRST'),
+                                    'readmeFolder2': tree('README.rst')}) == 'docs/README.rst'
+    assert gdc.graphql_readme_path({'readmeFolder1': {'entries': [{'name': 'readme', 'type': 'tree'}]}}) is None
+
+
+def test_readme_under_other_spelling_is_fetched(stub):
+    """A README the crawl did not ask for by name is fetched with one more request."""
+    node = json.loads(stub.fixtures['github_graphql_repo.json'])
+    node['readme1'] = None
+    for entry in node['readmeFolder1']['entries']:
+        if entry['name'] == 'README.md':
+            entry['name'] = 'ReadMe.MD'
+    stub.fixtures['github_graphql_repo.json'] = json.dumps(node)
+    stub.reset_counts()
+    result = gdc.fetch_repo_batch([('NeotomaDB', 'neotoma2')])
+    assert stub.calls == {'api.github.com': 2}
+    values = gdc.graphql_crawl_values(1, result['data']['r0'], datetime.datetime.now())
+    assert values['readme'] == stub.readme('NeotomaDB').encode('utf-8')
+    assert 'readme' not in json.loads(values['raw'])
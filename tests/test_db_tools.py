@@ -0,0 +1,50 @@
+import pytest
+import gddospo.ospo_db_tools as gdo
+
+
+def repository_urls(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT url FROM repositories ORDER BY url;")
+        return [i[0] for i in cur.fetchall()]
+
+
+def test_rollback_in_a_record_stops_the_record(conn):
+    reached = []
+    with gdo.batch(conn):
+        with gdo.record(conn, verbose = False):
+            gdo.insert_repository_db(conn, 'https://github.com/kept/repo', verbose = False, crawl = False)
+        with gdo.record(conn, verbose = False):
+            gdo.insert_repository_db(conn, 'https://github.com/dropped/repo', verbose = False, crawl = False)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1 / 0;")
+            except Exception:
+                gdo.rollback_db(conn)
+            reached.append(True)
+    assert reached == []
+    assert repository_urls(conn) == ['https://github.com/kept/repo']
+
+
+def test_rollback_outside_a_batch_does_not_raise(conn):
+    gdo.insert_repository_db(conn, 'https://github.com/kept/repo', verbose = False, crawl = False)
+    with pytest.raises(Exception):
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 / 0;")
+    gdo.rollback_db(conn)
+    assert repository_urls(conn) == ['https://github.com/kept/repo']
+
+
+def test_missing_repository_is_recorded_in_a_record(conn, monkeypatch):
+    monkeypatch.setattr(gdo, 'check_repository_url', lambda repo: {'status': False})
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO ospoimportsources (sourcename) VALUES ('Test Source') ON CONFLICT DO NOTHING;")
+    conn.commit()
+    with gdo.batch(conn):
+        with gdo.record(conn):
+            result = gdo.add_repo_db(conn, 'github.com/gone/repo', 'Test Source', verbose = False, crawl = False)
+    assert result is None
+    with conn.cursor() as cur:
+        cur.execute("""SELECT repo.url, rqc.badstatus
+                       FROM repoqualitychecks AS rqc
+                       JOIN repositories AS repo ON repo.repositoryid = rqc.repositoryid;""")
+        assert cur.fetchall() == [('https://github.com/gone/repo', 404)]
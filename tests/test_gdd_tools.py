@@ -0,0 +1,54 @@
+import gddospo.gdd_tools as gdt
+
+
+def test_extract_repositories_keeps_case_and_cleans_names():
+    assert gdt.extract_repositories('See https://GitHub.com/NeotomaDB/Neotoma2.git.') == ['github.com/NeotomaDB/Neotoma2']
+    assert gdt.extract_repositories('www.bitbucket.org/owner/repo.name) and github.com/owner') == \
+        ['bitbucket.org/owner/repo.name', 'github.com/owner']
+    assert gdt.extract_repositories('GITHUB.COM/X/Y github.com/X/Y') == ['github.com/X/Y']
+    assert gdt.extract_repositories('no repositories here') == []
+
+
+def test_extract_repositories_joins_hyphenated_line_breaks():
+    text = 'code at github.com/my-\n  project/the-\n tool, and gitlab.com/a/b'
+    assert gdt.extract_repositories(text) == ['github.com/my-project/the-tool', 'gitlab.com/a/b']
+
+
+def test_extract_repositories_batch_matches_one_at_a_time():
+    highlights = ['github.com/a/b', 'nothing', 'gitlab.com/c/d and github.com/a/b', '', 'İstanbul github.com/e/f']
+    assert gdt.extract_repositories_batch(highlights) == [gdt.extract_repositories(i) for i in highlights]
+
+
+def test_extract_page_repositories(stub):
+    page = gdt.get_snippet_page(gdt.GDD_SNIPPETS)
+    matches = gdt.extract_page_repositories(page['data'])
+    assert len(matches) == len(page['data'])
+    for paper, repos in zip(page['data'], matches):
+        assert repos == [gdt.extract_repositories(i) for i in paper['highlight']]
+    assert any(any(i) for i in matches)
+
+
+def test_harvest_resumes_from_checkpoint(stub, tmp_path):
+    stub.pages = 3
+    stub.per_page = 5
+    path = str(tmp_path / 'checkpoint.json')
+    # Stop while the second page is being processed, as a crash would.
+    seen = []
+    for page in gdt.harvest_snippets(checkpoint = gdt.HarvestCheckpoint(path)):
+        seen.append([i['doi'] for i in page['data']])
+        if len(seen) == 2:
+            break
+    checkpoint = gdt.HarvestCheckpoint(path)
+    assert checkpoint.state['pages'] == 1
+    assert checkpoint.state['papers'] == 5
+    assert not checkpoint.state['done']
+    resumed = [[i['doi'] for i in page['data']] for page in gdt.harvest_snippets(checkpoint = checkpoint)]
+    assert resumed == [seen[1], [f'10.5555/xdd.2.{i}' for i in range(5)]]
+    assert checkpoint.state == gdt.HarvestCheckpoint(path).state
+    assert checkpoint.state['pages'] == 3
+    assert checkpoint.state['papers'] == 15
+    assert checkpoint.state['done']
+    # A finished harvest starts again from the first page.
+    again = [[i['doi'] for i in page['data']] for page in gdt.harvest_snippets(checkpoint = checkpoint)]
+    assert again[0] == seen[0]
+    assert len(again) == 3
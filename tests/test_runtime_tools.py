@@ -0,0 +1,23 @@
+import gddospo.ospo_runtime_tools as gdr
+import gddospo.ospo_url_tools as gdu
+import gddospo.ospo_crossref_tools as gdx
+
+
+def test_http_session_grows_its_pool_and_closes_the_old_one(monkeypatch):
+    closed = []
+    session = gdr.http_session('test-grow', workers = 2)
+    old = session.adapters['https://']
+    monkeypatch.setattr(old, 'close', lambda: closed.append(old))
+    assert gdr.http_session('test-grow', workers = 1) is session
+    assert session.adapters['https://'] is old
+    assert gdr.http_session('test-grow', workers = 8) is session
+    assert session.adapters['https://'] is not old
+    assert session.adapters['https://']._pool_maxsize == 8
+    assert closed == [old]
+
+
+def test_helper_sessions_are_shared():
+    assert gdu.url_session(4) is gdr.http_session('url')
+    session = gdx.crossref_session(2, mailto = 'someone@example.org')
+    assert session is gdr.http_session('crossref')
+    assert session.headers['User-Agent'].endswith('(mailto:someone@example.org)')
@@ -0,0 +1,32 @@
+import datetime
+import gddospo.ospo_schedule_tools as gdsc
+
+NOW = datetime.datetime(2024, 6, 1)
+
+
+def crawled(repositoryid, last_crawl, first_crawl, crawls, changes, last_change = None):
+    signals = gdsc.new_signals(repositoryid)
+    signals.update({'first_crawl': NOW - datetime.timedelta(days = first_crawl),
+                    'last_crawl': NOW - datetime.timedelta(days = last_crawl),
+                    'crawls': crawls, 'changes': changes,
+                    'last_change': None if last_change is None else NOW - datetime.timedelta(days = last_change)})
+    return signals
+
+
+def test_budget_only_brings_forward_likely_changes():
+    signals = [gdsc.new_signals(1),
+               # Changes daily and was crawled most of a day ago: due within the horizon.
+               crawled(2, 0.9, 60, 60, 59, last_change = 0.9),
+               # Crawled an hour ago after months without a change.
+               crawled(3, 1 / 24, 180, 12, 0),
+               # Quiet for a month, not due for weeks.
+               crawled(4, 2, 120, 10, 1, last_change = 30)]
+    chosen = [i['repositoryid'] for i in gdsc.rank_crawls(signals, NOW, budget = 5000)]
+    assert chosen == [1, 2]
+    assert [i['repositoryid'] for i in gdsc.rank_crawls(signals, NOW)] == [1]
+
+
+def test_budget_keeps_the_highest_priorities():
+    signals = [crawled(i, 2, 60, 60, 59, last_change = 2) for i in range(10)] + [gdsc.new_signals(10)]
+    chosen = gdsc.rank_crawls(signals, NOW, budget = 3)
+    assert len(chosen) == 3 and chosen[0]['repositoryid'] == 10
@@ -0,0 +1,20 @@
+import gddospo.ospo_db_tools as gdo
+import gddospo.ospo_url_tools as gdu
+
+
+def test_gone_repositories_are_recorded_like_missing_ones(conn, monkeypatch):
+    urls = ['https://github.com/a/missing', 'https://github.com/a/gone',
+            'https://github.com/a/moved', 'https://github.com/a/fine']
+    results = {urls[0]: {'status': False, 'redirect': None, 'code': 404},
+               urls[1]: {'status': False, 'redirect': None, 'code': 410},
+               urls[2]: {'status': True, 'redirect': 'https://github.com/b/moved', 'code': 200},
+               urls[3]: {'status': True, 'redirect': None, 'code': 200}}
+    monkeypatch.setattr(gdu, 'check_repository_urls', lambda urls, **kwargs: {i: results[i] for i in urls})
+    repositories = gdo.bulk_add_repos(conn, urls, None)
+    gdu.check_repository_urls_db(conn, repositories, verbose = False)
+    with conn.cursor() as cur:
+        cur.execute("""SELECT repo.url, rqc.badstatus, rqc.url
+                       FROM repoqualitychecks AS rqc
+                       JOIN repositories AS repo ON repo.repositoryid = rqc.repositoryid;""")
+        assert sorted(cur.fetchall()) == [(urls[1], 410, None), (urls[0], 404, None),
+                                          (urls[2], 301, 'https://github.com/b/moved')]
@@ -0,0 +1,47 @@
+import json
+import bench_unchecked_pubs
+import gddospo.ospo_uw_tools as gdu
+
+DOIS = ['10.5334/OQ.41', 'https://doi.org/10.5555/elsewhere.1', '10.5555/unknown.1', '10.5555/with,comma']
+
+
+def test_openalex_works_batch_matches_records_to_dois(stub):
+    records = gdu.openalex_works_batch(DOIS)
+    assert sorted(records) == sorted([DOIS[0], DOIS[1], DOIS[3]])
+    assert records[DOIS[0]]['doi'] == 'https://doi.org/10.5334/oq.41'
+    # One filter request for three DOIs, one lookup for the DOI with a comma.
+    assert stub.calls == {'api.openalex.org': 2}
+
+
+def test_uw_publication_check_batch_records_each_publication_once(stub, conn):
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO publications (doi) SELECT unnest(%s);", (DOIS,))
+    conn.commit()
+    results = gdu.uw_publication_check_batch(conn, DOIS, verbose = False)
+    assert results == {DOIS[0]: True, DOIS[1]: False, DOIS[3]: True}
+    assert gdu.uw_publication_check_batch(conn, DOIS, verbose = False) == results
+    with conn.cursor() as cur:
+        cur.execute("""SELECT pub.doi, uwp.valid
+                       FROM uwpublications AS uwp
+                       JOIN publications AS pub ON pub.publicationid = uwp.publicationid;""")
+        rows = cur.fetchall()
+    assert sorted(rows) == sorted(results.items())
+
+
+def test_unchecked_query_runs_as_anti_join(conn):
+    """`UNCHECKED_QUERY` must plan as an anti-join, not a subplan run for every publication."""
+    sourceid = bench_unchecked_pubs.seed(conn, 5000, 0.8)
+    gdu.create_uw_indexes(conn)
+    with conn.cursor() as cur:
+        cur.execute("SET work_mem = '64kB';")
+        cur.execute("EXPLAIN (FORMAT JSON) " + gdu.UNCHECKED_QUERY, (sourceid,))
+        plan = cur.fetchone()[0]
+        cur.execute(gdu.UNCHECKED_QUERY, (sourceid,))
+        unchecked = cur.fetchall()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = list(bench_unchecked_pubs.plan_nodes(plan[0]['Plan']))
+    assert any(node.startswith('Anti') for node, _ in nodes)
+    assert all(name is None for _, name in nodes)
+    streamed = [j for i in gdu.iter_unchecked_pubs(conn, sourceid, chunk_size = 300) for j in i]
+    assert streamed == unchecked
@@ -8,15 +8,12 @@ import datetime
 import gddospo.ospo_db_tools as gdo
 import gddospo.gdd_tools as gdt
 import gddospo.ospo_uw_tools as gdw
-from github import Github
-from github import Auth
+import gddospo.ospo_runtime_tools as gdr
 from github.GithubException import UnknownObjectException
 
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
+conn = gdr.get_connection()
 
 query = """
     SELECT rp.*
@@ -31,8 +28,7 @@ with conn.cursor() as cur:
     repos = cur.fetchall()
 
 auth = os.getenv('GITHUB_TOKEN')
-G_AUTH = Auth.Token(auth)
-gi = Github(auth=G_AUTH)
+gi = gdr.github_client(auth)
 
 for i in repos:
     repo_name = gdo.clean_repo_name(i[1])
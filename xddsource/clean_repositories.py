@@ -8,11 +8,10 @@ import datetime
 import gddospo.ospo_db_tools as gdo
 import gddospo.gdd_tools as gdt
 import gddospo.ospo_uw_tools as gdw
+import gddospo.ospo_runtime_tools as gdr
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
+conn = gdr.get_connection()
 
 repos = gdo.get_repository_urls(conn)
 dirty_names = [i[0] for i in repos if i[0] != gdo.clean_repo_name(i[0])]
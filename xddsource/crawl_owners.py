@@ -11,18 +11,18 @@ import datetime
 import gddospo.ospo_db_tools as gdo
 import gddospo.gdd_tools as gdt
 import gddospo.ospo_uw_tools as gdw
+import gddospo.ospo_crawl_tools as gdc
+import gddospo.ospo_runtime_tools as gdr
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
+conn = gdr.get_connection()
 
 repos = gdo.get_repository_urls(conn)
 
 #for i in repos:
 #    gdo.update_repo_name_db(conn, i[0])
 
-unscanned_queries = """SELECT DISTINCT url
+unscanned_queries = """SELECT DISTINCT rp.repositoryid, url
                        FROM repositories AS rp
                        LEFT JOIN repositoryowners AS rpo ON rpo.ownerid = rp.ownerid
                        WHERE rp.url ILIKE '%github%' AND rpo.managerid IS NULL;"""
@@ -30,13 +30,9 @@ with conn.cursor() as cur:
     cur.execute(unscanned_queries)
     repos = cur.fetchall()
 
-for i in repos:
-    try:
-        gdo.update_repo_add_owner(conn, i[0])
-        print(i[0])
-    except Exception as e:
-        conn.rollback()
-        print(f"Error for {i[0]}\nException: {e}")
+# Each owner is fetched once (and cached for a week), however many repositories it has.
+owner_cache = gdc.OwnerCache('../source_data/owner_cache.json')
+gdc.resolve_repo_owners(conn, repos, cache = owner_cache)
 
 uw_owners = """SELECT DISTINCT rpo.ownername
                FROM repositories AS rp
@@ -46,9 +42,10 @@ with conn.cursor() as cur:
     cur.execute(uw_owners)
     owners = cur.fetchall()
 
-for i in owners:
-    gdw.uw_validate_owners(conn,
-                           owner = i[0],
-                           relation = 'UW Person',
-                           add_repos = True,
-                           auth = None)
+# Owners' repository lists are fetched concurrently and written in one transaction.
+gdw.uw_validate_owners_bulk(conn,
+                            owners = [i[0] for i in owners],
+                            relation = 'UW Person',
+                            add_repos = True,
+                            auth = None,
+                            workers = 8)
@@ -10,31 +10,39 @@ import psycopg2
 import datetime
 import gddospo.ospo_db_tools as gdo
 import gddospo.gdd_tools as gdt
+import gddospo.ospo_crawl_tools as gdc
+import gddospo.ospo_async_tools as gda
+import gddospo.ospo_schedule_tools as gdsc
+import gddospo.ospo_blob_tools as gdb
+import gddospo.ospo_partition_tools as gdp
+import gddospo.ospo_runtime_tools as gdr
+import gddospo.ospo_metrics_tools as gdm
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
+conn = gdr.get_connection()
 
 repos = gdo.get_repository_urls(conn)
 
 #for i in repos:
 #    gdo.update_repo_name_db(conn, i[0])
 
-unscanned_queries = """SELECT url
-                       FROM repositories AS rp
-                       LEFT JOIN repositorycrawls AS rpc ON rp.repositoryid = rpc.repositoryid
-                       WHERE rpc.crawl_at < LOCALTIMESTAMP - INTERVAL '2 week';"""
-
-with conn.cursor() as cur:
-    cur.execute(unscanned_queries)
-    repos = cur.fetchall()
-
-for i in repos:
-    try:
-        gdo.update_repo_crawl_db(conn, i[0])
-        # gdo.update_repo_add_owner(conn, i[0])
-        print(i[0])
-    except Exception as e:
-        conn.rollback()
-        print(f"Error for {i[0]}\nException: {e}")
+gdc.create_crawl_indexes(conn)
+gdc.create_validator_table(conn)
+gdb.create_blob_tables(conn)
+# Once `partition_crawls.py` has run, crawls need a partition for the current month.
+gdp.ensure_crawl_partitions(conn)
+# Active repositories are crawled as often as daily, dormant and archived ones back off
+# to every 90 days; `simulate_schedule.py` compares this with the flat two week interval.
+repos = gdsc.plan_adaptive_crawls(conn, budget = 5000)
+gdm.count_records(len(repos))
+repos = gdc.filter_changed_repos(conn, repos)
+
+try:
+    crawl_summary = gda.crawl_repositories(conn, repos, batch_size = 50, workers = 4)
+    print(json.dumps(crawl_summary, indent = 2))
+except Exception as e:
+    conn.rollback()
+    print(f"Error crawling repositories\nException: {e}")
+
+# Set OSPO_METRICS=1 to collect timings, round-trips and API calls for the run.
+gdm.write_summary(json_path = 'crawl_metrics.json', prometheus_path = 'crawl_metrics.prom')
@@ -3,13 +3,14 @@ import json
 import os
 import re
 import psycopg2
+from psycopg2.extras import execute_values
 import pyarrow.parquet as pq
 import gddospo.ospo_db_tools as gdo
+import gddospo.ospo_url_tools as gdu
+import gddospo.ospo_runtime_tools as gdr
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-conn_dict['port'] = 5432
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
+conn = gdr.get_connection(port = 5432)
 
 repos = pq.read_table('../source_data/repo.parquet').to_pylist()
 
@@ -24,16 +25,18 @@ for i in ownerset:
 conn.commit()
 
 # Add repos:
-for i in repos:
-    i['url'] = re.sub('\.git$', '', i.get('url'))
-    repositoryid = gdo.add_repo_db(conn, i.get('url'), 'Bulk Submision OSPO')
-    with conn.cursor() as cur:
-        try:
-            cur.execute("""INSERT INTO uwrepositories (repositoryid, uwrelationid) VALUES
-                            (%s, (SELECT uwrelationid FROM uwrelations WHERE uwrelation = 'Keyword Search'))
-                            ON CONFLICT DO NOTHING;""",
-                        (repositoryid,))
-            conn.commit()
-        except Exception as e:
-            print(f"Error: {e}")
-            conn.rollback()
+repo_urls = [re.sub(r'\.git$', '', i.get('url')) for i in repos]
+repositoryids = gdo.bulk_add_repos(conn, repo_urls, 'Bulk Submision OSPO')
+gdu.check_repository_urls_db(conn, repositoryids,
+                             cache = gdu.LivenessCache('../source_data/liveness_cache.json'))
+with conn.cursor() as cur:
+    try:
+        execute_values(cur,
+                       """INSERT INTO uwrepositories (repositoryid, uwrelationid) VALUES %s
+                          ON CONFLICT DO NOTHING;""",
+                       [(i,) for i in repositoryids.values()],
+                       template = "(%s, (SELECT uwrelationid FROM uwrelations WHERE uwrelation = 'Keyword Search'))")
+        conn.commit()
+    except Exception as e:
+        print(f"Error: {e}")
+        conn.rollback()
@@ -14,55 +14,53 @@ import psycopg2
 import datetime
 import gddospo.ospo_db_tools as gdo
 import gddospo.gdd_tools as gdt
+import gddospo.ospo_cache_tools as gdch
+import gddospo.ospo_queue_tools as gdq
+import gddospo.ospo_runtime_tools as gdr
+import gddospo.ospo_metrics_tools as gdm
 import pandas as pd
 import json
 
 dotenv.load_dotenv()
-conn_dict = json.loads(os.getenv('OSDB_CONNECT'))
-
-conn = psycopg2.connect(**conn_dict, connect_timeout=5)
-
-pausetime = 2
-
-thing = 0
-maxhits = 0
+conn = gdr.get_connection()
+cache = gdch.LookupCache.load(conn)
+gdq.create_queue_tables(conn)
 
 # This will generate a large-ish number of papers and grants.
-gddurl = ("https://geodeepdive.org/api/v1/snippets?"
-          + "term=gitlab.com,bitbucket.com,github.com"
-          + "&clean&full_results")
+gddurl = gdt.GDD_SNIPPETS
 
-hits = True
-paperCt = 0
+# An interrupted harvest resumes from gdd_checkpoint.json; a finished one starts again
+# from the first page. Delete the file to restart an unfinished harvest.
+checkpoint = gdt.HarvestCheckpoint('gdd_checkpoint.json')
 
-resultset = {'good':[], 'bad':[]}
+for page in gdt.harvest_snippets(gddurl, checkpoint = checkpoint):
+    print('Have run ' + str(checkpoint.state['papers'])
+          + ' papers, looking for ' + str(page.get('hits')))
+    data = page['data']
+    known = gdo.check_publications_db(conn, [i['doi'] for i in data], cache = cache)
+    page_repos = gdt.extract_page_repositories(data)
+    new_dois = []
+    new_repos = []
+    gdm.count_records(len(data))
+    for papers, repohit in zip(data, page_repos):
+        if papers['doi'] not in known:
+            print("Running " + papers['doi'])
+            if any(repohit):
+                outcome = gdo.process_gdd_hit(conn, papers['doi'], papers['highlight'],
+                                              cache = cache, matches = repohit,
+                                              enrich = False, crawl = False)
+                new_dois.append(papers['doi'])
+                new_repos.extend([i for j in repohit for i in j])
+                if outcome is not None:
+                    with open('failed_extract.json', 'a') as fe:
+                        fe.write(json.dumps(outcome) + '\n')
+    # Crawls, CrossRef metadata and the OpenAlex check for University of Wisconsin
+    # authors are left to the workers in `queue_worker.py`.
+    gdq.enqueue_repository_urls(conn, new_repos, jobtypes = ['crawl'])
+    gdq.enqueue_publications(conn, new_dois, jobtypes = ['crossref', 'openalex'])
 
-while hits:
-    print('Have run ' + str(paperCt)
-          + ' papers, looking for ' + str(maxhits))
-    try:
-        results = requests.get(gddurl)
-    except requests.exceptions.MissingSchema:
-        break
-    if results.status_code == 200:
-        output = results.json()
-        gddurl = output.get('success').get('next_page')
-        maxhits = output.get('success').get('hits')
-        if len(output.get('success').get('data')) > 0:
-            data = output['success']['data']
-            for papers in data:
-                if gdo.check_publication_db(conn, papers['doi']) is None:
-                    print("Running " + papers['doi'])
-                    repohits = map(lambda x: gdt.repotest(x), papers['highlight'])
-                    repohit = list(repohits)
-                    if any(repohit):
-                        outcome = gdo.process_gdd_hit(conn, papers['doi'], papers['highlight'])
-                        if outcome is not None:
-                            with open('failed_extract.json', 'a') as fe:
-                                fe.write(json.dumps(outcome) + '\n')
-                paperCt = paperCt + 1
-        else:
-            break
+# Set OSPO_METRICS=1 to collect timings, round-trips and API calls for the run.
+gdm.write_summary(json_path = 'gdd_metrics.json', prometheus_path = 'gdd_metrics.prom')
 
 df = pd.read_json('failed_extract.json', lines=True)
 
@@ -0,0 +1,21 @@
+"""_Move the README and raw payloads of existing crawls into the deduplicated `crawlblobs` table._
+
+Runs in batches, each its own transaction, so it can run alongside the crawlers
+and be stopped and restarted. Pass the batch size as the first argument.
+"""
+
+import sys
+import json
+import dotenv
+import gddospo.ospo_blob_tools as gdb
+import gddospo.ospo_runtime_tools as gdr
+
+dotenv.load_dotenv()
+conn = gdr.get_connection()
+
+gdb.create_blob_tables(conn)
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+summary = gdb.migrate_crawl_blobs(conn, batch_size = batch_size)
+print(json.dumps(summary, indent = 2))
+print(json.dumps(gdb.blob_storage_summary(conn), indent = 2))
+# The freed space is reused by new rows; VACUUM FULL repositorycrawls returns it to the disk.
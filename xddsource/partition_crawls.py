@@ -0,0 +1,24 @@
+"""_Partition `repositorycrawls` by month and downsample crawl history past the retention window._
+
+The first run moves the table into monthly partitions online (the crawlers can
+keep running). Every run then reduces months older than the retention window
+(first argument, in months; default 6) to one crawl per repository per month and
+deletes the README and raw blobs no remaining crawl references.
+"""
+
+import sys
+import json
+import dotenv
+import gddospo.ospo_partition_tools as gdp
+import gddospo.ospo_runtime_tools as gdr
+
+dotenv.load_dotenv()
+conn = gdr.get_connection()
+
+keep_months = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+summary = {'partition': gdp.partition_crawls(conn)}
+gdp.ensure_crawl_partitions(conn)
+summary['downsample'] = gdp.downsample_crawls(conn, keep_months = keep_months)
+summary['pruned_blobs'] = gdp.prune_crawl_blobs(conn)
+print(json.dumps(summary, indent = 2))
+# Once satisfied, `DROP TABLE repositorycrawls_unpartitioned;` frees the original table.
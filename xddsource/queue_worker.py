@@ -0,0 +1,33 @@
+"""_Run queued crawl, CrossRef and OpenAlex jobs._
+
+Start as many copies as you like, on any machine that can reach the database:
+
+    python queue_worker.py                  # every job type
+    python queue_worker.py crawl crossref   # only these job types
+"""
+
+import sys
+import json
+import dotenv
+import gddospo.ospo_queue_tools as gdq
+import gddospo.ospo_blob_tools as gdb
+import gddospo.ospo_partition_tools as gdp
+import gddospo.ospo_runtime_tools as gdr
+import gddospo.ospo_metrics_tools as gdm
+
+dotenv.load_dotenv()
+conn = gdr.get_connection()
+gdq.create_queue_tables(conn)
+gdb.create_blob_tables(conn)
+gdp.ensure_crawl_partitions(conn)
+
+jobtypes = sys.argv[1:] if len(sys.argv) > 1 else gdq.JOB_TYPES
+print(json.dumps(gdq.queue_status(conn), indent = 2))
+
+try:
+    # Wait for new jobs when the queue is empty; stop with Ctrl-C.
+    gdq.run_worker(conn, jobtypes = jobtypes, batch_size = 50, poll = 30)
+except KeyboardInterrupt:
+    print(json.dumps(gdq.queue_status(conn), indent = 2))
+
+gdm.write_summary(json_path = 'queue_metrics.json', prometheus_path = 'queue_metrics.prom')
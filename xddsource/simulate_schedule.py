@@ -0,0 +1,35 @@
+"""_Compare crawl schedules by replaying the crawl history stored in the OSPO database._
+
+For each daily budget the flat two week schedule is replayed alongside the
+adaptive schedule from `ospo_schedule_tools`, reporting crawls spent and mean freshness.
+"""
+
+import json
+import dotenv
+import gddospo.ospo_crawl_tools as gdc
+import gddospo.ospo_schedule_tools as gdsc
+import gddospo.ospo_runtime_tools as gdr
+
+dotenv.load_dotenv()
+conn = gdr.get_connection()
+# The history skips `unchanged` markers, so the column must exist.
+gdc.create_validator_table(conn)
+
+history = gdsc.load_crawl_history(conn)
+print(f"Loaded the crawl history of {len(history)} repositories.")
+
+# The flat schedule needs about a fourteenth of the repositories each day.
+budgets = [max(1, round(len(history) * i / 14)) for i in [0.25, 0.5, 1]]
+policies = {'flat (2 weeks)': gdsc.flat_policy(interval = 14),
+            'adaptive': gdsc.adaptive_policy()}
+
+results = []
+for budget in budgets:
+    for name, policy in policies.items():
+        result = dict(gdsc.simulate_policy(history, policy, budget), policy = name, budget = budget)
+        results.append(result)
+        print(f"{name:<16} budget {budget:>7}/day: {result['crawls']:>9} crawls, "
+              f"mean freshness {result['mean_freshness']:.3f}, min {result['min_freshness']:.3f}")
+
+with open('schedule_simulation.json', 'w') as sim_file:
+    json.dump(results, sim_file, indent = 2)
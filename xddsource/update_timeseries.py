@@ -0,0 +1,36 @@
+"""_Bring the star time-series store up to date and report the fastest growing repositories._
+
+Loads `stargazer_history.parquet` (only new stars are written), reads the stars
+added on GitHub since each repository's checkpoint, appends the counts from any
+crawls since the last run, then prints the top 100 UW repositories by
+star growth over the last 90 days.
+"""
+
+import os
+import sys
+import dotenv
+import gddospo.ospo_timeseries_tools as gdts
+import gddospo.ospo_stargazer_tools as gdsg
+import gddospo.ospo_runtime_tools as gdr
+
+dotenv.load_dotenv()
+conn = gdr.get_connection()
+
+store_path = sys.argv[1] if len(sys.argv) > 1 else '../source_data/timeseries'
+store = gdts.TimeSeriesStore(store_path)
+stars = store.import_stargazer_history('../source_data/stargazer_history.parquet')
+repositories = gdts.tracked_repositories(conn)
+
+# Repositories whose latest crawled star count matches their checkpoint cost no requests.
+checkpoints = gdsg.StarCheckpoints(os.path.join(store_path, 'stargazer_checkpoints.json'))
+fetched = gdsg.update_stargazers(store, repositories, checkpoints,
+                                 stargazer_counts = gdsg.latest_stargazer_counts(conn))
+stars = stars + fetched['stars']
+observations = gdts.append_crawl_observations(conn, store)
+print(f"Added {stars} stars and {observations} crawl observations.")
+store.compact('stars')
+store.compact('observations')
+
+growth = store.star_growth(days = 90, repos = repositories, top = 100)
+for row in growth.to_pylist():
+    print(f"{row['stars']:>6}  {row['repo_url']}")